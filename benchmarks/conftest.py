@@ -0,0 +1,34 @@
+# This file is part of parinvoke.
+# Copyright (C) 2020-2023 Boise State University
+# Copyright (C) 2023-2024 Drexel University
+# Licensed under the MIT license, see LICENSE.md for details.
+# SPDX-License-Identifier: MIT
+
+"""
+Benchmarks for parinvoke, using pytest-benchmark.  Run them with::
+
+    pytest benchmarks --benchmark-autosave
+
+and compare against saved runs from earlier commits with
+``--benchmark-compare``.
+"""
+
+from typing import Iterator
+
+from pytest import FixtureRequest, fixture, skip
+
+from parinvoke.context import InvokeContext
+from parinvoke.sharing.binpickle import BPKContext
+from parinvoke.sharing.shm import SHM_AVAILABLE, SHMContext
+
+
+@fixture(params=["shm", "bpk"])
+def persist_context(request: FixtureRequest) -> Iterator[InvokeContext]:
+    if request.param == "shm":
+        if not SHM_AVAILABLE:
+            skip("shared memory not available")
+        with SHMContext() as ctx:
+            yield ctx
+    else:
+        with BPKContext() as ctx:
+            yield ctx
@@ -0,0 +1,88 @@
+# This file is part of parinvoke.
+# Copyright (C) 2020-2023 Boise State University
+# Copyright (C) 2023-2024 Drexel University
+# Licensed under the MIT license, see LICENSE.md for details.
+# SPDX-License-Identifier: MIT
+
+"""
+Benchmarks for invoking operations: pool startup, map throughput, and
+subprocess round trips.
+"""
+
+import os
+
+import numpy as np
+import numpy.typing as npt
+
+from pytest import fixture, mark
+from pytest_benchmark.fixture import BenchmarkFixture
+
+from parinvoke import InvokeContext
+from parinvoke.config import InvokeConfig
+from parinvoke.invoker import ChunkSize
+
+N_JOBS = 2
+N_TASKS = 1000
+
+
+@fixture(scope="module")
+def matrix() -> npt.NDArray[np.float64]:
+    return np.random.randn(1000, 1000)
+
+
+def _tiny_op(model: object, x: int):
+    return x
+
+
+def _heavy_op(model: npt.NDArray[np.float64], x: int):
+    v = np.full(model.shape[1], x, dtype=model.dtype)
+    for _i in range(10):
+        v = model @ v
+        v /= np.linalg.norm(v)
+    return v[0]
+
+
+def _pid(_x: int):
+    return os.getpid()
+
+
+def test_pool_startup(benchmark: BenchmarkFixture, matrix: npt.NDArray[np.float64]):
+    benchmark.group = "startup"
+
+    def start():
+        with InvokeContext.default() as ctx:
+            with ctx.invoker(matrix, _tiny_op, N_JOBS) as inv:
+                inv.wait_ready()
+
+    benchmark.pedantic(start, rounds=5)
+
+
+@mark.parametrize("chunksize", [None, "auto"])
+@mark.parametrize("backend", ["process", "ring", "thread"])
+def test_map_tiny(benchmark: BenchmarkFixture, backend: str, chunksize: ChunkSize | None):
+    benchmark.group = "map-tiny"
+    with InvokeContext.default(InvokeConfig(backend=backend)) as ctx:
+        with ctx.invoker(None, _tiny_op, N_JOBS) as inv:
+            inv.wait_ready()
+            benchmark(lambda: list(inv.map(range(N_TASKS), chunksize=chunksize)))
+
+
+@mark.parametrize("chunksize", [None, "auto"])
+@mark.parametrize("backend", ["process", "ring", "thread"])
+def test_map_heavy(
+    benchmark: BenchmarkFixture,
+    matrix: npt.NDArray[np.float64],
+    backend: str,
+    chunksize: ChunkSize | None,
+):
+    benchmark.group = "map-heavy"
+    with InvokeContext.default(InvokeConfig(backend=backend)) as ctx:
+        with ctx.invoker(matrix, _heavy_op, N_JOBS) as inv:
+            inv.wait_ready()
+            benchmark(lambda: list(inv.map(range(N_TASKS // 10), chunksize=chunksize)))
+
+
+def test_run_sp(benchmark: BenchmarkFixture):
+    benchmark.group = "run_sp"
+    with InvokeContext.default() as ctx:
+        benchmark.pedantic(ctx.run_sp, (_pid, 0), rounds=10)
@@ -0,0 +1,62 @@
+# This file is part of parinvoke.
+# Copyright (C) 2020-2023 Boise State University
+# Copyright (C) 2023-2024 Drexel University
+# Licensed under the MIT license, see LICENSE.md for details.
+# SPDX-License-Identifier: MIT
+
+"""
+Benchmarks for persisting and loading models.
+"""
+
+import pickle
+from typing import Any
+
+import numpy as np
+
+from pytest import mark
+from pytest_benchmark.fixture import BenchmarkFixture
+
+from parinvoke.context import InvokeContext
+from parinvoke.sharing import PersistedModel
+
+SIZES = {"1MiB": 1, "16MiB": 16, "256MiB": 256}
+
+
+def _model(mib: int):
+    "A model with a few large arrays, totalling about ``mib`` MiB."
+    n = mib * 1024 * 1024 // 8 // 4
+    return {f"a{i}": np.random.randn(n) for i in range(4)}
+
+
+@mark.parametrize("size", SIZES.keys())
+def test_persist(benchmark: BenchmarkFixture, persist_context: InvokeContext, size: str):
+    model = _model(SIZES[size])
+    benchmark.group = f"persist-{size}"
+
+    def persist():
+        persist_context.persist(model).close()
+
+    benchmark(persist)
+
+
+@mark.parametrize("size", SIZES.keys())
+def test_load(benchmark: BenchmarkFixture, persist_context: InvokeContext, size: str):
+    persisted = persist_context.persist(_model(SIZES[size]))
+    benchmark.group = f"load-{size}"
+    # persisted models cache what they load, so load a fresh handle each round,
+    # as a worker process does
+    handles: list[PersistedModel[Any]] = []
+
+    def setup():
+        handles.append(pickle.loads(pickle.dumps(persisted)))
+        return (handles[-1],), {}
+
+    def load(handle: PersistedModel[Any]):
+        handle.get()
+
+    try:
+        benchmark.pedantic(load, setup=setup, rounds=10)
+    finally:
+        for handle in handles:
+            handle.close()
+        persisted.close()
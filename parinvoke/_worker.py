@@ -11,17 +11,20 @@ from __future__ import annotations
 
 import faulthandler
 import logging
-import logging.handlers
 import multiprocessing as mp
 import os
 import pickle
-from typing import Any, TypeVar
+import time
+from multiprocessing.synchronize import Semaphore
+from typing import Any, Callable, NamedTuple, TypeVar
 
 import seedbank
 from numpy.random import SeedSequence
 from threadpoolctl import threadpool_limits
 
 from parinvoke.context import InvokeContext
+from parinvoke.invoker._executor import WorkerResource, record_load_time, record_task_count
+from parinvoke.logging import LogBatch, install_worker_logging
 from parinvoke.sharing import PersistedModel
 
 T = TypeVar("T")
@@ -42,12 +45,17 @@ def is_mp_worker() -> bool:
 
 
 def initialize_worker(
-    log_queue: mp.Queue[logging.LogRecord] | None,
+    log_queue: mp.Queue[LogBatch] | None,
     seed: SeedSequence | None,
     multi: bool = False,
     context: InvokeContext | None = None,
+    log_levels: dict[str, int] | None = None,
 ):
-    "Initialize a worker process."
+    """
+    Initialize a worker process.  Log records are filtered with the parent's
+    ``log_levels`` (from :func:`parinvoke.logging.log_levels`) and sent to the
+    parent in batches.
+    """
     global __is_worker, __is_mp_worker, child_persist_context
     child_persist_context = context
     __is_worker = True
@@ -56,36 +64,258 @@ def initialize_worker(
     if seed is not None:
         seedbank.initialize(seed)
     if log_queue is not None:
-        h = logging.handlers.QueueHandler(log_queue)
-        root = logging.getLogger()
-        root.addHandler(h)
-        root.setLevel(logging.DEBUG)
-        h.setLevel(logging.DEBUG)
+        install_worker_logging(log_queue, log_levels)
 
     _log.debug("worker %s initialized", mp.current_process().name)
 
 
-def mp_invoke_worker(*args: Any):
-    model = __work_model.get()
-    return __work_func(model, *args)
+class OpSpec(NamedTuple):
+    """
+    Specification of an operation for multiprocessing workers to run.  Shared
+    pools send it to their workers as a :class:`WorkerResource`, so each
+    worker receives and installs it once.
+    """
+
+    key: str
+    "A unique key identifying the operation."
+    model: PersistedModel[object]
+    "The persisted model to operate on."
+    func: bytes
+    "The pickled function to apply."
+    shm_results: bool = False
+    "Whether to return large results through shared memory."
+    prepare: bytes | None = None
+    "The pickled function to prepare the model after loading it, if any."
+
+    def install(self) -> WorkOp:
+        "Install the operation in this worker."
+        _log.debug("installing operation %s", self.key)
+        # deferred function unpickling to minimize imports before initialization
+        prepare = pickle.loads(self.prepare) if self.prepare is not None else None
+        return WorkOp(self.model, pickle.loads(self.func), self.shm_results, prepare)
+
+
+WorkerResource.register(OpSpec)
+
+
+class WorkOp:
+    """
+    An operation installed in a worker process.
+    """
+
+    model: PersistedModel[object]
+    func: Callable[..., Any]
+    shm_results: bool
+    prepare: Callable[[Any], Any] | None
+    _value: Any = None
+    _loaded: bool = False
+
+    def __init__(
+        self,
+        model: PersistedModel[object],
+        func: Callable[..., Any],
+        shm_results: bool = False,
+        prepare: Callable[[Any], Any] | None = None,
+    ):
+        self.model = model
+        self.func = func
+        self.shm_results = shm_results
+        self.prepare = prepare
+
+    def load(self) -> Any:
+        """
+        Load the model, and prepare it if the operation has a prepare function.
+        The result is cached, so preparation only happens once per worker.
+        """
+        if not self._loaded:
+            start = time.perf_counter()
+            value = self.model.get()
+            if self.prepare is not None:
+                _log.debug("preparing model with %s", self.prepare)
+                value = self.prepare(value)
+            self._value = value
+            self._loaded = True
+            record_load_time(time.perf_counter() - start)
+        return self._value
+
+    def close(self):
+        self._value = None
+        self._loaded = False
+        self.model.close()
+
+
+class SharedResult(NamedTuple):
+    """
+    A task result returned through shared memory instead of the result pipe.
+    The worker creates the shared memory, and the parent unlinks it.
+    """
+
+    persisted: PersistedModel[Any]
+
+    def load(self) -> Any:
+        """
+        Load the result in the parent process, taking ownership of its memory.
+        The result's arrays are views of the shared memory, which is unlinked
+        immediately and unmapped once they are garbage-collected.
+        """
+        try:
+            return self.persisted.get()
+        finally:
+            self.persisted.close()
+
+
+class PickledResult(NamedTuple):
+    """
+    A task result too small for shared memory, returned as the pickle data and
+    buffers the worker produced to measure its size, so it is not pickled
+    again.
+    """
+
+    data: bytes
+    buffers: list[pickle.PickleBuffer]
+
+    def load(self) -> Any:
+        "Unpickle the result in the parent process."
+        return pickle.loads(self.data, buffers=self.buffers)
+
+
+SHM_RESULT_THRESHOLD = 1024 * 1024
+"""
+Minimum total size of out-of-band buffers for a result to be returned through
+shared memory.  Smaller results are returned through the result pipe.
+"""
+
+
+MAX_WORKER_OPS = 2
+"""
+Maximum number of operations a worker of a shared pool keeps installed.  Shared
+pools install operations in workers as they are first used, and remove the
+least-recently-used operation when this limit is exceeded.
+"""
+__work_ops: dict[str, WorkOp] = {}
+
+
+def install_op(spec: OpSpec) -> WorkOp:
+    """
+    Install the operation of a dedicated pool in this worker.
+    """
+    op = spec.install()
+    __work_ops[spec.key] = op
+    return op
+
+
+def _resolve_op(op: str | OpSpec | WorkOp) -> WorkOp:
+    if isinstance(op, WorkOp):
+        # the executor replaces the operation spec with the installed operation
+        return op
+    elif isinstance(op, OpSpec):
+        raise RuntimeError(f"operation {op.key} was not installed by the executor")
+
+    try:
+        return __work_ops[op]
+    except KeyError:
+        raise RuntimeError(f"operation {op} is not installed in worker")
+
+
+def _share_result(result: Any) -> SharedResult | PickledResult:
+    from parinvoke.sharing.shm import persist_buffers, pickle_buffers
+
+    data, buffers = pickle_buffers(result)
+    if sum(b.raw().nbytes for b in buffers) < SHM_RESULT_THRESHOLD:
+        # the buffers are pickled in-band with the result message
+        return PickledResult(bytes(data), buffers)
+
+    # allocated directly, so no manager keeps track of it after the parent unlinks it
+    return SharedResult(persist_buffers(data, buffers).transfer())
+
+
+def mp_invoke_worker(op: str | OpSpec | WorkOp, *args: Any):
+    wop = _resolve_op(op)
+    model = wop.load()
+    result = wop.func(model, *args)
+    if wop.shm_results:
+        result = _share_result(result)
+    return result
+
+
+def mp_invoke_batch(
+    op: str | OpSpec | WorkOp, batch: list[tuple[Any, ...]]
+) -> tuple[float, list[Any]]:
+    """
+    Invoke the worker function on a batch of argument tuples, returning the
+    elapsed compute time along with the results.
+    """
+    record_task_count(len(batch))
+    wop = _resolve_op(op)
+    model = wop.load()
+    start = time.perf_counter()
+    results = [wop.func(model, *args) for args in batch]
+    elapsed = time.perf_counter() - start
+    if wop.shm_results:
+        results = [_share_result(r) for r in results]
+    return elapsed, results
+
+
+def mp_invoke_into(
+    op: str | OpSpec | WorkOp, out: PersistedModel[Any], batch: list[tuple[Any, ...]]
+) -> tuple[float, list[None]]:
+    """
+    Invoke the worker function on a batch of ``(index, *args)`` tuples, storing
+    each result in row ``index`` of the shared output array.
+    """
+    record_task_count(len(batch))
+    wop = _resolve_op(op)
+    model = wop.load()
+    array = out.get()
+    start = time.perf_counter()
+    for i, *args in batch:
+        array[i] = wop.func(model, *args)
+    elapsed = time.perf_counter() - start
+    del array
+    out.close()
+    return elapsed, [None] * len(batch)
+
+
+def mp_load_op(op: str | OpSpec | WorkOp) -> None:
+    """
+    Install an operation in this worker and load its model, to warm up the
+    workers of a shared pool.  It does not count as a task.
+    """
+    record_task_count(0)
+    start = time.perf_counter()
+    _resolve_op(op).load()
+    _log.debug("loaded model in %.3fs", time.perf_counter() - start)
 
 
 def initialize_mp_worker(
-    model: PersistedModel[object],
-    func: bytes,
+    op: OpSpec | None,
     threads: int,
-    log_queue: mp.Queue[logging.LogRecord] | None,
+    log_queue: mp.Queue[LogBatch] | None,
     seed: SeedSequence | None,
+    context: InvokeContext | None = None,
+    ready: Semaphore | None = None,
+    log_levels: dict[str, int] | None = None,
 ):
+    """
+    Initialize a multiprocessing worker, optionally installing its operation.
+    Shared pools are initialized without an operation, and receive operations
+    with their tasks (or from :func:`mp_load_op`).  If the context is
+    configured for eager loading, the operation's model is loaded before the
+    worker reports itself ready by releasing the ``ready`` semaphore.
+    """
     seed = seedbank.derive_seed(mp.current_process().name, base=seed)
-    initialize_worker(log_queue, seed, True)
-    global __work_model, __work_func
+    initialize_worker(log_queue, seed, True, context, log_levels)
 
     # disable BLAS threading
     threadpool_limits(limits=threads, user_api="blas")
 
-    __work_model = model
-    # deferred function unpickling to minimize imports before initialization
-    __work_func = pickle.loads(func)
+    if op is not None:
+        wop = install_op(op)
+        if context is not None and context.config.eager_load:
+            start = time.perf_counter()
+            wop.load()
+            _log.debug("loaded model in %.3fs", time.perf_counter() - start)
 
     _log.debug("worker %d ready (process %s)", os.getpid(), mp.current_process())
+    if ready is not None:
+        ready.release()
@@ -9,10 +9,13 @@ Configuration and environment support for ParInvoke.
 """
 
 import logging
+import math
+import mmap
 import multiprocessing as mp
 import os
 import warnings
 from collections.abc import Generator
+from multiprocessing.context import BaseContext
 from typing import Callable, NamedTuple, Optional, TypeVar, overload
 
 _log = logging.getLogger(__name__)
@@ -38,6 +41,34 @@ class InvokeConfig:
             See :attr:`max_default`.
         core_div:
             See :attr:`core_div`.
+        persistent_pool:
+            See :attr:`persistent_pool`.
+        start_method:
+            See :attr:`start_method`.
+        preload:
+            See :attr:`preload`.
+        backend:
+            See :attr:`backend`.
+        dedup_persist:
+            See :attr:`dedup_persist`.
+        shm_align:
+            See :attr:`shm_align`.
+        shm_prefault:
+            See :attr:`shm_prefault`.
+        shm_huge_pages:
+            See :attr:`shm_huge_pages`.
+        eager_load:
+            See :attr:`eager_load`.
+        max_tasks_per_worker:
+            See :attr:`max_tasks_per_worker`.
+        max_worker_rss:
+            See :attr:`max_worker_rss`.
+        task_retries:
+            See :attr:`task_retries`.
+        task_timeout:
+            See :attr:`task_timeout`.
+        pin_workers:
+            See :attr:`pin_workers`.
     """
 
     env_prefixes: list[str]
@@ -59,6 +90,20 @@ class InvokeConfig:
     """
     The parallelism nesting level.  See :ref:`nesting-levels`.
     """
+    _persistent_pool: Optional[bool]
+    _start_method: Optional[str]
+    _backend: Optional[str]
+    _dedup_persist: Optional[bool]
+    _shm_align: Optional[int]
+    _shm_prefault: Optional[bool]
+    _shm_huge_pages: Optional[bool]
+    _eager_load: Optional[bool]
+    _max_tasks_per_worker: Optional[int]
+    _max_worker_rss: Optional[int]
+    _task_retries: Optional[int]
+    _task_timeout: Optional[float]
+    _pin_workers: Optional[bool]
+    _preload: Optional[list[str]]
 
     def __init__(
         self,
@@ -68,6 +113,20 @@ class InvokeConfig:
         max_default: int | None = None,
         core_div: int = 1,
         level: int = 0,
+        persistent_pool: bool | None = None,
+        start_method: str | None = None,
+        preload: list[str] | None = None,
+        backend: str | None = None,
+        dedup_persist: bool | None = None,
+        shm_align: int | None = None,
+        shm_prefault: bool | None = None,
+        shm_huge_pages: bool | None = None,
+        eager_load: bool | None = None,
+        max_tasks_per_worker: int | None = None,
+        max_worker_rss: int | None = None,
+        task_retries: int | None = None,
+        task_timeout: float | None = None,
+        pin_workers: bool | None = None,
     ):
         self.env_prefixes = ["PARINVOKE"]
         self.aliases = {}
@@ -85,6 +144,20 @@ class InvokeConfig:
         self.max_default = max_default
         self.core_div = core_div
         self.level = level
+        self._persistent_pool = persistent_pool
+        self._start_method = start_method
+        self._preload = preload
+        self._backend = backend
+        self._dedup_persist = dedup_persist
+        self._shm_align = shm_align
+        self._shm_prefault = shm_prefault
+        self._shm_huge_pages = shm_huge_pages
+        self._eager_load = eager_load
+        self._max_tasks_per_worker = max_tasks_per_worker
+        self._max_worker_rss = max_worker_rss
+        self._task_retries = task_retries
+        self._task_timeout = task_timeout
+        self._pin_workers = pin_workers
 
     @staticmethod
     def default():
@@ -124,6 +197,264 @@ class InvokeConfig:
                 else:
                     return vn.name, val
 
+    def env_flag(self, name: str, default: bool = False) -> bool:
+        """
+        Get a boolean flag from an environment variable.  The values ``1``,
+        ``true``, ``yes``, and ``on`` (in any case) are true; other values are
+        false.
+        """
+        var = self.env_var(name)
+        if var is None:
+            return default
+        else:
+            return var[1].strip().lower() in ("1", "true", "yes", "on")
+
+    @property
+    def persistent_pool(self) -> bool:
+        """
+        Whether the context keeps a persistent pool of worker processes that is
+        reused by its invokers, instead of starting new workers for each
+        invoker.  Defaults to the ``PARINVOKE_PERSISTENT_POOL`` environment
+        variable, or ``False``.
+        """
+        if self._persistent_pool is None:
+            self._persistent_pool = self.env_flag("PERSISTENT_POOL")
+        return self._persistent_pool
+
+    @property
+    def dedup_persist(self) -> bool:
+        """
+        Whether contexts deduplicate persisted models by content.  If enabled,
+        persisting a model whose pickle data and buffers are identical to a
+        model that is already persisted returns a reference-counted handle to
+        the existing shared memory or file instead of keeping another copy
+        (file-based contexts write the model once to fingerprint it).
+        Defaults to the ``PARINVOKE_DEDUP_PERSIST`` environment variable, or
+        ``False``.
+        """
+        if self._dedup_persist is None:
+            self._dedup_persist = self.env_flag("DEDUP_PERSIST")
+        return self._dedup_persist
+
+    @property
+    def shm_align(self) -> int:
+        """
+        The alignment (in bytes) of each buffer in shared memory.  Defaults to
+        the ``PARINVOKE_SHM_ALIGN`` environment variable, which is either a
+        number of bytes or ``page`` for the system page size, or 64 (a cache
+        line, which also satisfies SIMD alignment).
+        """
+        if self._shm_align is None:
+            var = self.env_var("SHM_ALIGN")
+            if var is None:
+                self._shm_align = 64
+            elif var[1].strip().lower() == "page":
+                self._shm_align = mmap.PAGESIZE
+            else:
+                self._shm_align = int(var[1])
+        return self._shm_align
+
+    @property
+    def shm_prefault(self) -> bool:
+        """
+        Whether worker processes pre-fault shared memory pages when loading a
+        model, instead of faulting each page in on first access.  Models
+        persisted with binpickle are read ahead from their files instead.
+        Defaults to the ``PARINVOKE_SHM_PREFAULT`` environment variable, or
+        ``False``.
+        """
+        if self._shm_prefault is None:
+            self._shm_prefault = self.env_flag("SHM_PREFAULT")
+        return self._shm_prefault
+
+    @property
+    def shm_huge_pages(self) -> bool:
+        """
+        Whether to ask the kernel to back shared memory with transparent huge
+        pages.  This only takes effect if the system allows huge pages for
+        shared memory (``shmem_enabled`` set to ``advise``).  Defaults to the
+        ``PARINVOKE_SHM_HUGE_PAGES`` environment variable, or ``False``.
+        """
+        if self._shm_huge_pages is None:
+            self._shm_huge_pages = self.env_flag("SHM_HUGE_PAGES")
+        return self._shm_huge_pages
+
+    @property
+    def eager_load(self) -> bool:
+        """
+        Whether worker processes load the model while they are initialized,
+        instead of when they run their first task.  Invokers with eager loading
+        wait for all their workers to be ready before returning, so the first
+        tasks do not absorb the cost of loading the model; invokers on a shared
+        pool install their operation in each of the pool's workers.  Combine
+        with :attr:`shm_prefault` to also fault in the model's pages.  Defaults
+        to the ``PARINVOKE_EAGER_LOAD`` environment variable, or ``False``.
+        """
+        if self._eager_load is None:
+            self._eager_load = self.env_flag("EAGER_LOAD")
+        return self._eager_load
+
+    @property
+    def max_tasks_per_worker(self) -> int | None:
+        """
+        The number of tasks after which a worker process is replaced with a
+        fresh one, to reclaim memory lost to fragmentation or caches.  Tasks
+        dispatched in batches count individually, but batches are not split,
+        so a worker may run part of a batch past the limit.  The replacement
+        is started while the old worker finishes its tasks, and reuses the
+        persisted model.  Defaults to the ``PARINVOKE_MAX_TASKS_PER_WORKER``
+        environment variable, or ``None`` for no limit.
+        """
+        if self._max_tasks_per_worker is None:
+            var = self.env_var("MAX_TASKS_PER_WORKER", int)
+            if var is not None:
+                self._max_tasks_per_worker = var[1]
+        return self._max_tasks_per_worker
+
+    @property
+    def max_worker_rss(self) -> int | None:
+        """
+        The private resident memory size (in bytes) after which a worker
+        process is replaced with a fresh one.  Shared memory and memory-mapped
+        model files do not count towards this limit.  Defaults to the
+        ``PARINVOKE_MAX_WORKER_RSS`` environment variable, which is a number of
+        bytes with an optional ``K``, ``M``, or ``G`` suffix, or ``None`` for no
+        limit.
+        """
+        if self._max_worker_rss is None:
+            var = self.env_var("MAX_WORKER_RSS", _parse_size)
+            if var is not None:
+                self._max_worker_rss = var[1]
+        return self._max_worker_rss
+
+    @property
+    def task_retries(self) -> int:
+        """
+        The number of times to retry a task whose worker process dies while
+        running it (for example, from a segmentation fault or an out-of-memory
+        kill).  The dead worker is always replaced, and the tasks queued behind
+        the failed one are re-dispatched; once a task exhausts its retries, it
+        fails with :class:`~parinvoke.invoker.WorkerCrashError`.  Defaults to
+        the ``PARINVOKE_TASK_RETRIES`` environment variable, or 0.
+        """
+        if self._task_retries is None:
+            var = self.env_var("TASK_RETRIES", int)
+            self._task_retries = var[1] if var is not None else 0
+        return self._task_retries
+
+    @property
+    def task_timeout(self) -> float | None:
+        """
+        The maximum time (in seconds) a task may run in a worker process.  A
+        worker whose task exceeds this deadline is killed and replaced, and the
+        task fails with :class:`~parinvoke.invoker.TaskTimeoutError`.  Tasks
+        dispatched in batches have a deadline for each batch.  Defaults to the
+        ``PARINVOKE_TASK_TIMEOUT`` environment variable, or ``None`` for no
+        deadline.
+        """
+        if self._task_timeout is None:
+            var = self.env_var("TASK_TIMEOUT", float)
+            if var is not None:
+                self._task_timeout = var[1]
+        return self._task_timeout
+
+    @property
+    def pin_workers(self) -> bool:
+        """
+        Whether to pin each worker process (and its threads) to its own set of
+        :meth:`proc_count(level=1) <proc_count>` CPUs, with the sets aligned to
+        NUMA nodes and spread across them (see :func:`worker_cpu_sets`).  This
+        keeps workers' memory accesses local on multi-socket machines.
+        Defaults to the ``PARINVOKE_PIN_WORKERS`` environment variable, or
+        ``False``.
+        """
+        if self._pin_workers is None:
+            self._pin_workers = self.env_flag("PIN_WORKERS")
+        return self._pin_workers
+
+    @property
+    def backend(self) -> str:
+        """
+        The backend for parallel invokers: ``process`` for a pool of worker
+        processes, ``ring`` for a pool of worker processes that exchange tasks
+        and results through shared memory ring buffers, or ``thread`` for a
+        pool of threads in the current process.  The ``ring`` backend has lower
+        per-task overhead, for very short tasks, but does not support
+        :attr:`max_tasks_per_worker`, :attr:`max_worker_rss`,
+        :attr:`task_retries`, or :attr:`task_timeout`, and warns that it
+        ignores them if they are set.  Threads avoid
+        persisting the model and starting processes, and are appropriate for
+        operations that release the GIL or on free-threaded Python builds.
+        Defaults to the ``PARINVOKE_BACKEND`` environment variable, or
+        ``process``.
+        """
+        if self._backend is None:
+            var = self.env_var("BACKEND")
+            if var is not None:
+                vn, backend = var
+                _log.debug("found backend config in %s=%s", vn, backend)
+                self._backend = backend.strip().lower()
+            else:
+                self._backend = "process"
+        return self._backend
+
+    @property
+    def start_method(self) -> str:
+        """
+        The :mod:`multiprocessing` start method for worker processes, either
+        ``spawn`` or ``forkserver``.  Defaults to the ``PARINVOKE_START_METHOD``
+        environment variable, or ``spawn``.
+        """
+        if self._start_method is None:
+            var = self.env_var("START_METHOD")
+            if var is not None:
+                vn, method = var
+                _log.debug("found start method config in %s=%s", vn, method)
+                self._start_method = method.strip().lower()
+            else:
+                self._start_method = "spawn"
+        return self._start_method
+
+    @property
+    def preload(self) -> list[str]:
+        """
+        Modules for the fork server to import before forking workers, when the
+        start method is ``forkserver``.  Workers then start with these modules
+        already imported.  Defaults to the comma-separated list of modules in
+        the ``PARINVOKE_PRELOAD`` environment variable.
+        """
+        if self._preload is None:
+            var = self.env_var("PRELOAD")
+            if var is not None:
+                self._preload = [m.strip() for m in var[1].split(",") if m.strip()]
+            else:
+                self._preload = []
+        return self._preload
+
+    def mp_context(self) -> BaseContext:
+        """
+        Get the :mod:`multiprocessing` context for starting worker processes,
+        based on :attr:`start_method` and :attr:`preload`.
+
+        .. note::
+            The fork server is started once per process, so the preload list
+            only takes effect if it is configured before the first worker is
+            started with the ``forkserver`` method.
+        """
+        method = self.start_method
+        if method not in ("spawn", "forkserver"):
+            raise ValueError(f"unsupported start method {method}")
+        if method not in mp.get_all_start_methods():
+            _log.warning("start method %s unavailable, using spawn", method)
+            method = "spawn"
+
+        ctx = mp.get_context(method)
+        if method == "forkserver":
+            # keep the default preload of the main module
+            preload = ["__main__"] + [m for m in self.preload if m != "__main__"]
+            ctx.set_forkserver_preload(preload)
+        return ctx
+
     def _var_names(self, name: str) -> Generator[VarName, None, None]:
         yield from self.aliases.get(name, [])
         for pfx in self.env_prefixes:
@@ -142,10 +473,11 @@ class InvokeConfig:
             _log.debug("found process count config in %s=%s", vn, nprocs)
             self.proc_counts = [int(s) for s in nprocs.split(",")]
         else:
-            nprocs = max(mp.cpu_count() // self.core_div, 1)
+            ncpus = available_cpus()
+            nprocs = max(ncpus // self.core_div, 1)
             if self.max_default is not None:
                 nprocs = min(nprocs, self.max_default)
-            self.proc_counts = [nprocs, self.core_div]
+            self.proc_counts = [nprocs, min(self.core_div, ncpus)]
 
     def proc_count(self, *, level: int | None = None) -> int:
         """
@@ -157,8 +489,10 @@ class InvokeConfig:
         * The value provided to the :class:`ParallelConfig` constructor.
         * The ``PARINVOKE_NUM_PROCS`` environment variable and its aliases and
           alternate prefixes (see :ref:`env-vars`).
-        * The number of CPUs, as returned by :func:`mp.cpu_count`, capped by
-          :attr:`max_default`.
+        * The number of CPUs available to this process, as returned by
+          :func:`available_cpus`, divided by :attr:`core_div` and capped by
+          :attr:`max_default`.  Nested levels use the remaining
+          :attr:`core_div` CPUs, up to the number available.
 
         Args:
             level:
@@ -178,3 +512,163 @@ class InvokeConfig:
             return 1
         else:
             return self.proc_counts[level]
+
+
+def available_cpus() -> int:
+    """
+    Get the number of CPUs available to the current process.  Unlike
+    :func:`mp.cpu_count`, this respects the process's CPU affinity (such as a
+    container's cpuset) and its cgroup CPU quota (v2 ``cpu.max`` or v1
+    ``cpu.cfs_quota_us``), rounding fractional quotas up.
+
+    Returns:
+        int: The number of available CPUs, at least 1.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        ncpus = len(os.sched_getaffinity(0))
+    else:
+        ncpus = mp.cpu_count()
+
+    quota = _cgroup_cpu_quota()
+    if quota is not None:
+        _log.debug("cgroup CPU quota is %.2f", quota)
+        ncpus = min(ncpus, math.ceil(quota))
+    return max(ncpus, 1)
+
+
+def worker_cpu_sets(size: int, *, node_root: str = "/sys/devices/system/node") -> list[set[int]]:
+    """
+    Divide the CPUs available to the current process into disjoint sets for
+    pinning worker processes.  Each set has ``size`` CPUs from a single NUMA
+    node (unless ``size`` is larger than a node), and consecutive sets come
+    from different nodes, so workers are spread evenly across nodes.  CPUs
+    left over after filling the sets are not used.
+
+    Args:
+        size:
+            The number of CPUs in each set.
+        node_root:
+            The directory listing the NUMA nodes.
+
+    Returns:
+        list[set[int]]:
+            The CPU sets, or an empty list if the platform does not support
+            CPU affinity.
+    """
+    if not hasattr(os, "sched_getaffinity"):
+        return []
+
+    avail = os.sched_getaffinity(0)
+    size = max(min(size, len(avail)), 1)
+    nodes = [sorted(cpus & avail) for cpus in _numa_nodes(node_root)]
+    nodes = [cpus for cpus in nodes if cpus]
+    if not nodes or min(len(cpus) for cpus in nodes) < size:
+        nodes = [sorted(avail)]
+
+    node_sets = [
+        [set(cpus[i : i + size]) for i in range(0, len(cpus) - size + 1, size)] for cpus in nodes
+    ]
+    return [
+        sets[i]
+        for i in range(max(len(sets) for sets in node_sets))
+        for sets in node_sets
+        if i < len(sets)
+    ]
+
+
+def _numa_nodes(root: str) -> list[set[int]]:
+    "Get the CPUs of each NUMA node."
+    nodes: list[set[int]] = []
+    try:
+        entries = sorted(os.listdir(root))
+    except OSError:
+        return nodes
+    for entry in entries:
+        if entry.startswith("node") and entry[4:].isdigit():
+            try:
+                with open(os.path.join(root, entry, "cpulist")) as f:
+                    nodes.append(_parse_cpulist(f.read()))
+            except (OSError, ValueError):
+                _log.debug("cannot read CPU list for NUMA %s", entry)
+    return nodes
+
+
+def _parse_cpulist(cpulist: str) -> set[int]:
+    "Parse a Linux CPU list, such as ``0-3,8-11``."
+    cpus: set[int] = set()
+    for part in cpulist.strip().split(","):
+        if "-" in part:
+            lo, hi = part.split("-")
+            cpus.update(range(int(lo), int(hi) + 1))
+        elif part:
+            cpus.add(int(part))
+    return cpus
+
+
+def _cgroup_cpu_quota(
+    root: str = "/sys/fs/cgroup", proc_cgroup: str = "/proc/self/cgroup"
+) -> Optional[float]:
+    """
+    Get the CPU quota of the current process's cgroup and its ancestors, as a
+    (possibly fractional) number of CPUs, or ``None`` if it is unlimited.
+    """
+    try:
+        with open(proc_cgroup) as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return None
+
+    quotas: list[float] = []
+    for line in lines:
+        try:
+            quotas += _cgroup_line_quotas(root, line)
+        except ValueError:
+            _log.debug("cannot parse cgroup entry %r", line)
+
+    return min(quotas) if quotas else None
+
+
+def _cgroup_line_quotas(root: str, line: str) -> list[float]:
+    "Get the CPU quotas for an entry of ``/proc/self/cgroup``."
+    _id, controllers, path = line.split(":", 2)
+    quotas: list[float] = []
+    if controllers == "":
+        # cgroup v2: "$MAX $PERIOD", where $MAX may be "max"
+        for cg in _cgroup_dirs(root, path):
+            max_str = _read_cgroup_file(cg, "cpu.max")
+            if max_str is not None:
+                quota, *period = max_str.split()
+                if quota != "max":
+                    quotas.append(int(quota) / int(period[0] if period else 100000))
+    elif "cpu" in controllers.split(","):
+        # cgroup v1: a quota of -1 is unlimited
+        for cg in _cgroup_dirs(os.path.join(root, controllers), path):
+            quota = _read_cgroup_file(cg, "cpu.cfs_quota_us")
+            period = _read_cgroup_file(cg, "cpu.cfs_period_us")
+            if quota is not None and period is not None and int(quota) > 0:
+                quotas.append(int(quota) / int(period))
+    return quotas
+
+
+def _cgroup_dirs(mount: str, path: str) -> Generator[str, None, None]:
+    "Yield a cgroup's directory and those of its ancestors, up to the mount point."
+    parts = [p for p in path.split("/") if p]
+    for i in range(len(parts), -1, -1):
+        yield os.path.join(mount, *parts[:i])
+
+
+def _read_cgroup_file(cgroup: str, name: str) -> Optional[str]:
+    try:
+        with open(os.path.join(cgroup, name)) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _parse_size(size: str) -> int:
+    "Parse a size in bytes, with an optional binary ``K``, ``M``, or ``G`` suffix."
+    size = size.strip().upper().removesuffix("B")
+    for i, suffix in enumerate("KMG", 1):
+        if size.endswith(suffix):
+            return int(float(size[:-1]) * 1024**i)
+    return int(size)
@@ -6,13 +6,19 @@ from __future__ import annotations
 
 import logging
 from abc import ABC, abstractmethod
+from functools import partial
 from inspect import Traceback
 from threading import local
-from typing import Callable, Concatenate, ParamSpec, TypeVar
+from typing import TYPE_CHECKING, Any, Callable, Concatenate, ParamSpec, TypeVar
 
 from parinvoke.config import InvokeConfig
 from parinvoke.invoker import ModelOpInvoker
 
+if TYPE_CHECKING:
+    from numpy.typing import DTypeLike, NDArray
+
+    from parinvoke.invoker.pool import WorkerPool
+
 _log = logging.getLogger()
 _current_context = local()
 T = TypeVar("T")
@@ -32,6 +38,8 @@ class InvokeContext(ABC):
     """
 
     config: InvokeConfig
+    _pools: dict[int, WorkerPool] | None = None
+    _dedup: dict[str, tuple[PersistedModel[Any], int]] | None = None
 
     def __init__(self, config: InvokeConfig) -> None:
         super().__init__()
@@ -89,6 +97,66 @@ class InvokeContext(ABC):
         """
         raise NotImplementedError()
 
+    def _persist_dedup(
+        self, digest: str, persist: Callable[[], PersistedModel[T]]
+    ) -> PersistedModel[T]:
+        """
+        Persist a model with content-based deduplication.  If a model with the
+        same digest is already persisted, a new reference to it is returned;
+        otherwise, ``persist`` is called to persist the model.
+
+        Args:
+            digest: The content fingerprint of the model.
+            persist: A function to persist the model.
+
+        Returns:
+            A reference-counted handle to the persisted model.
+        """
+        if self._dedup is None:
+            self._dedup = {}
+
+        entry = self._dedup.get(digest, None)
+        if entry is None:
+            persisted = persist()
+            refs = 0
+        else:
+            persisted, refs = entry
+            _log.debug("reusing persisted model %s (%d references)", digest, refs)
+
+        self._dedup[digest] = (persisted, refs + 1)
+        return PersistedRef(persisted, partial(self._release_dedup, digest))
+
+    def _release_dedup(self, digest: str):
+        assert self._dedup is not None
+        persisted, refs = self._dedup[digest]
+        if refs > 1:
+            self._dedup[digest] = (persisted, refs - 1)
+        else:
+            _log.debug("releasing persisted model %s", digest)
+            del self._dedup[digest]
+            persisted.close()
+
+    @abstractmethod
+    def shared_array(
+        self, shape: int | tuple[int, ...], dtype: DTypeLike = "f8"
+    ) -> PersistedModel[NDArray[Any]]:
+        """
+        Allocate a zero-initialized, writable NumPy array that is shared with
+        worker processes.  Workers that load the returned object write directly
+        into the same memory, so it can be used as the output of
+        :meth:`ModelOpInvoker.map_into`.
+
+        The array is released when the returned object is closed.
+
+        Args:
+            shape: The shape of the array.
+            dtype: The array's data type.
+
+        Returns:
+            The persisted array.
+        """
+        raise NotImplementedError()
+
     def setup(self):
         """
         Initialize the context so it is ready to run.
@@ -101,13 +169,50 @@ class InvokeContext(ABC):
 
     def teardown(self):
         """
-        Close the context, cleaning up temporary objects.
+        Close the context, cleaning up temporary objects and shutting down
+        persistent worker pools.
 
         .. note::
-            Even though the current superclass implemenation does nothing, subclasses
-            **must** call it.
+            Subclasses **must** call the superclass implementation.
         """
-        pass
+        if self._pools:
+            for pool in self._pools.values():
+                pool.shutdown()
+            self._pools = None
+
+    def worker_pool(self, n_jobs: int | None = None) -> WorkerPool:
+        """
+        Get a persistent pool of worker processes owned by this context, starting
+        it if necessary.  Invokers created with a shared pool send their models
+        and functions to the existing workers instead of starting new ones, so
+        the cost of starting workers and importing modules is only paid once.
+        The pools are shut down by :meth:`teardown`.
+
+        Args:
+            n_jobs: The number of worker processes.
+
+        Returns:
+            The worker pool.
+        """
+        from .invoker.pool import WorkerPool
+
+        if n_jobs is None:
+            n_jobs = self.config.proc_count()
+        if self._pools is None:
+            self._pools = {}
+
+        pool = self._pools.get(n_jobs, None)
+        if pool is None:
+            pool = WorkerPool(n_jobs, self)
+            self._pools[n_jobs] = pool
+        return pool
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        # worker pools stay with the parent process
+        state.pop("_pools", None)
+        state.pop("_dedup", None)
+        return state
 
     def __enter__(self):
         _current_context.context = self
@@ -125,6 +230,9 @@ class InvokeContext(ABC):
         model: T,
         func: Callable[Concatenate[T, ...], R],
         n_jobs: int | None = None,
+        *,
+        prepare: Callable[[T], Any] | None = None,
+        shm_results: bool = False,
     ) -> ModelOpInvoker[T, R]:
         """
         Get an appropriate invoker for performing oeprations on ``model``.
@@ -133,7 +241,18 @@ class InvokeContext(ABC):
             model: The model object on which to perform operations.
             func: The function to call.  The function must be pickleable.
             n_jobs:
-                The number of processes to use for parallel operations.
+                The number of processes (or threads, with the ``thread``
+                :attr:`~InvokeConfig.backend`) to use for parallel operations.
+            prepare:
+                A function to run once in each worker after the model is
+                loaded, to build per-worker state such as indexes or caches.
+                Its return value is passed to ``func`` in place of the model.
+                It must be pickleable.
+            shm_results:
+                If ``True``, worker processes return large results (such as big
+                NumPy arrays) through shared memory instead of pickling them
+                through the result pipe, and the parent maps them without
+                copying.
 
         Returns:
             An invoker to perform operations on the model.
@@ -144,11 +263,25 @@ class InvokeContext(ABC):
         if n_jobs == 1:
             from .invoker.inproc import InProcessOpInvoker
 
-            return InProcessOpInvoker(model, func)
-        else:
+            return InProcessOpInvoker(model, func, prepare=prepare)
+
+        backend = self.config.backend
+        if backend == "thread":
+            from .invoker.threads import ThreadPoolOpInvoker
+
+            return ThreadPoolOpInvoker(model, func, n_jobs, self, prepare=prepare)
+        elif backend in ("process", "ring"):
             from .invoker.pool import ProcessPoolOpInvoker
 
-            return ProcessPoolOpInvoker(model, func, n_jobs, self)
+            if self.config.persistent_pool:
+                pool = self.worker_pool(n_jobs)
+            else:
+                pool = None
+            return ProcessPoolOpInvoker(
+                model, func, n_jobs, self, pool, shm_results=shm_results, prepare=prepare
+            )
+        else:
+            raise ValueError(f"unknown invoker backend {backend}")
 
     def run_sp(self, func: Callable[P, T], *args: P.args, **kwargs: P.kwargs) -> T:
         """
@@ -162,4 +295,4 @@ class InvokeContext(ABC):
         return run_sp(self, func, *args, **kwargs)
 
 
-from parinvoke.sharing import PersistedModel  # noqa: E402
+from parinvoke.sharing import PersistedModel, PersistedRef  # noqa: E402
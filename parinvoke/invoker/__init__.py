@@ -1,10 +1,18 @@
+import asyncio
 from abc import ABC, abstractmethod
-from typing import Any, Generic, Iterator, ParamSpec, TypeVar
+from concurrent.futures import Future
+from typing import Any, AsyncIterator, Generic, Iterator, Literal, ParamSpec, TypeVar
+
+from parinvoke.invoker._executor import TaskTimeoutError, WorkerCrashError
+from parinvoke.invoker._stats import InvokerStats
+from parinvoke.sharing import PersistedModel
 
 T = TypeVar("T")
 R = TypeVar("R")
 P = ParamSpec("P")
 
+ChunkSize = int | Literal["auto"]
+
 
 class ModelOpInvoker(ABC, Generic[T, R]):
     """
@@ -17,19 +25,172 @@ class ModelOpInvoker(ABC, Generic[T, R]):
     """
 
     @abstractmethod
-    def map(self, *iterables: Any) -> Iterator[R]:
+    def map(
+        self,
+        *iterables: Any,
+        chunksize: ChunkSize | None = None,
+        max_pending: int | None = None,
+    ) -> Iterator[R]:
         """
         Apply the configured function to the model and iterables.  This is like :py:func:`map`,
         except it supplies the invoker's model as the first object to ``func``.
 
         Args:
             iterables: Iterables of arguments to provide to the function.
+            chunksize:
+                The number of tasks to send to a worker in a single batch.  If
+                ``"auto"``, the batch size is adapted to the measured per-task
+                cost.  In-process invokers ignore this option.
+            max_pending:
+                The maximum number of tasks to have in flight at once.  If
+                specified, the iterables are consumed lazily as results are
+                retrieved, so memory use does not grow with the length of the
+                input.  In-process invokers always consume their input lazily.
+
+        Returns:
+            iterable:
+                An iterable of the results.  If it is closed (or
+                garbage-collected) before it is exhausted, tasks that have not
+                started yet are cancelled.
+        """
+        pass
+
+    def map_unordered(
+        self,
+        *iterables: Any,
+        chunksize: ChunkSize | None = None,
+        max_pending: int | None = None,
+    ) -> Iterator[tuple[int, R]]:
+        """
+        Apply the configured function to the model and iterables, yielding results
+        as they complete instead of in input order.  This avoids having one slow
+        task hold up the results of the tasks after it.
+
+        The default implementation enumerates the results of :meth:`map`, which is
+        correct for invokers that compute results sequentially.
+
+        Args:
+            iterables: Iterables of arguments to provide to the function.
+            chunksize: The batch size (see :meth:`map`).
+            max_pending: The maximum number of tasks in flight (see :meth:`map`).
+
+        Returns:
+            iterable:
+                An iterable of ``(index, result)`` pairs, where ``index`` is the
+                position of the task's arguments in the input iterables.
+        """
+        return enumerate(self.map(*iterables, chunksize=chunksize, max_pending=max_pending))
+
+    def map_into(
+        self,
+        out: PersistedModel[Any],
+        *iterables: Any,
+        chunksize: ChunkSize | None = "auto",
+        max_pending: int | None = None,
+    ) -> None:
+        """
+        Apply the configured function to the model and iterables, storing the
+        result for the *i*-th set of arguments in ``out[i]``.  The output is an
+        array allocated with :meth:`InvokeContext.shared_array`; worker
+        processes write into it directly, so results are not sent back to the
+        parent process.  Returns once all results have been stored.
+
+        Args:
+            out: The shared output array.
+            iterables: Iterables of arguments to provide to the function.
+            chunksize: The batch size (see :meth:`map`).
+            max_pending: The maximum number of tasks in flight (see :meth:`map`).
+        """
+        array = out.get()
+        for i, res in enumerate(self.map(*iterables, chunksize=chunksize, max_pending=max_pending)):
+            array[i] = res
+
+    def amap(
+        self,
+        *iterables: Any,
+        chunksize: ChunkSize | None = None,
+        max_pending: int | None = None,
+    ) -> AsyncIterator[R]:
+        """
+        Asynchronous version of :meth:`map`, for use from :mod:`asyncio` code.
+        Parallel invokers wait for results on the event loop instead of
+        blocking a thread, so many concurrent callers can share one invoker.
+
+        The default implementation computes results synchronously with
+        :meth:`map`, blocking the event loop while each result is computed.
+
+        Returns:
+            An asynchronous iterator of the results, in input order.
+        """
+        return _aiter(self.map(*iterables, chunksize=chunksize, max_pending=max_pending))
+
+    def submit(self, *args: Any) -> Future[R]:
+        """
+        Apply the configured function to the model and a single set of
+        arguments.  Parallel invokers send the task directly to their workers,
+        without the batching machinery of :meth:`map`, so this is the
+        lowest-latency way to run a single operation.
+
+        The default implementation computes the result synchronously with
+        :meth:`map`, and returns a completed future.  Since :meth:`map` cannot
+        express a call without arguments, it fails for operations that take
+        no arguments besides the model; invokers override it to support them.
+
+        Args:
+            args: The arguments to provide to the function.
+
+        Returns:
+            A future for the function's result.
+        """
+        fut: Future[R] = Future()
+        if not args:
+            err = TypeError(f"{type(self).__name__} cannot submit a task without arguments")
+            fut.set_exception(err)
+            return fut
+
+        try:
+            fut.set_result(next(self.map(*([a] for a in args))))
+        except Exception as e:
+            fut.set_exception(e)
+        return fut
+
+    async def asubmit(self, *args: Any) -> R:
+        """
+        Asynchronously apply the configured function to the model and a single
+        set of arguments.  The default implementation awaits the future from
+        :meth:`submit`, so invokers that compute synchronously block the event
+        loop.
+
+        Args:
+            args: The arguments to provide to the function.
 
         Returns:
-            iterable: An iterable of the results.
+            The function's result.
+        """
+        return await asyncio.wrap_future(self.submit(*args))
+
+    def wait_ready(self, timeout: float | None = None):
+        """
+        Wait until the invoker's workers (if any) are started and initialized,
+        so that subsequent operations do not include startup costs.  The
+        default implementation does nothing.
+
+        Args:
+            timeout: The maximum time to wait, in seconds.
         """
         pass
 
+    def stats(self) -> InvokerStats:
+        """
+        Get a snapshot of the invoker's runtime statistics: task counts and
+        time spent loading the model and computing tasks, along with (for
+        process pools) time tasks spent waiting to start and the bytes sent to
+        and received from workers.  Invokers using a persistent pool report
+        statistics for the whole pool.  The default implementation reports no
+        statistics.
+        """
+        return InvokerStats(worker_compute_time={})
+
     def shutdown(self):
         pass
 
@@ -38,3 +199,17 @@ class ModelOpInvoker(ABC, Generic[T, R]):
 
     def __exit__(self, *args: Any):
         self.shutdown()
+
+
+async def _aiter(results: Iterator[R]) -> AsyncIterator[R]:
+    for res in results:
+        yield res
+
+
+__all__ = [
+    "ChunkSize",
+    "InvokerStats",
+    "ModelOpInvoker",
+    "TaskTimeoutError",
+    "WorkerCrashError",
+]
@@ -0,0 +1,258 @@
+# This file is part of parinvoke.
+# Copyright (C) 2020-2023 Boise State University
+# Copyright (C) 2023-2024 Drexel University
+# Licensed under the MIT license, see LICENSE.md for details.
+# SPDX-License-Identifier: MIT
+
+"""
+Batched task dispatch to executors.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, wait
+from itertools import islice
+from typing import Any, AsyncIterator, Callable, Iterable, Iterator
+
+from parinvoke.invoker import ChunkSize
+from parinvoke.invoker._executor import PoolExecutor
+
+_log = logging.getLogger(__name__)
+
+AUTO_CHUNK_TIME = 0.05
+"""
+Target compute time (in seconds) for a single batch when chunk sizes are adaptive.
+"""
+AUTO_CHUNK_MAX = 4096
+"""
+Maximum size of an adaptive batch.
+"""
+
+BatchFunc = Callable[[list[tuple[Any, ...]]], tuple[float, list[Any]]]
+
+
+class ChunkSizer:
+    """
+    Compute batch sizes for task dispatch, optionally adapting them to the
+    measured per-task cost so each batch takes roughly :data:`AUTO_CHUNK_TIME`.
+    """
+
+    size: int
+    adaptive: bool
+    _task_time: float | None = None
+
+    def __init__(self, chunksize: ChunkSize):
+        if chunksize == "auto":
+            self.size = 1
+            self.adaptive = True
+        elif chunksize >= 1:
+            self.size = chunksize
+            self.adaptive = False
+        else:
+            raise ValueError("chunk size must be positive")
+
+    def update(self, n_tasks: int, elapsed: float):
+        """
+        Record the time a batch took to compute, and adjust the chunk size.
+        """
+        if not self.adaptive or n_tasks == 0:
+            return
+
+        per_task = elapsed / n_tasks
+        if self._task_time is None:
+            self._task_time = per_task
+        else:
+            self._task_time = 0.5 * self._task_time + 0.5 * per_task
+
+        if self._task_time > 0:
+            target = int(AUTO_CHUNK_TIME / self._task_time)
+        else:
+            target = AUTO_CHUNK_MAX
+        # grow at most 2x at a time, so one fast batch does not overshoot
+        self.size = max(min(target, self.size * 2, AUTO_CHUNK_MAX), 1)
+
+
+class BatchQueue:
+    """
+    Track batches of tasks submitted to an executor, submitting new batches as
+    permitted by the batch size and in-flight limits.  The input iterables are
+    consumed lazily, only as far as needed to keep the permitted number of
+    tasks in flight.
+
+    Args:
+        executor:
+            The executor to submit batches to.
+        func:
+            The batch function.  It takes a list of argument tuples, and returns
+            the time spent computing the batch along with the list of results.
+        iterables:
+            The argument iterables, as for :py:func:`map`.
+        chunksize:
+            The batch size, or ``"auto"`` to adapt it to measured task cost.
+        max_batches:
+            The maximum number of batches to keep in flight.
+        max_pending:
+            The maximum number of tasks to keep in flight.
+    """
+
+    pending: dict[Future[tuple[float, list[Any]]], int]
+    """
+    The pending batches, mapped to the index of their first task.  Dicts preserve
+    insertion order, so the first entry is the oldest batch.
+    """
+
+    def __init__(
+        self,
+        executor: Executor,
+        func: BatchFunc,
+        iterables: Iterable[Iterable[Any]],
+        *,
+        chunksize: ChunkSize = 1,
+        max_batches: int | None = None,
+        max_pending: int | None = None,
+    ):
+        if max_pending is not None and max_pending < 1:
+            raise ValueError("max_pending must be positive")
+
+        self.executor = executor
+        self.func = func
+        self.max_batches = max_batches
+        self.max_pending = max_pending
+        self.sizer = ChunkSizer(chunksize)
+        self.pending = {}
+        self._tasks = zip(*iterables)
+        self._n_pending = 0
+        self._n_submitted = 0
+        self._exhausted = False
+
+    def fill(self):
+        """
+        Submit batches until the in-flight limits are reached or the input is
+        exhausted.
+        """
+        while not self._exhausted:
+            if self.max_batches is not None and len(self.pending) >= self.max_batches:
+                break
+            size = self.sizer.size
+            if self.max_pending is not None:
+                if self._n_pending >= self.max_pending:
+                    break
+                size = min(size, self.max_pending - self._n_pending)
+
+            batch = list(islice(self._tasks, size))
+            if batch:
+                if isinstance(self.executor, PoolExecutor):
+                    fut = self.executor.submit_batch(self.func, batch)
+                else:
+                    fut = self.executor.submit(self.func, batch)
+                self.pending[fut] = self._n_submitted
+                self._n_pending += len(batch)
+                self._n_submitted += len(batch)
+            if len(batch) < size:
+                self._exhausted = True
+
+    def complete(self, fut: Future[tuple[float, list[Any]]]) -> list[tuple[int, Any]]:
+        """
+        Remove a completed batch, returning its ``(index, result)`` pairs.
+        """
+        start = self.pending.pop(fut)
+        elapsed, results = fut.result()
+        self._n_pending -= len(results)
+        self.sizer.update(len(results), elapsed)
+        return list(enumerate(results, start))
+
+    def cancel(self):
+        """
+        Cancel the pending batches and stop submitting new ones.  Batches that
+        workers have already started still run to completion.
+        """
+        self._exhausted = True
+        for fut in self.pending:
+            fut.cancel()
+
+
+def dispatch(
+    executor: Executor,
+    func: BatchFunc,
+    iterables: Iterable[Iterable[Any]],
+    *,
+    chunksize: ChunkSize = 1,
+    max_batches: int | None = None,
+    max_pending: int | None = None,
+    ordered: bool = True,
+) -> Iterator[tuple[int, Any]]:
+    """
+    Dispatch tasks to an executor in batches, yielding ``(index, result)``
+    pairs.  See :class:`BatchQueue` for the arguments.
+
+    If the result iterator is closed (or garbage-collected) before it is
+    exhausted, pending batches are cancelled.
+
+    Args:
+        ordered:
+            If ``False``, yield the results of each batch as soon as it
+            completes, instead of in input order.
+    """
+    queue = BatchQueue(
+        executor,
+        func,
+        iterables,
+        chunksize=chunksize,
+        max_batches=max_batches,
+        max_pending=max_pending,
+    )
+
+    try:
+        while True:
+            queue.fill()
+            if not queue.pending:
+                return
+
+            if ordered:
+                done = [next(iter(queue.pending))]
+            else:
+                done, _ = wait(queue.pending, return_when=FIRST_COMPLETED)
+
+            for fut in done:
+                yield from queue.complete(fut)
+    finally:
+        queue.cancel()
+
+
+async def adispatch(
+    executor: Executor,
+    func: BatchFunc,
+    iterables: Iterable[Iterable[Any]],
+    *,
+    chunksize: ChunkSize = 1,
+    max_batches: int | None = None,
+    max_pending: int | None = None,
+) -> AsyncIterator[Any]:
+    """
+    Dispatch tasks to an executor in batches, asynchronously yielding results in
+    order.  The event loop waits on the executor's futures, so no threads are
+    blocked while waiting for results.  See :class:`BatchQueue` for the arguments.
+    """
+    queue = BatchQueue(
+        executor,
+        func,
+        iterables,
+        chunksize=chunksize,
+        max_batches=max_batches,
+        max_pending=max_pending,
+    )
+
+    try:
+        while True:
+            queue.fill()
+            if not queue.pending:
+                return
+
+            fut = next(iter(queue.pending))
+            await asyncio.wrap_future(fut)
+            for _i, res in queue.complete(fut):
+                yield res
+    finally:
+        queue.cancel()
@@ -0,0 +1,1322 @@
+# This file is part of parinvoke.
+# Copyright (C) 2020-2023 Boise State University
+# Copyright (C) 2023-2024 Drexel University
+# Licensed under the MIT license, see LICENSE.md for details.
+# SPDX-License-Identifier: MIT
+
+"""
+Process pool executor that manages its own worker processes.
+
+Unlike :class:`~concurrent.futures.ProcessPoolExecutor`, the parent assigns
+each task to a specific worker, so it always knows which tasks each worker
+holds.  This lets it retire workers (after a number of tasks, or when their
+memory use grows too large) and start replacements without disturbing the
+tasks in flight, recover from workers that die by re-dispatching only the
+tasks they held, and kill workers whose tasks exceed a deadline.  Workers send
+their log records through their own result pipes instead of the shared log
+queue, so a killed worker cannot leave the queue locked for the others.
+
+Large buffers in task arguments (such as NumPy arrays) are pickled out-of-band
+and copied into reusable shared memory segments when tasks are assigned to
+workers, so only small pickled headers go through the workers' task queues.
+Worker resources (see :class:`WorkerResource`) in task arguments are sent to
+each worker once, and referenced by key after that.
+"""
+
+from __future__ import annotations
+
+import atexit
+import io
+import logging
+import mmap
+import multiprocessing.queues
+import multiprocessing.shared_memory as shm
+import os
+import pickle
+import sys
+import threading
+import time
+import traceback
+import weakref
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from concurrent.futures import Executor, Future
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from itertools import count, islice
+from multiprocessing.connection import Connection, wait
+from multiprocessing.context import BaseContext
+from multiprocessing.process import BaseProcess
+from typing import TYPE_CHECKING, Any, Callable, Generator, Iterable, Iterator, cast
+
+from parinvoke.invoker._stats import InvokerStats
+from parinvoke.logging import LogBatch, close_worker_logs, inject_worker_logs, route_worker_logs
+
+if TYPE_CHECKING:
+    from parinvoke.invoker._ring import _RingManager
+
+_log = logging.getLogger(__name__)
+
+PREFETCH = 2
+"""
+The number of tasks to queue on each worker, so it can start its next task
+without waiting for the parent to hear about the last one.
+"""
+
+_READY = 0
+ARG_SHM_THRESHOLD = 64 * 1024
+"""
+Minimum size of a buffer in a task's arguments for it to be sent through
+shared memory instead of the task queue.
+"""
+ARENA_MIN_SIZE = 1024 * 1024
+"""
+Minimum size of a shared memory segment for task arguments.
+"""
+_ARG_ALIGN = 64
+
+_RESULT = 1
+_ERROR = 2
+_INIT_ERROR = 3
+_LOG = 4
+
+_live_managers: set[_Manager | _RingManager] = set()
+_worker_load_time = 0.0
+_worker_task_count: int | None = None
+_worker_resource_data: dict[str, bytes] = {}
+_worker_resources: dict[str, Any] = {}
+_worker_send_lock = threading.Lock()
+"Lock for the worker's result pipe, which log records are also sent through."
+
+
+class WorkerResource(ABC):
+    """
+    An object that tasks use in worker processes, such as an operation and its
+    model, that is too expensive to send with every task.  When a task's
+    arguments contain a resource, the executor sends the resource to a worker
+    with the first such task it assigns the worker, and only sends its key
+    after that.  The worker installs the resource with :meth:`install` when a
+    task first uses it, and tasks receive the installed object in its place.
+
+    Executors keep a limited number of resources installed in each worker, and
+    remove the least recently used ones beyond that limit; they can also be
+    removed explicitly with :meth:`PoolExecutor.remove_resource`.
+    """
+
+    @property
+    @abstractmethod
+    def key(self) -> str:
+        "A unique key identifying the resource."
+        raise NotImplementedError()
+
+    @abstractmethod
+    def install(self) -> Any:
+        """
+        Install the resource in a worker process.  The result replaces the
+        resource in task arguments, and its ``close`` method (if it has one) is
+        called when the resource is removed from the worker.
+        """
+        raise NotImplementedError()
+
+
+class WorkerCrashError(BrokenProcessPool):
+    """
+    A task failed because its worker process died while running it (for
+    example, from a segmentation fault or being killed for running out of
+    memory) more times than its retry budget allows.  The pool itself
+    survives, with a replacement worker.
+    """
+
+
+class TaskTimeoutError(TimeoutError):
+    """
+    A task ran longer than its deadline, and its worker process was killed and
+    replaced.
+    """
+
+
+class _RemoteTraceback(Exception):
+    def __init__(self, tb: str):
+        self.tb = tb
+
+    def __str__(self):
+        return self.tb
+
+
+class _TaskQueue(multiprocessing.queues.Queue):  # type: ignore
+    """
+    Queue of tasks for a single worker.  Its worker may have died, so the
+    feeder thread ignores broken pipes instead of printing them.
+    """
+
+    @staticmethod
+    def _on_queue_feeder_error(e: Exception, obj: object):
+        if not isinstance(e, OSError):
+            traceback.print_exc()
+
+
+class _ArgArena:
+    """
+    Pool of shared memory segments for the out-of-band buffers of task
+    arguments.  Segments are reused once their tasks finish, so sending large
+    arguments does not create (and fault in) new shared memory for each task.
+    The arena is only used by the manager thread.
+    """
+
+    max_free: int
+    _free: list[shm.SharedMemory]
+    _closed: bool = False
+
+    def __init__(self, max_free: int):
+        self.max_free = max_free
+        self._free = []
+
+    def acquire(self, size: int) -> shm.SharedMemory:
+        "Get a segment of at least ``size`` bytes."
+        fits = [m for m in self._free if m.size >= size]
+        if fits:
+            memory = min(fits, key=lambda m: m.size)
+            self._free.remove(memory)
+            return memory
+
+        alloc = ARENA_MIN_SIZE
+        while alloc < size:
+            alloc *= 2
+        _log.debug("allocating %d bytes of shared memory for task arguments", alloc)
+        return shm.SharedMemory(create=True, size=alloc)
+
+    def release(self, memory: shm.SharedMemory):
+        "Return a segment to the pool."
+        self._free.append(memory)
+        if self._closed or len(self._free) > self.max_free:
+            # evict the smallest segment
+            evict = min(self._free, key=lambda m: m.size)
+            self._free.remove(evict)
+            evict.unlink()
+            evict.close()
+
+    def discard(self, memory: shm.SharedMemory):
+        """
+        Drop a segment that a worker still maps, because its task kept
+        references to its arguments.  The segment is freed once the worker
+        unmaps it.
+        """
+        memory.unlink()
+        memory.close()
+
+    def close(self):
+        self._closed = True
+        for memory in self._free:
+            memory.unlink()
+            memory.close()
+        self._free = []
+
+
+class _Task:
+    __slots__ = (
+        "id",
+        "future",
+        "data",
+        "buffers",
+        "resources",
+        "worker",
+        "n_tasks",
+        "memory",
+        "crashes",
+        "submitted",
+    )
+
+    id: int
+    future: Future[Any]
+    data: bytes
+    buffers: list[memoryview] | None
+    "The task's out-of-band buffers, until they are copied to shared memory."
+    resources: dict[str, bytes] | None
+    "The pickled worker resources the task uses, by key."
+    worker: _Worker | None
+    "The worker the task must run on, if any."
+    n_tasks: int
+    "The number of tasks the task runs, if it runs a batch."
+    memory: shm.SharedMemory | None
+    "The shared memory holding the task's out-of-band buffers."
+    crashes: int
+    submitted: float
+
+    def __init__(
+        self,
+        id: int,
+        future: Future[Any],
+        data: bytes,
+        buffers: list[memoryview] | None,
+        resources: dict[str, bytes] | None,
+        n_tasks: int = 1,
+    ):
+        self.id = id
+        self.future = future
+        self.data = data
+        self.buffers = buffers
+        self.resources = resources
+        self.worker = None
+        self.n_tasks = n_tasks
+        self.memory = None
+        self.crashes = 0
+        self.submitted = time.perf_counter()
+
+    def share_buffers(self, arena: _ArgArena) -> tuple[str, list[tuple[int, int]]] | None:
+        """
+        Copy the task's out-of-band buffers into shared memory (if they are not
+        already there), and return the segment name and buffer positions.
+        """
+        if self.buffers is None:
+            return None
+
+        blocks: list[tuple[int, int]] = []
+        end = 0
+        for buf in self.buffers:
+            start = -(-end // _ARG_ALIGN) * _ARG_ALIGN
+            end = start + buf.nbytes
+            blocks.append((start, end))
+
+        if self.memory is None:
+            self.memory = arena.acquire(end)
+            for (start, end), buf in zip(blocks, self.buffers):
+                self.memory.buf[start:end] = buf
+        return self.memory.name, blocks
+
+
+class _Worker:
+    """
+    The parent's view of a worker process.
+    """
+
+    process: BaseProcess
+    tasks: _TaskQueue
+    results: Connection
+    assigned: deque[_Task]
+    "The tasks sent to the worker and not yet completed, in order."
+    n_assigned: int = 0
+    ready: bool = False
+    "Whether the worker has finished initializing."
+    retiring: bool = False
+    "Whether the worker should stop receiving tasks."
+    exiting: bool = False
+    "Whether the worker has been told to exit."
+    eof: bool = False
+    task_start: float | None = None
+    "When the worker started its current task, if it is running one."
+    timed_out: bool = False
+    cpu_slot: int | None = None
+    "The index of the CPU set the worker is pinned to."
+    installed: OrderedDict[str, None]
+    "The keys of the resources sent to the worker, least recently used first."
+
+    def __init__(self, process: BaseProcess, tasks: _TaskQueue, results: Connection):
+        self.process = process
+        self.tasks = tasks
+        self.results = results
+        self.assigned = deque()
+        self.installed = OrderedDict()
+
+    def assign(
+        self,
+        task: _Task,
+        oob: tuple[str, list[tuple[int, int]]] | None,
+        updates: tuple[list[str], list[tuple[str, bytes]]],
+    ):
+        self.tasks.put((task.id, task.data, oob, *updates))
+        self.assigned.append(task)
+        self.n_assigned += task.n_tasks
+
+    def remove_resource(self, key: str):
+        "Tell the worker to remove a resource, if it has it."
+        if key in self.installed and not self.exiting:
+            del self.installed[key]
+            self.tasks.put((None, None, None, [key], []))
+
+    def exit(self):
+        self.tasks.put(None)
+        self.exiting = True
+
+    def close(self):
+        self.tasks.close()
+        self.tasks.cancel_join_thread()
+        self.results.close()
+
+
+class PoolExecutor(Executor, ABC):
+    """
+    Base class for executors that run tasks in pools of worker processes.
+    """
+
+    @property
+    @abstractmethod
+    def n_jobs(self) -> int:
+        "The number of worker processes."
+        raise NotImplementedError()
+
+    @property
+    @abstractmethod
+    def broken(self) -> BaseException | None:
+        """
+        The error that broke the pool, if it is broken.
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def stats(self) -> InvokerStats:
+        """
+        Get a snapshot of the pool's runtime statistics.
+        """
+        raise NotImplementedError()
+
+    def submit_batch(self, fn: Callable[..., Any], batch: list[tuple[Any, ...]]) -> Future[Any]:
+        """
+        Submit a task that runs a batch of argument tuples, such as a chunk of
+        :meth:`map`.  Executors that recycle workers count it as ``len(batch)``
+        tasks.
+
+        Args:
+            fn: The function to call with the batch.
+            batch: The batch of argument tuples.
+        """
+        return self.submit(fn, batch)
+
+    @abstractmethod
+    def submit_each(
+        self, fn: Callable[..., Any], /, *args: Any, **kwargs: Any
+    ) -> list[Future[Any]]:
+        """
+        Submit a task to run once on each worker process, such as to install
+        and load a worker resource before it is needed.  If a worker exits
+        before running its copy of the task, another worker runs it.
+
+        Returns:
+            The futures of the submitted tasks, one per worker.
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def remove_resource(self, key: str):
+        """
+        Remove a worker resource from the workers that have it installed, once
+        they finish the tasks already assigned to them.  Tasks that use the
+        resource after it is removed send it again.
+
+        Args:
+            key: The resource's key.
+        """
+        raise NotImplementedError()
+
+    def map(
+        self,
+        fn: Callable[..., Any],
+        *iterables: Iterable[Any],
+        timeout: float | None = None,
+        chunksize: int = 1,
+    ) -> Iterator[Any]:
+        if chunksize < 1:
+            raise ValueError("chunksize must be >= 1.")
+        elif chunksize == 1:
+            return super().map(fn, *iterables, timeout=timeout)
+
+        tasks = zip(*iterables)
+        chunks = iter(lambda: list(islice(tasks, chunksize)), [])
+        futures = [self.submit_batch(partial(_run_chunk, fn), chunk) for chunk in chunks]
+        return _flatten(_results(futures, timeout))
+
+
+class ProcessExecutor(PoolExecutor):
+    """
+    Executor that runs tasks in a pool of worker processes, optionally
+    recycling workers.  Workers are started (and restarted) with the
+    initializer, so a replacement worker re-installs and loads the already
+    persisted model instead of requiring the parent to send it again.
+
+    Args:
+        n_jobs:
+            The number of worker processes.
+        mp_context:
+            The multiprocessing context for starting workers.
+        initializer:
+            A function to initialize each worker process.
+        initargs:
+            The arguments to ``initializer``.
+        max_tasks:
+            The number of tasks after which to replace a worker.  Batches
+            submitted with :meth:`submit_batch` count each of their tasks.
+        max_rss:
+            The private resident memory size (in bytes) after which to
+            replace a worker.
+        retries:
+            The number of times to retry a task whose worker dies while running
+            it, before failing it with :class:`WorkerCrashError`.  Other tasks
+            queued on the dead worker are re-dispatched without counting
+            against their budgets.
+        timeout:
+            The maximum time (in seconds) a task may run.  If a task runs
+            longer, its worker is killed and replaced, and the task fails with
+            :class:`TaskTimeoutError`.
+        cpu_sets:
+            CPU sets to pin workers to.  Each worker is pinned to the set with
+            the fewest active workers, so replacement workers take the sets of
+            the workers they replace.
+        max_resources:
+            The maximum number of worker resources to keep installed in each
+            worker.
+    """
+
+    _manager: _Manager
+
+    def __init__(
+        self,
+        n_jobs: int,
+        mp_context: BaseContext,
+        initializer: Callable[..., None] | None = None,
+        initargs: tuple[Any, ...] = (),
+        *,
+        max_tasks: int | None = None,
+        max_rss: int | None = None,
+        retries: int = 0,
+        timeout: float | None = None,
+        cpu_sets: list[set[int]] | None = None,
+        max_resources: int | None = None,
+    ):
+        if n_jobs < 1:
+            raise ValueError("n_jobs must be positive")
+        self._manager = _Manager(
+            n_jobs,
+            mp_context,
+            initializer,
+            initargs,
+            max_tasks,
+            max_rss,
+            retries,
+            timeout,
+            cpu_sets,
+            max_resources,
+        )
+        self._manager.start()
+        weakref.finalize(self, self._manager.stop)
+
+    @property
+    def n_jobs(self) -> int:
+        return self._manager.n_jobs
+
+    @property
+    def broken(self) -> BaseException | None:
+        return self._manager.broken
+
+    def stats(self) -> InvokerStats:
+        return self._manager.stats()
+
+    def submit(self, fn: Callable[..., Any], /, *args: Any, **kwargs: Any) -> Future[Any]:
+        return self._manager.submit(fn, args, kwargs)
+
+    def submit_batch(self, fn: Callable[..., Any], batch: list[tuple[Any, ...]]) -> Future[Any]:
+        return self._manager.submit(fn, (batch,), {}, len(batch))
+
+    def submit_each(
+        self, fn: Callable[..., Any], /, *args: Any, **kwargs: Any
+    ) -> list[Future[Any]]:
+        return self._manager.submit_each(fn, args, kwargs)
+
+    def remove_resource(self, key: str):
+        self._manager.remove_resource(key)
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False):
+        self._manager.stop(cancel_futures)
+        if wait:
+            self._manager.join()
+
+
+class _Manager(threading.Thread):
+    """
+    Thread that assigns tasks to workers, receives their results, and replaces
+    workers as needed.  It does not reference the executor, so an abandoned
+    executor can be garbage-collected and shut down.
+    """
+
+    n_jobs: int
+    broken: BaseException | None = None
+    _workers: list[_Worker]
+    _queue: deque[_Task]
+    _stopping: bool = False
+    _n_done: int = 0
+    _n_failed: int = 0
+    _load_time: float = 0.0
+    _compute_time: dict[int, float]
+    _resource_data: dict[str, bytes]
+    "Pickled worker resources, by key, so they are only pickled once."
+    _removals: list[str]
+    "Keys of resources to remove from the workers."
+    _queue_wait: float = 0.0
+    _bytes_sent: int = 0
+    _bytes_received: int = 0
+
+    def __init__(
+        self,
+        n_jobs: int,
+        mp_context: BaseContext,
+        initializer: Callable[..., None] | None,
+        initargs: tuple[Any, ...],
+        max_tasks: int | None,
+        max_rss: int | None,
+        retries: int,
+        timeout: float | None,
+        cpu_sets: list[set[int]] | None,
+        max_resources: int | None,
+    ):
+        super().__init__(name="parinvoke-pool-manager", daemon=True)
+        self.n_jobs = n_jobs
+        self.mp_context = mp_context
+        self.initializer = initializer
+        self.initargs = initargs
+        self.max_tasks = max_tasks
+        self.max_rss = max_rss
+        self.retries = retries
+        self.timeout = timeout
+        self.cpu_sets = cpu_sets
+        self.max_resources = max_resources
+        self._lock = threading.Lock()
+        self._ids = count()
+        self._queue = deque()
+        # imported here, as the sharing modules depend on the invokers
+        from parinvoke.sharing.shm import SHM_AVAILABLE
+
+        self.shm_args = SHM_AVAILABLE
+        self._arena = _ArgArena(PREFETCH * n_jobs)
+        self._compute_time = {}
+        self._resource_data = {}
+        self._removals = []
+        self._wake_r, self._wake_w = mp_context.Pipe(duplex=False)
+        self._workers = []
+        for _i in range(n_jobs):
+            self._workers.append(self._spawn())
+
+    def submit(
+        self,
+        fn: Callable[..., Any],
+        args: tuple[Any, ...],
+        kwargs: dict[str, Any],
+        n_tasks: int = 1,
+    ):
+        fut: Future[Any] = Future()
+        try:
+            data, buffers, resources = _pickle_task(
+                fn, args, kwargs, self.shm_args, self._resource_data
+            )
+        except BaseException as e:
+            fut.set_exception(e)
+            return fut
+
+        with self._lock:
+            if self.broken is not None:
+                raise BrokenProcessPool("worker pool is broken") from self.broken
+            if self._stopping:
+                raise RuntimeError("cannot schedule new futures after shutdown")
+            self._queue.append(_Task(next(self._ids), fut, data, buffers, resources, n_tasks))
+        self._wake()
+        return fut
+
+    def submit_each(
+        self, fn: Callable[..., Any], args: tuple[Any, ...], kwargs: dict[str, Any]
+    ) -> list[Future[Any]]:
+        data, buffers, resources = _pickle_task(
+            fn, args, kwargs, self.shm_args, self._resource_data
+        )
+        with self._lock:
+            if self.broken is not None:
+                raise BrokenProcessPool("worker pool is broken") from self.broken
+            if self._stopping:
+                raise RuntimeError("cannot schedule new futures after shutdown")
+            tasks: list[_Task] = []
+            for worker in self._workers:
+                if not worker.retiring:
+                    task = _Task(next(self._ids), Future(), data, buffers, resources)
+                    task.worker = worker
+                    tasks.append(task)
+            self._queue.extend(tasks)
+        self._wake()
+        return [t.future for t in tasks]
+
+    def stats(self) -> InvokerStats:
+        compute = dict(self._compute_time)
+        return InvokerStats(
+            tasks=self._n_done,
+            failed=self._n_failed,
+            load_time=self._load_time,
+            compute_time=sum(compute.values()),
+            worker_compute_time=compute,
+            queue_wait=self._queue_wait,
+            bytes_sent=self._bytes_sent,
+            bytes_received=self._bytes_received,
+        )
+
+    def remove_resource(self, key: str):
+        self._resource_data.pop(key, None)
+        with self._lock:
+            self._removals.append(key)
+        self._wake()
+
+    def stop(self, cancel_futures: bool = False):
+        with self._lock:
+            self._stopping = True
+            if cancel_futures:
+                while self._queue:
+                    self._queue.popleft().future.cancel()
+        self._wake()
+
+    def run(self):
+        _live_managers.add(self)
+        try:
+            self._run()
+        except BaseException as e:
+            _log.error("worker pool failed: %s", e)
+            self._break(e)
+        finally:
+            self._finish()
+            _live_managers.discard(self)
+
+    def _run(self):
+        while True:
+            self._assign()
+            if self._stopping and self._idle():
+                return
+
+            conns = {w.results: w for w in self._workers if not w.eof}
+            sentinels = {w.process.sentinel: w for w in self._workers}
+            for obj in wait([self._wake_r, *conns, *sentinels], self._next_deadline()):
+                if obj is self._wake_r:
+                    while self._wake_r.poll():
+                        self._wake_r.recv_bytes()
+                elif isinstance(obj, Connection):
+                    self._receive(conns[obj])
+                else:
+                    self._reap(sentinels[obj])
+            self._check_deadlines()
+
+    def _next_deadline(self) -> float | None:
+        "Get the time until the next task deadline."
+        if self.timeout is None:
+            return None
+        starts = [
+            w.task_start for w in self._workers if w.task_start is not None and not w.timed_out
+        ]
+        if starts:
+            return max(min(starts) + self.timeout - time.perf_counter(), 0)
+        else:
+            return None
+
+    def _check_deadlines(self):
+        if self.timeout is None:
+            return
+        now = time.perf_counter()
+        for worker in self._workers:
+            start = worker.task_start
+            if start is not None and not worker.timed_out and now - start > self.timeout:
+                _log.warning(
+                    "task on worker %s timed out after %.1fs, killing worker",
+                    worker.process.pid,
+                    now - start,
+                )
+                worker.timed_out = True
+                worker.process.kill()
+
+    def _wake(self):
+        try:
+            self._wake_w.send_bytes(b"")
+        except OSError:
+            # the manager has finished
+            pass
+
+    def _spawn(self) -> _Worker:
+        cpu_slot = None
+        cpus = None
+        if self.cpu_sets:
+            active = [w.cpu_slot for w in self._workers if not w.retiring]
+            cpu_slot = min(range(len(self.cpu_sets)), key=active.count)
+            cpus = self.cpu_sets[cpu_slot]
+
+        tasks = _TaskQueue(ctx=self.mp_context)
+        results, child_results = self.mp_context.Pipe(duplex=False)
+        proc = self.mp_context.Process(  # type: ignore
+            target=_worker_main,
+            args=(
+                tasks,
+                child_results,
+                self.initializer,
+                self.initargs,
+                self.max_rss is not None,
+                cpus,
+            ),
+        )
+        proc.start()
+        child_results.close()
+        _log.debug("started worker process %s", proc.pid)
+        worker = _Worker(proc, tasks, results)
+        worker.cpu_slot = cpu_slot
+        return worker
+
+    def _idle(self) -> bool:
+        return not self._queue and all(not w.assigned for w in self._workers)
+
+    def _assign(self):
+        with self._lock:
+            # workers receive removals before the tasks queued after them
+            for key in self._removals:
+                for worker in self._workers:
+                    worker.remove_resource(key)
+            self._removals.clear()
+
+            while self._queue:
+                worker = self._queue[0].worker
+                if worker is not None and (worker.retiring or worker not in self._workers):
+                    # the worker is gone, so any worker can run the task
+                    worker = self._queue[0].worker = None
+                if worker is None:
+                    worker = min(
+                        (w for w in self._workers if not w.retiring and len(w.assigned) < PREFETCH),
+                        key=lambda w: len(w.assigned),
+                        default=None,
+                    )
+                elif len(worker.assigned) >= PREFETCH:
+                    worker = None
+                if worker is None:
+                    break
+                task = self._queue.popleft()
+                task.worker = None
+                # re-dispatched tasks are already running
+                if not task.future.running() and not task.future.set_running_or_notify_cancel():
+                    continue
+                oob = task.share_buffers(self._arena)
+                remove, install = _resource_updates(
+                    worker.installed, task.resources, self.max_resources
+                )
+                worker.assign(task, oob, (remove, install))
+                self._bytes_sent += len(task.data) + sum(len(d) for _k, d in install)
+                if task.memory is not None:
+                    self._bytes_sent += task.memory.size
+                if worker.task_start is None:
+                    self._start_next(worker)
+                if self.max_tasks is not None and worker.n_assigned >= self.max_tasks:
+                    self._retire(worker, f"reached {worker.n_assigned} tasks")
+
+        for worker in self._workers:
+            if worker.retiring and not worker.exiting and not worker.assigned:
+                worker.exit()
+
+    def _start_next(self, worker: _Worker):
+        """
+        Record that a worker has moved on to its next task, if it has one.
+        """
+        if worker.ready and worker.assigned:
+            worker.task_start = time.perf_counter()
+            self._queue_wait += worker.task_start - worker.assigned[0].submitted
+        else:
+            worker.task_start = None
+
+    def _release(self, task: _Task, retained: bool = False):
+        """
+        Release a finished task's shared memory.  If the worker retained
+        references to the task's arguments, the memory is not reused.
+        """
+        task.buffers = None
+        if task.memory is not None:
+            if retained:
+                _log.debug(
+                    "task %d retained its arguments, discarding %s", task.id, task.memory.name
+                )
+                self._arena.discard(task.memory)
+            else:
+                self._arena.release(task.memory)
+            task.memory = None
+
+    def _retire(self, worker: _Worker, reason: str):
+        _log.debug("retiring worker %s: %s", worker.process.pid, reason)
+        worker.retiring = True
+        if not self._stopping or self._queue:
+            self._workers.append(self._spawn())
+
+    def _receive(self, worker: _Worker):
+        try:
+            while worker.results.poll():
+                data = worker.results.recv_bytes()
+                self._bytes_received += len(data)
+                kind, task_id, value, rss, compute, load, n_tasks, retained = pickle.loads(data)
+                del data
+                if kind == _LOG:
+                    inject_worker_logs(value)
+                    continue
+                self._load_time += load
+                if kind == _READY:
+                    worker.ready = True
+                    self._start_next(worker)
+                    continue
+                elif kind == _INIT_ERROR:
+                    raise BrokenProcessPool("worker failed to initialize") from _unwrap(value)
+
+                task = worker.assigned.popleft()
+                assert task.id == task_id, "task out of order"
+                self._release(task, retained)
+                pid = worker.process.pid
+                assert pid is not None
+                self._n_done += n_tasks
+                self._compute_time[pid] = self._compute_time.get(pid, 0.0) + compute
+                if kind == _RESULT:
+                    task.future.set_result(value)
+                else:
+                    self._n_failed += n_tasks
+                    task.future.set_exception(_unwrap(value))
+                del task, value
+                self._start_next(worker)
+
+                if (
+                    self.max_rss is not None
+                    and rss is not None
+                    and rss > self.max_rss
+                    and not worker.retiring
+                ):
+                    self._retire(worker, f"resident size {rss / (1024 * 1024):.1f} MiB")
+        except EOFError:
+            worker.eof = True
+
+    def _reap(self, worker: _Worker):
+        if worker not in self._workers:
+            return
+        if not worker.eof:
+            self._receive(worker)
+        worker.process.join()
+        self._workers.remove(worker)
+        worker.close()
+        if worker.exiting:
+            _log.debug("worker process %s exited", worker.process.pid)
+        elif not worker.ready:
+            # retrying a worker that cannot start would loop forever
+            raise BrokenProcessPool(
+                f"worker process {worker.process.pid} died during startup"
+                f" with code {worker.process.exitcode}"
+            )
+        else:
+            self._recover(worker)
+
+    def _recover(self, worker: _Worker):
+        """
+        Recover from a worker dying unexpectedly, by replacing it and
+        re-dispatching its tasks.
+        """
+        pid = worker.process.pid
+        code = worker.process.exitcode
+        if not worker.timed_out:
+            _log.warning("worker process %s died with code %s", pid, code)
+
+        tasks = list(worker.assigned)
+        worker.assigned.clear()
+        if tasks:
+            # the worker runs its tasks in order, so it died running the first one
+            task = tasks[0]
+            task.crashes += 1
+            if worker.timed_out or task.crashes > self.retries:
+                self._release(task)
+            if worker.timed_out:
+                tasks = tasks[1:]
+                err = TaskTimeoutError(f"task exceeded timeout of {self.timeout}s")
+                task.future.set_exception(err)
+            elif task.crashes > self.retries:
+                tasks = tasks[1:]
+                err = WorkerCrashError(
+                    f"worker process {pid} died with code {code} running task"
+                    f" ({task.crashes} attempts)"
+                )
+                task.future.set_exception(err)
+            else:
+                _log.info("retrying task (attempt %d)", task.crashes + 1)
+
+        with self._lock:
+            self._queue.extendleft(reversed(tasks))
+            # a retiring worker was already replaced, unless it was retired
+            # while stopping and its tasks now have nowhere to run
+            active = any(not w.retiring for w in self._workers)
+            if (not self._stopping or self._queue) and (not worker.retiring or not active):
+                self._workers.append(self._spawn())
+
+    def _break(self, cause: BaseException):
+        with self._lock:
+            self.broken = cause
+            tasks = list(self._queue)
+            self._queue.clear()
+        for worker in self._workers:
+            tasks += worker.assigned
+            worker.assigned.clear()
+            worker.process.terminate()
+
+        for task in tasks:
+            self._release(task)
+            if not task.future.done():
+                err = BrokenProcessPool("worker pool is broken")
+                err.__cause__ = cause
+                task.future.set_exception(err)
+
+    def _finish(self):
+        for worker in self._workers:
+            if not worker.exiting and worker.process.is_alive():
+                worker.exit()
+        for worker in self._workers:
+            worker.process.join()
+            worker.close()
+        self._workers = []
+        self._arena.close()
+        self._wake_w.close()
+        self._wake_r.close()
+
+
+def _results(futures: list[Future[Any]], timeout: float | None) -> Iterator[Any]:
+    """
+    Yield the results of futures in order, like :meth:`Executor.map`, cancelling
+    the pending futures if closed early.
+    """
+    end = None if timeout is None else time.monotonic() + timeout
+    # reverse to pop the futures in order, so finished ones are not referenced
+    futures.reverse()
+    try:
+        while futures:
+            fut = futures.pop()
+            try:
+                result = fut.result(None if end is None else end - time.monotonic())
+            except BaseException:
+                fut.cancel()
+                raise
+            del fut
+            yield result
+    finally:
+        for fut in futures:
+            fut.cancel()
+
+
+def _flatten(results: Iterator[list[Any]]) -> Iterator[Any]:
+    "Flatten chunk results, cancelling the pending chunks if closed early."
+    try:
+        for chunk in results:
+            yield from chunk
+    finally:
+        cast(Generator[Any, None, None], results).close()
+
+
+def _run_chunk(fn: Callable[..., Any], chunk: list[tuple[Any, ...]]) -> list[Any]:
+    record_task_count(len(chunk))
+    return [fn(*args) for args in chunk]
+
+
+class _TaskPickler(pickle.Pickler):
+    """
+    Pickler for tasks, which replaces worker resources with references to the
+    objects installed in the worker and collects them to send separately.
+    """
+
+    resources: dict[str, WorkerResource]
+
+    def __init__(self, file: io.BytesIO, buffer_callback: Callable[[Any], Any] | None = None):
+        super().__init__(file, pickle.HIGHEST_PROTOCOL, buffer_callback=buffer_callback)
+        self.resources = {}
+
+    def reducer_override(self, obj: Any) -> Any:
+        if isinstance(obj, WorkerResource):
+            self.resources[obj.key] = obj
+            return _installed_resource, (obj.key,)
+        return NotImplemented
+
+
+def _pickle_task(
+    fn: Callable[..., Any],
+    args: tuple[Any, ...],
+    kwargs: dict[str, Any],
+    oob: bool,
+    resource_data: dict[str, bytes],
+) -> tuple[bytes, list[memoryview] | None, dict[str, bytes] | None]:
+    """
+    Pickle a task, separating large buffers out-of-band (if ``oob`` is true) so
+    they can be sent through shared memory, and worker resources so they can
+    be sent once per worker.  Resources are pickled once, and cached in
+    ``resource_data``.
+
+    Returns:
+        The task's pickle data, out-of-band buffers, and pickled resources.
+    """
+    buffers: list[memoryview] = []
+
+    def out_of_band(buf: pickle.PickleBuffer) -> bool:
+        # pickle only emits contiguous buffers (NumPy copies non-contiguous
+        # arrays in-band), so they always have a raw view
+        raw = buf.raw()
+        if raw.nbytes < ARG_SHM_THRESHOLD:
+            return True
+        buffers.append(raw)
+        return False
+
+    out = io.BytesIO()
+    pickler = _TaskPickler(out, out_of_band if oob else None)
+    pickler.dump((fn, args, kwargs))
+
+    resources: dict[str, bytes] | None = None
+    if pickler.resources:
+        resources = {}
+        for key, resource in pickler.resources.items():
+            data = resource_data.get(key, None)
+            if data is None:
+                data = pickle.dumps(resource, pickle.HIGHEST_PROTOCOL)
+                resource_data[key] = data
+            resources[key] = data
+
+    return out.getvalue(), buffers or None, resources
+
+
+def _resource_updates(
+    installed: OrderedDict[str, None], needed: dict[str, bytes] | None, limit: int | None
+) -> tuple[list[str], list[tuple[str, bytes]]]:
+    """
+    Compute the resources to remove from and install in a worker before it
+    runs a task, updating the worker's installed resources.
+
+    Args:
+        installed: The keys of the worker's resources, least recently used first.
+        needed: The pickled resources the task uses.
+        limit: The maximum number of resources the worker keeps installed.
+
+    Returns:
+        The keys of the resources to remove, and the keys and data of the
+        resources to install.
+    """
+    remove: list[str] = []
+    install: list[tuple[str, bytes]] = []
+    if not needed:
+        return remove, install
+
+    for key, data in needed.items():
+        if key in installed:
+            installed.move_to_end(key)
+        else:
+            installed[key] = None
+            install.append((key, data))
+
+    if limit is not None and len(installed) > limit:
+        for key in list(installed):
+            if len(installed) <= limit:
+                break
+            if key not in needed:
+                del installed[key]
+                remove.append(key)
+
+    return remove, install
+
+
+def _update_resources(remove: list[str], install: list[tuple[str, bytes]]):
+    """
+    Remove and install resources in a worker process.  Installation is
+    deferred until a task uses the resource, so installation errors are
+    reported by the tasks.
+    """
+    for key in remove:
+        _worker_resource_data.pop(key, None)
+        value = _worker_resources.pop(key, None)
+        close = getattr(value, "close", None)
+        if close is not None:
+            try:
+                close()
+            except Exception as e:
+                _log.warning("error removing resource %s: %s", key, e)
+        del value, close
+
+    for key, data in install:
+        _worker_resource_data[key] = data
+
+
+def _installed_resource(key: str) -> Any:
+    "Get the object installed for a resource in a worker, installing it if needed."
+    try:
+        return _worker_resources[key]
+    except KeyError:
+        pass
+
+    try:
+        data = _worker_resource_data[key]
+    except KeyError:
+        raise RuntimeError(f"resource {key} was not sent to worker")
+    resource: WorkerResource = pickle.loads(data)
+    value = _worker_resources[key] = resource.install()
+    return value
+
+
+def _wrap_exception(e: BaseException) -> tuple[BaseException, str]:
+    tb = "".join(traceback.format_exception(type(e), e, e.__traceback__))
+    return e, tb
+
+
+def _unwrap(value: tuple[BaseException, str]) -> BaseException:
+    exc, tb = value
+    exc.__cause__ = _RemoteTraceback(f'\n"""\n{tb}"""')
+    return exc
+
+
+def record_load_time(elapsed: float):
+    """
+    Record time a worker process spent loading its model, to report with the
+    next message to the parent.
+    """
+    global _worker_load_time
+    _worker_load_time += elapsed
+
+
+def record_task_count(n: int):
+    """
+    Record the number of tasks in the batch a worker process is running, to
+    report with its result.  Tasks that do not record a count are counted as
+    one task.
+    """
+    global _worker_task_count
+    _worker_task_count = n
+
+
+def _send(
+    conn: Connection,
+    kind: int,
+    task_id: int | None,
+    value: Any,
+    rss: int | None,
+    compute: float,
+    retained: bool = False,
+):
+    global _worker_load_time, _worker_task_count
+    n_tasks = 1 if _worker_task_count is None else _worker_task_count
+    meta = (rss, compute, _worker_load_time, n_tasks, retained)
+    try:
+        data = pickle.dumps((kind, task_id, value, *meta), pickle.HIGHEST_PROTOCOL)
+    except BaseException as e:
+        if kind == _RESULT:
+            kind = _ERROR
+        data = pickle.dumps((kind, task_id, _wrap_exception(e), *meta), pickle.HIGHEST_PROTOCOL)
+    _worker_load_time = 0.0
+    _worker_task_count = None
+    with _worker_send_lock:
+        conn.send_bytes(data)
+
+
+class _LogPipe:
+    """
+    Log sink that sends a worker's log records to the parent through its result
+    pipe, so killing a worker cannot leave a log queue shared with other
+    workers locked.
+    """
+
+    def __init__(self, conn: Connection):
+        self.conn = conn
+
+    def put_nowait(self, item: LogBatch, /):
+        data = pickle.dumps((_LOG, None, item, None, 0.0, 0.0, 0, False), pickle.HIGHEST_PROTOCOL)
+        with _worker_send_lock:
+            self.conn.send_bytes(data)
+
+
+def pin_worker(cpus: set[int]):
+    """
+    Pin the current worker process to a set of CPUs.  This is done before the
+    worker is initialized, so the threads it starts inherit the affinity.
+    """
+    try:
+        os.sched_setaffinity(0, cpus)
+    except (AttributeError, OSError) as e:
+        _log.warning("cannot pin worker %d to CPUs %s: %s", os.getpid(), sorted(cpus), e)
+
+
+def worker_rss() -> int | None:
+    """
+    Get the private resident memory size of the current process, in bytes.
+    This excludes shared memory and memory-mapped files, so models shared
+    with the workers do not count against them.  Where private resident size
+    is unavailable, this falls back to the process's peak resident size.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            fields = f.read().split()
+        return (int(fields[1]) - int(fields[2])) * mmap.PAGESIZE
+    except OSError:
+        pass
+
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, other systems report KiB
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def _worker_main(
+    tasks: _TaskQueue,
+    results: Connection,
+    initializer: Callable[..., None] | None,
+    initargs: tuple[Any, ...],
+    report_rss: bool,
+    cpus: set[int] | None = None,
+):
+    "Main loop of a worker process."
+    from parinvoke.sharing.shm import _close_memory
+
+    if cpus is not None:
+        pin_worker(cpus)
+    route_worker_logs(_LogPipe(results))
+    if initializer is not None:
+        try:
+            initializer(*initargs)
+        except BaseException as e:
+            _send(results, _INIT_ERROR, None, _wrap_exception(e), None, 0.0)
+            return
+    _send(results, _READY, None, None, None, 0.0)
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            close_worker_logs()
+            return
+
+        task_id, data, oob, remove, install = task
+        _update_resources(remove, install)
+        if task_id is None:
+            # a resource update without a task
+            continue
+
+        memory = None
+        load = _worker_load_time
+        start = time.perf_counter()
+        try:
+            if oob is None:
+                fn, args, kwargs = pickle.loads(data)
+            else:
+                name, blocks = oob
+                memory = shm.SharedMemory(name)
+                buffers = [memory.buf[bs:be] for bs, be in blocks]
+                fn, args, kwargs = pickle.loads(data, buffers=buffers)
+                del buffers
+            kind, value = _RESULT, fn(*args, **kwargs)
+            del fn, args, kwargs
+        except BaseException as e:
+            kind, value = _ERROR, _wrap_exception(e)
+        # a task that loads the model reports the load time separately
+        compute = time.perf_counter() - start - (_worker_load_time - load)
+        del task, data
+
+        # the parent reuses the memory for other tasks once it has the result,
+        # unless the task kept references to its arguments
+        retained = memory is not None and not _close_memory(memory)
+        del memory
+        rss = worker_rss() if report_rss else None
+        _send(results, kind, task_id, value, rss, compute, retained)
+        del value
+
+
+@atexit.register
+def _shutdown_all():
+    # stop workers before multiprocessing tries to join them at exit
+    for manager in list(_live_managers):
+        manager.stop(cancel_futures=True)
+    for manager in list(_live_managers):
+        manager.join()
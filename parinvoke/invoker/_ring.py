@@ -0,0 +1,582 @@
+# This file is part of parinvoke.
+# Copyright (C) 2020-2023 Boise State University
+# Copyright (C) 2023-2024 Drexel University
+# Licensed under the MIT license, see LICENSE.md for details.
+# SPDX-License-Identifier: MIT
+
+"""
+Process pool executor that exchanges tasks and results with its workers
+through ring buffers in shared memory.
+
+Each worker has a shared memory segment with :data:`RING_SLOTS` request slots
+and as many result slots.  The parent keeps at most :data:`RING_SLOTS` tasks in
+flight on each worker, so the *i*-th task sent to a worker always uses slot
+``i % RING_SLOTS`` in each direction and a slot is never overwritten while it
+is in use; no shared indices are needed.  Each worker waits for tasks on its
+own semaphore and posts its results to another; it also posts a semaphore
+shared by all workers, which the parent waits on before polling the workers'
+result semaphores.  Semaphores order the writes to the slots, and on Linux they
+are futex-based, so a task round trip involves no pipes, locks, or feeder
+threads.  Messages too large for a slot are spilled to their own shared memory
+segment.  Worker resources are sent with the first task that uses them on each
+worker, as with the process executor.
+
+This backend is for very short tasks, where the cost of the pipes behind
+:class:`~parinvoke.invoker._executor.ProcessExecutor` dominates.  It does not
+recycle workers, retry tasks, or enforce timeouts; if a worker dies, the pool
+is broken.
+"""
+
+from __future__ import annotations
+
+import logging
+import multiprocessing.shared_memory as shm
+import pickle
+import struct
+import threading
+import time
+import weakref
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.context import BaseContext
+from multiprocessing.process import BaseProcess
+from multiprocessing.synchronize import Semaphore
+from typing import Any, Callable
+
+from parinvoke.invoker import _executor
+from parinvoke.invoker._executor import (
+    PoolExecutor,
+    _pickle_task,
+    _resource_updates,
+    _unwrap,
+    _update_resources,
+    _wrap_exception,
+    pin_worker,
+)
+from parinvoke.invoker._stats import InvokerStats
+from parinvoke.logging import close_worker_logs
+
+_log = logging.getLogger(__name__)
+
+RING_SLOTS = 8
+"""
+The number of slots in each ring, which is also the maximum number of tasks in
+flight on each worker.
+"""
+SLOT_SIZE = 64 * 1024
+"""
+The size of each slot (in bytes), including its header.
+"""
+
+# slot header: flags, payload length
+_HEADER = struct.Struct("=BxxxI")
+_SPILLED = 1
+_UPDATES = 2
+"The message is preceded by resource updates."
+_EXIT = 0xFFFFFFFF
+_RESULT = 0
+_ERROR = 1
+_POLL_INTERVAL = 0.1
+
+
+class _Ring:
+    """
+    One direction of a worker's ring buffer.  The writer posts a semaphore
+    after writing a slot, and the reader only reads slots it has acquired.
+    """
+
+    def __init__(self, buf: memoryview):
+        self.buf = buf
+
+    def write(self, seq: int, payload: bytes | None, flags: int = 0):
+        "Write a message (``None`` to tell the worker to exit) to a slot."
+        base = (seq % RING_SLOTS) * SLOT_SIZE
+        start = base + _HEADER.size
+        if payload is None:
+            _HEADER.pack_into(self.buf, base, 0, _EXIT)
+        elif len(payload) <= SLOT_SIZE - _HEADER.size:
+            self.buf[start : start + len(payload)] = payload
+            _HEADER.pack_into(self.buf, base, flags, len(payload))
+        else:
+            # the reader unlinks the spilled message
+            spill = shm.SharedMemory(create=True, size=len(payload))
+            spill.buf[: len(payload)] = payload
+            spill.close()
+            name = spill.name.encode()
+            self.buf[start : start + len(name)] = name
+            _HEADER.pack_into(self.buf, base, flags | _SPILLED, len(name))
+
+    def read(self, seq: int) -> tuple[int, bytes] | None:
+        "Read a message and its flags from a slot."
+        base = (seq % RING_SLOTS) * SLOT_SIZE
+        flags, length = _HEADER.unpack_from(self.buf, base)
+        start = base + _HEADER.size
+        if length == _EXIT:
+            return None
+        elif flags & _SPILLED:
+            spill = shm.SharedMemory(bytes(self.buf[start : start + length]).decode())
+            try:
+                return flags, bytes(spill.buf[: spill.size])
+            finally:
+                spill.close()
+                spill.unlink()
+        else:
+            return flags, bytes(self.buf[start : start + length])
+
+    def release(self):
+        self.buf.release()
+
+
+class _RingWorker:
+    """
+    The parent's view of a ring worker.
+    """
+
+    process: BaseProcess
+    memory: shm.SharedMemory
+    requests: _Ring
+    responses: _Ring
+    tasks: Semaphore
+    results: Semaphore
+    inflight: deque[Future[Any]]
+    "Futures of tasks sent to the worker, in order."
+    installed: OrderedDict[str, None]
+    "The keys of the resources sent to the worker, least recently used first."
+    removals: list[str]
+    "The keys of resources to remove from the worker with its next message."
+    pinned: deque[tuple[Future[Any], bytes, dict[str, bytes] | None]]
+    "Tasks that must run on this worker, waiting for a free slot."
+    n_sent: int = 0
+    n_received: int = 0
+
+    def __init__(
+        self, process: BaseProcess, memory: shm.SharedMemory, tasks: Semaphore, results: Semaphore
+    ):
+        self.process = process
+        self.memory = memory
+        self.requests, self.responses = _rings(memory)
+        self.tasks = tasks
+        self.results = results
+        self.inflight = deque()
+        self.installed = OrderedDict()
+        self.removals = []
+        self.pinned = deque()
+
+    def send(self, payload: bytes | None, flags: int = 0):
+        self.requests.write(self.n_sent, payload, flags)
+        self.n_sent += 1
+        self.tasks.release()
+
+    def receive(self) -> bytes | None:
+        "Receive the next result, if the worker has posted one."
+        if not self.results.acquire(block=False):
+            return None
+        message = self.responses.read(self.n_received)
+        assert message is not None
+        self.n_received += 1
+        return message[1]
+
+    def close(self):
+        self.requests.release()
+        self.responses.release()
+        self.memory.close()
+        self.memory.unlink()
+
+
+class RingExecutor(PoolExecutor):
+    """
+    Executor that runs tasks in a pool of worker processes, communicating with
+    them through shared memory ring buffers.
+
+    Args:
+        n_jobs:
+            The number of worker processes.
+        mp_context:
+            The multiprocessing context for starting workers.
+        initializer:
+            A function to initialize each worker process.
+        initargs:
+            The arguments to ``initializer``.
+        cpu_sets:
+            CPU sets to pin workers to, assigned to workers in turn.
+        max_resources:
+            The maximum number of worker resources to keep installed in each
+            worker.
+    """
+
+    _manager: _RingManager
+
+    def __init__(
+        self,
+        n_jobs: int,
+        mp_context: BaseContext,
+        initializer: Callable[..., None] | None = None,
+        initargs: tuple[Any, ...] = (),
+        *,
+        cpu_sets: list[set[int]] | None = None,
+        max_resources: int | None = None,
+    ):
+        if n_jobs < 1:
+            raise ValueError("n_jobs must be positive")
+        self._manager = _RingManager(
+            n_jobs, mp_context, initializer, initargs, cpu_sets, max_resources
+        )
+        self._manager.start()
+        weakref.finalize(self, self._manager.stop)
+
+    @property
+    def n_jobs(self) -> int:
+        return self._manager.n_jobs
+
+    @property
+    def broken(self) -> BaseException | None:
+        return self._manager.broken
+
+    def stats(self) -> InvokerStats:
+        return self._manager.stats()
+
+    def submit(self, fn: Callable[..., Any], /, *args: Any, **kwargs: Any) -> Future[Any]:
+        return self._manager.submit(fn, args, kwargs)
+
+    def submit_each(
+        self, fn: Callable[..., Any], /, *args: Any, **kwargs: Any
+    ) -> list[Future[Any]]:
+        return self._manager.submit_each(fn, args, kwargs)
+
+    def remove_resource(self, key: str):
+        self._manager.remove_resource(key)
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False):
+        self._manager.stop(cancel_futures)
+        if wait:
+            self._manager.join()
+
+
+class _RingManager(threading.Thread):
+    """
+    Thread that collects results from ring workers.  Tasks are sent to workers
+    directly by :meth:`submit` when they have free slots, and otherwise when
+    results free them.  Like the process executor's manager, it does not
+    reference the executor.
+    """
+
+    n_jobs: int
+    broken: BaseException | None = None
+    _workers: list[_RingWorker]
+    _queue: deque[tuple[Future[Any], bytes, dict[str, bytes] | None]]
+    _stopping: bool = False
+    _n_done: int = 0
+    _n_failed: int = 0
+    _load_time: float = 0.0
+    _compute_time: dict[int, float]
+    _resource_data: dict[str, bytes]
+    _bytes_sent: int = 0
+    _bytes_received: int = 0
+
+    def __init__(
+        self,
+        n_jobs: int,
+        mp_context: BaseContext,
+        initializer: Callable[..., None] | None,
+        initargs: tuple[Any, ...],
+        cpu_sets: list[set[int]] | None,
+        max_resources: int | None,
+    ):
+        super().__init__(name="parinvoke-ring-manager", daemon=True)
+        self.n_jobs = n_jobs
+        self.max_resources = max_resources
+        self._lock = threading.Lock()
+        self._queue = deque()
+        self._compute_time = {}
+        self._resource_data = {}
+        self._posted = mp_context.Semaphore(0)
+        self._workers = []
+        size = 2 * RING_SLOTS * SLOT_SIZE
+        for i in range(n_jobs):
+            cpus = cpu_sets[i % len(cpu_sets)] if cpu_sets else None
+            # the resource tracker unlinks the rings if the parent dies
+            memory = shm.SharedMemory(create=True, size=size)
+            tasks = mp_context.Semaphore(0)
+            results = mp_context.Semaphore(0)
+            proc = mp_context.Process(  # type: ignore
+                target=_ring_worker_main,
+                args=(memory.name, tasks, results, self._posted, initializer, initargs, cpus),
+                daemon=True,
+            )
+            proc.start()
+            self._workers.append(_RingWorker(proc, memory, tasks, results))
+
+    def submit(self, fn: Callable[..., Any], args: tuple[Any, ...], kwargs: dict[str, Any]):
+        fut: Future[Any] = Future()
+        try:
+            payload, _b, resources = _pickle_task(fn, args, kwargs, False, self._resource_data)
+        except BaseException as e:
+            fut.set_exception(e)
+            return fut
+
+        with self._lock:
+            if self.broken is not None:
+                raise BrokenProcessPool("worker pool is broken") from self.broken
+            if self._stopping:
+                raise RuntimeError("cannot schedule new futures after shutdown")
+            self._queue.append((fut, payload, resources))
+            self._dispatch()
+        return fut
+
+    def submit_each(
+        self, fn: Callable[..., Any], args: tuple[Any, ...], kwargs: dict[str, Any]
+    ) -> list[Future[Any]]:
+        payload, _b, resources = _pickle_task(fn, args, kwargs, False, self._resource_data)
+        with self._lock:
+            if self.broken is not None:
+                raise BrokenProcessPool("worker pool is broken") from self.broken
+            if self._stopping:
+                raise RuntimeError("cannot schedule new futures after shutdown")
+            futures: list[Future[Any]] = []
+            for worker in self._workers:
+                fut: Future[Any] = Future()
+                worker.pinned.append((fut, payload, resources))
+                futures.append(fut)
+            self._dispatch()
+        return futures
+
+    def stats(self) -> InvokerStats:
+        compute = dict(self._compute_time)
+        return InvokerStats(
+            tasks=self._n_done,
+            failed=self._n_failed,
+            load_time=self._load_time,
+            compute_time=sum(compute.values()),
+            worker_compute_time=compute,
+            bytes_sent=self._bytes_sent,
+            bytes_received=self._bytes_received,
+        )
+
+    def remove_resource(self, key: str):
+        self._resource_data.pop(key, None)
+        with self._lock:
+            for worker in self._workers:
+                if key in worker.installed:
+                    del worker.installed[key]
+                    worker.removals.append(key)
+            self._dispatch()
+
+    def stop(self, cancel_futures: bool = False):
+        with self._lock:
+            self._stopping = True
+            if cancel_futures:
+                while self._queue:
+                    self._queue.popleft()[0].cancel()
+                for worker in self._workers:
+                    while worker.pinned:
+                        worker.pinned.popleft()[0].cancel()
+        # wake the thread; it finds no result and checks whether it can stop
+        self._posted.release()
+
+    def run(self):
+        _executor._live_managers.add(self)
+        try:
+            self._run()
+        except BaseException as e:
+            _log.error("worker pool failed: %s", e)
+            self._break(e)
+        finally:
+            self._finish()
+            _executor._live_managers.discard(self)
+
+    def _run(self):
+        checked = time.perf_counter()
+        while True:
+            if self._posted.acquire(timeout=_POLL_INTERVAL):
+                # a post without a result is a wakeup, or a result we already
+                # received when polling for an earlier post
+                while self._receive():
+                    pass
+
+            # a busy pool always has a result to receive, so a dead worker's
+            # tasks would wait forever if workers were only checked when idle
+            now = time.perf_counter()
+            if now - checked >= _POLL_INTERVAL:
+                self._check_workers()
+                checked = now
+
+            with self._lock:
+                idle = not self._queue and all(
+                    not w.inflight and not w.pinned for w in self._workers
+                )
+                if self._stopping and idle:
+                    return
+
+    def _dispatch(self):
+        "Send queued tasks to workers with free slots.  Must hold the lock."
+        for worker in self._workers:
+            while worker.pinned and len(worker.inflight) < RING_SLOTS:
+                fut, payload, resources = worker.pinned.popleft()
+                if fut.set_running_or_notify_cancel():
+                    self._send(worker, fut, payload, resources)
+
+        while self._queue:
+            worker = min(self._workers, key=lambda w: len(w.inflight))
+            if len(worker.inflight) >= RING_SLOTS:
+                break
+            fut, payload, resources = self._queue.popleft()
+            if not fut.set_running_or_notify_cancel():
+                continue
+            self._send(worker, fut, payload, resources)
+
+        # removals without a task still need a slot, and produce a result
+        for worker in self._workers:
+            if worker.removals and len(worker.inflight) < RING_SLOTS:
+                self._send(worker, Future(), None, None)
+
+    def _send(
+        self,
+        worker: _RingWorker,
+        fut: Future[Any],
+        payload: bytes | None,
+        resources: dict[str, bytes] | None,
+    ):
+        "Send a task (or, if ``payload`` is ``None``, only resource updates) to a worker."
+        remove, install = _resource_updates(worker.installed, resources, self.max_resources)
+        remove = worker.removals + remove
+        worker.removals = []
+        flags = 0
+        if remove or install or payload is None:
+            payload = pickle.dumps((remove, install, payload), pickle.HIGHEST_PROTOCOL)
+            flags = _UPDATES
+        worker.inflight.append(fut)
+        worker.send(payload, flags)
+        self._bytes_sent += len(payload)
+
+    def _receive(self) -> bool:
+        "Receive one result from any worker that has posted one."
+        for worker in self._workers:
+            payload = worker.receive()
+            if payload is None:
+                continue
+
+            with self._lock:
+                fut = worker.inflight.popleft()
+                self._dispatch()
+
+            self._bytes_received += len(payload)
+            kind, value, compute, load, n_tasks = pickle.loads(payload)
+            pid = worker.process.pid
+            assert pid is not None
+            self._n_done += n_tasks
+            self._compute_time[pid] = self._compute_time.get(pid, 0.0) + compute
+            self._load_time += load
+            if kind == _RESULT:
+                fut.set_result(value)
+            else:
+                self._n_failed += n_tasks
+                fut.set_exception(_unwrap(value))
+            return True
+        return False
+
+    def _check_workers(self):
+        for worker in self._workers:
+            if not worker.process.is_alive():
+                raise BrokenProcessPool(
+                    f"worker process {worker.process.pid} exited unexpectedly"
+                    f" with code {worker.process.exitcode}"
+                )
+
+    def _break(self, cause: BaseException):
+        with self._lock:
+            self.broken = cause
+            futures = [f for f, _p, _r in self._queue]
+            self._queue.clear()
+            for worker in self._workers:
+                futures += worker.inflight
+                futures += [f for f, _p, _r in worker.pinned]
+                worker.inflight.clear()
+                worker.pinned.clear()
+                worker.process.terminate()
+
+        for fut in futures:
+            if not fut.done():
+                err = BrokenProcessPool("worker pool is broken")
+                err.__cause__ = cause
+                fut.set_exception(err)
+
+    def _finish(self):
+        for worker in self._workers:
+            if self.broken is None:
+                worker.send(None)
+            worker.process.join()
+            worker.close()
+        self._workers = []
+
+
+def _rings(memory: shm.SharedMemory) -> tuple[_Ring, _Ring]:
+    half = RING_SLOTS * SLOT_SIZE
+    return _Ring(memory.buf[:half]), _Ring(memory.buf[half : 2 * half])
+
+
+def _ring_worker_main(
+    name: str,
+    tasks: Semaphore,
+    results: Semaphore,
+    posted: Semaphore,
+    initializer: Callable[..., None] | None,
+    initargs: tuple[Any, ...],
+    cpus: set[int] | None = None,
+):
+    "Main loop of a ring worker process."
+    if cpus is not None:
+        pin_worker(cpus)
+    if initializer is not None:
+        initializer(*initargs)
+
+    memory = shm.SharedMemory(name)
+    requests, responses = _rings(memory)
+    seq = 0
+    while True:
+        tasks.acquire()
+        message = requests.read(seq)
+        if message is None:
+            break
+        flags, payload = message
+        if flags & _UPDATES:
+            remove, install, payload = pickle.loads(payload)
+            _update_resources(remove, install)
+            if payload is None:
+                # resource updates without a task
+                responses.write(seq, pickle.dumps((_RESULT, None, 0.0, 0.0, 0)))
+                results.release()
+                posted.release()
+                seq += 1
+                continue
+
+        load = _executor._worker_load_time
+        start = time.perf_counter()
+        try:
+            fn, args, kwargs = pickle.loads(payload)
+            kind, value = _RESULT, fn(*args, **kwargs)
+            del fn, args, kwargs
+        except BaseException as e:
+            kind, value = _ERROR, _wrap_exception(e)
+        compute = time.perf_counter() - start - (_executor._worker_load_time - load)
+        load = _executor._worker_load_time
+        _executor._worker_load_time = 0.0
+        n_tasks = _executor._worker_task_count
+        n_tasks = 1 if n_tasks is None else n_tasks
+        _executor._worker_task_count = None
+
+        meta = (compute, load, n_tasks)
+        try:
+            msg = pickle.dumps((kind, value, *meta), pickle.HIGHEST_PROTOCOL)
+        except BaseException as e:
+            msg = pickle.dumps((_ERROR, _wrap_exception(e), *meta), pickle.HIGHEST_PROTOCOL)
+        del value
+        responses.write(seq, msg)
+        results.release()
+        posted.release()
+        seq += 1
+
+    close_worker_logs()
+    requests.release()
+    responses.release()
+    memory.close()
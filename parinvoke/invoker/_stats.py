@@ -0,0 +1,88 @@
+# This file is part of parinvoke.
+# Copyright (C) 2020-2023 Boise State University
+# Copyright (C) 2023-2024 Drexel University
+# Licensed under the MIT license, see LICENSE.md for details.
+# SPDX-License-Identifier: MIT
+
+"""
+Runtime statistics for invokers.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any, Callable, NamedTuple
+
+
+class InvokerStats(NamedTuple):
+    """
+    A snapshot of an invoker's runtime statistics.  Times are totals in
+    seconds, summed across workers.  Tasks dispatched in batches are counted
+    individually; if a batch fails, all of its tasks count as failed.
+    """
+
+    tasks: int = 0
+    "The number of tasks completed."
+    failed: int = 0
+    "The number of completed tasks that failed."
+    load_time: float = 0.0
+    "Time spent loading (and preparing) the model."
+    compute_time: float = 0.0
+    "Time spent computing tasks."
+    worker_compute_time: dict[int, float] | None = None
+    """
+    Time spent computing tasks, by worker process (or thread) ID, or ``None`` if
+    the invoker does not track it.  ``None`` is the default so snapshots do not
+    share a mutable dictionary.
+    """
+    queue_wait: float = 0.0
+    "Time tasks spent waiting between being submitted and starting."
+    bytes_sent: int = 0
+    "Bytes of pickled tasks sent to worker processes."
+    bytes_received: int = 0
+    "Bytes of pickled results received from worker processes."
+
+
+class TaskTimer:
+    """
+    Time tasks run in the current process.  Each thread accumulates its own
+    totals, so threads do not contend on shared counters.
+    """
+
+    load_time: float = 0.0
+    _threads: dict[int, list[float]]
+
+    def __init__(self):
+        self._threads = {}
+
+    def call(self, func: Callable[..., Any], *args: Any) -> Any:
+        "Call a function, recording its time as one task."
+        start = time.perf_counter()
+        try:
+            result = func(*args)
+        except BaseException:
+            self.record(1, time.perf_counter() - start, failed=1)
+            raise
+        self.record(1, time.perf_counter() - start)
+        return result
+
+    def record(self, n: int, elapsed: float, *, failed: int = 0):
+        "Record completed tasks."
+        ident = threading.get_ident()
+        acc = self._threads.get(ident)
+        if acc is None:
+            acc = self._threads.setdefault(ident, [0, 0, 0.0])
+        acc[0] += n
+        acc[1] += failed
+        acc[2] += elapsed
+
+    def stats(self) -> InvokerStats:
+        accs = list(self._threads.items())
+        return InvokerStats(
+            tasks=int(sum(a[0] for _i, a in accs)),
+            failed=int(sum(a[1] for _i, a in accs)),
+            load_time=self.load_time,
+            compute_time=sum(a[2] for _i, a in accs),
+            worker_compute_time={i: a[2] for i, a in accs},
+        )
@@ -1,8 +1,11 @@
 import logging
+import time
+from concurrent.futures import Future
 from functools import partial
 from typing import Any, Callable, Concatenate, Iterator
 
-from parinvoke.invoker import ModelOpInvoker, P, R, T
+from parinvoke.invoker import ChunkSize, InvokerStats, ModelOpInvoker, P, R, T
+from parinvoke.invoker._stats import TaskTimer
 from parinvoke.sharing import PersistedModel
 
 _log = logging.getLogger(__name__)
@@ -11,18 +14,46 @@ _log = logging.getLogger(__name__)
 class InProcessOpInvoker(ModelOpInvoker[T, R]):
     model: T | None
 
-    def __init__(self, model: T, func: Callable[Concatenate[T, P], R]):
+    def __init__(
+        self,
+        model: T,
+        func: Callable[Concatenate[T, P], R],
+        *,
+        prepare: Callable[[T], Any] | None = None,
+    ):
         _log.info("setting up in-process worker")
+        self._timer = TaskTimer()
+        start = time.perf_counter()
         if isinstance(model, PersistedModel):
             self.model = model.get()
         else:
             self.model = model
+        if prepare is not None:
+            self.model = prepare(self.model)
+        self._timer.load_time = time.perf_counter() - start
         self.function = func
 
-    def map(self, *iterables: Any) -> Iterator[R]:
+    def map(
+        self,
+        *iterables: Any,
+        chunksize: ChunkSize | None = None,
+        max_pending: int | None = None,
+    ) -> Iterator[R]:
         assert self.model is not None
-        proc = partial(self.function, self.model)
-        return map(proc, *iterables)
+        proc = partial(self._timer.call, self.function, self.model)
+        return (proc(*args) for args in zip(*iterables))
+
+    def submit(self, *args: Any) -> Future[R]:
+        assert self.model is not None
+        fut: Future[R] = Future()
+        try:
+            fut.set_result(self._timer.call(self.function, self.model, *args))
+        except Exception as e:
+            fut.set_exception(e)
+        return fut
+
+    def stats(self) -> InvokerStats:
+        return self._timer.stats()
 
     def shutdown(self):
         self.model = None
@@ -1,26 +1,173 @@
 import logging
-import multiprocessing as mp
 import pickle
-from concurrent.futures import ProcessPoolExecutor
-from typing import Any, Callable, Concatenate, Iterator, cast
+import time
+from concurrent.futures import Future, wait
+from functools import partial
+from itertools import count
+from typing import Any, AsyncIterator, Callable, Concatenate, Iterator, cast
+from uuid import uuid4
 
 import seedbank
 
-from parinvoke._worker import initialize_mp_worker, mp_invoke_worker
+from parinvoke._worker import (
+    MAX_WORKER_OPS,
+    OpSpec,
+    PickledResult,
+    SharedResult,
+    initialize_mp_worker,
+    mp_invoke_batch,
+    mp_invoke_into,
+    mp_invoke_worker,
+    mp_load_op,
+)
+from parinvoke.config import worker_cpu_sets
 from parinvoke.context import InvokeContext
-from parinvoke.invoker import ModelOpInvoker, P, R, T
-from parinvoke.logging import log_queue
+from parinvoke.invoker import ChunkSize, InvokerStats, ModelOpInvoker, P, R, T
+from parinvoke.invoker._dispatch import adispatch, dispatch
+from parinvoke.invoker._executor import PoolExecutor, ProcessExecutor
+from parinvoke.invoker._ring import RingExecutor
+from parinvoke.logging import log_levels, log_queue
 from parinvoke.sharing import PersistedModel
+from parinvoke.sharing.shm import SHM_AVAILABLE
 
 _log = logging.getLogger(__name__)
 
 
+class WorkerPool:
+    """
+    A pool of worker processes.  A pool is either dedicated to a single
+    invoker, in which case its operation is installed when the workers start,
+    or shared by several invokers through :meth:`InvokeContext.worker_pool`, in
+    which case each worker receives an operation with the first task that uses
+    it.
+
+    Args:
+        n_jobs: The number of worker processes.
+        context: The invocation context.
+        op: The operation for a dedicated pool.
+    """
+
+    n_jobs: int
+    executor: PoolExecutor
+
+    def __init__(self, n_jobs: int, context: InvokeContext, op: OpSpec | None = None):
+        self.n_jobs = n_jobs
+        ctx = context.config.mp_context()
+        kid_tc = context.config.proc_count(level=1)
+        self._ready = ctx.Semaphore(0)
+        self._n_ready = 0
+        initargs = (
+            op,
+            kid_tc,
+            log_queue(ctx),
+            seedbank.root_seed(),
+            context,
+            self._ready,
+            log_levels(),
+        )
+        cpu_sets = None
+        if context.config.pin_workers:
+            cpu_sets = worker_cpu_sets(kid_tc)
+            if cpu_sets:
+                _log.info("pinning workers to %d CPU sets of %d", len(cpu_sets), kid_tc)
+            else:
+                _log.warning("CPU affinity unsupported, not pinning workers")
+
+        backend = context.config.backend
+        if backend == "ring" and not SHM_AVAILABLE:
+            _log.warning("shared memory unavailable, using process backend")
+            backend = "process"
+
+        if backend == "ring":
+            unsupported = [
+                name
+                for name, value in [
+                    ("max_tasks_per_worker", context.config.max_tasks_per_worker),
+                    ("max_worker_rss", context.config.max_worker_rss),
+                    ("task_retries", context.config.task_retries),
+                    ("task_timeout", context.config.task_timeout),
+                ]
+                if value
+            ]
+            if unsupported:
+                _log.warning("ring backend ignores %s", ", ".join(unsupported))
+            _log.info("setting up RingExecutor w/ %d workers (%s)", n_jobs, ctx.get_start_method())
+            self.executor = RingExecutor(
+                n_jobs,
+                ctx,
+                initialize_mp_worker,
+                initargs,
+                cpu_sets=cpu_sets or None,
+                max_resources=MAX_WORKER_OPS,
+            )
+        else:
+            _log.info(
+                "setting up ProcessExecutor w/ %d workers (%s)", n_jobs, ctx.get_start_method()
+            )
+            self.executor = ProcessExecutor(
+                n_jobs,
+                ctx,
+                initialize_mp_worker,
+                initargs,
+                max_tasks=context.config.max_tasks_per_worker,
+                max_rss=context.config.max_worker_rss,
+                retries=context.config.task_retries,
+                timeout=context.config.task_timeout,
+                cpu_sets=cpu_sets or None,
+                max_resources=MAX_WORKER_OPS,
+            )
+
+    def wait_ready(self, timeout: float | None = None):
+        """
+        Start all worker processes and wait for them to finish initializing
+        (including loading the model, if :attr:`~InvokeConfig.eager_load` is
+        set).
+
+        Args:
+            timeout: The maximum time to wait, in seconds.
+
+        Raises:
+            TimeoutError: if the workers are not ready within the timeout.
+        """
+        if self._n_ready >= self.n_jobs:
+            return
+
+        start = time.perf_counter()
+        while self._n_ready < self.n_jobs:
+            if self._ready.acquire(timeout=0.1):
+                self._n_ready += 1
+                continue
+
+            if self.executor.broken is not None:
+                raise RuntimeError("worker failed to start") from self.executor.broken
+            if timeout is not None and time.perf_counter() - start > timeout:
+                raise TimeoutError("workers not ready")
+
+        _log.info("%d workers ready in %.3fs", self.n_jobs, time.perf_counter() - start)
+
+    def shutdown(self):
+        self.executor.shutdown()
+
+
 class ProcessPoolOpInvoker(ModelOpInvoker[T, R]):
     _close_key = None
     context: InvokeContext
+    pool: WorkerPool
+    n_jobs: int
+    _op: str | OpSpec
+    _shared_pool: bool
+    _shm_results: bool
 
     def __init__(
-        self, model: T, func: Callable[Concatenate[T, P], R], n_jobs: int, context: InvokeContext
+        self,
+        model: T,
+        func: Callable[Concatenate[T, P], R],
+        n_jobs: int,
+        context: InvokeContext,
+        pool: WorkerPool | None = None,
+        *,
+        shm_results: bool = False,
+        prepare: Callable[[T], Any] | None = None,
     ):
         self.context = context
         key: PersistedModel[T]
@@ -34,21 +181,176 @@ class ProcessPoolOpInvoker(ModelOpInvoker[T, R]):
 
         _log.debug("persisting function")
         func_pkl = pickle.dumps(func)
-        ctx = mp.get_context("spawn")
-        _log.info("setting up ProcessPoolExecutor w/ %d workers", n_jobs)
-        kid_tc = context.config.proc_count(level=1)
-        self.executor = ProcessPoolExecutor(
-            n_jobs,
-            ctx,
-            initialize_mp_worker,
-            (key, func_pkl, kid_tc, log_queue(ctx), seedbank.root_seed()),
+        if shm_results and not SHM_AVAILABLE:
+            _log.warning("shared memory unavailable, returning results through pipes")
+            shm_results = False
+        self._shm_results = shm_results
+        prep_pkl = pickle.dumps(prepare) if prepare is not None else None
+        spec = OpSpec(uuid4().hex, key, func_pkl, shm_results, prep_pkl)
+
+        if pool is None:
+            self.pool = WorkerPool(n_jobs, context, spec)
+            self._shared_pool = False
+            self._op = spec.key
+        else:
+            _log.debug("using shared pool with %d workers", pool.n_jobs)
+            self.pool = pool
+            self._shared_pool = True
+            self._op = spec
+        self.n_jobs = self.pool.n_jobs
+        if context.config.eager_load:
+            self.wait_ready()
+
+    @property
+    def executor(self) -> PoolExecutor:
+        return self.pool.executor
+
+    def wait_ready(self, timeout: float | None = None):
+        start = time.perf_counter()
+        self.pool.wait_ready(timeout)
+        if self._shared_pool and self.context.config.eager_load:
+            # the workers were started without the operation, so install it in each one
+            if timeout is not None:
+                timeout = max(timeout - (time.perf_counter() - start), 0)
+            done, pending = wait(self.executor.submit_each(mp_load_op, self._op), timeout)
+            if pending:
+                raise TimeoutError("workers not ready")
+            for fut in done:
+                fut.result()
+
+    def stats(self) -> InvokerStats:
+        return self.executor.stats()
+
+    def map(
+        self,
+        *iterables: Any,
+        chunksize: ChunkSize | None = None,
+        max_pending: int | None = None,
+    ) -> Iterator[R]:
+        if chunksize == "auto" or max_pending is not None:
+            results = (
+                r for _i, r in self._dispatch(iterables, chunksize, max_pending, ordered=True)
+            )
+        elif chunksize is not None:
+            # the executor sends and returns results in batches for us
+            results = self.executor.map(
+                partial(mp_invoke_worker, self._op), *iterables, chunksize=chunksize
+            )
+        else:
+            results = self.executor.map(partial(mp_invoke_worker, self._op), *iterables)
+        if self._shm_results:
+            results = (_load_result(r) for r in results)
+        return cast(Iterator[R], results)
+
+    def map_unordered(
+        self,
+        *iterables: Any,
+        chunksize: ChunkSize | None = None,
+        max_pending: int | None = None,
+    ) -> Iterator[tuple[int, R]]:
+        results = self._dispatch(iterables, chunksize, max_pending, ordered=False)
+        if self._shm_results:
+            results = ((i, _load_result(r)) for i, r in results)
+        return results
+
+    def map_into(
+        self,
+        out: PersistedModel[Any],
+        *iterables: Any,
+        chunksize: ChunkSize | None = "auto",
+        max_pending: int | None = None,
+    ) -> None:
+        if not iterables:
+            # like map, there are no tasks without arguments
+            return
+
+        func = partial(mp_invoke_into, self._op, out)
+        # prepend the task indices to the arguments, so workers know where to write
+        tasks = self._dispatch((count(), *iterables), chunksize, max_pending, func=func)
+        for _i, _r in tasks:
+            pass
+
+    def amap(
+        self,
+        *iterables: Any,
+        chunksize: ChunkSize | None = None,
+        max_pending: int | None = None,
+    ) -> AsyncIterator[R]:
+        results = adispatch(
+            self.executor,
+            partial(mp_invoke_batch, self._op),
+            iterables,
+            chunksize=chunksize or 1,
+            max_batches=self._max_batches(chunksize),
+            max_pending=max_pending,
         )
+        if self._shm_results:
+            results = _aload_results(results)
+        return results
+
+    def submit(self, *args: Any) -> Future[R]:
+        fut = self.executor.submit(mp_invoke_worker, self._op, *args)
+        if not self._shm_results:
+            return fut
+
+        loaded: Future[R] = Future()
 
-    def map(self, *iterables: Any) -> Iterator[R]:
-        return cast(Iterator[R], self.executor.map(mp_invoke_worker, *iterables))
+        def load(done: Future[Any]):
+            try:
+                loaded.set_result(_load_result(done.result()))
+            except BaseException as e:
+                loaded.set_exception(e)
+
+        fut.add_done_callback(load)
+        return loaded
+
+    def _max_batches(self, chunksize: ChunkSize | None) -> int | None:
+        if chunksize == "auto":
+            # keep two batches per worker in flight so batch sizes can adapt
+            return 2 * self.n_jobs
+        else:
+            return None
+
+    def _dispatch(
+        self,
+        iterables: tuple[Any, ...],
+        chunksize: ChunkSize | None,
+        max_pending: int | None,
+        *,
+        ordered: bool = True,
+        func: Callable[[list[tuple[Any, ...]]], tuple[float, list[Any]]] | None = None,
+    ) -> Iterator[tuple[int, Any]]:
+        if func is None:
+            func = partial(mp_invoke_batch, self._op)
+        return dispatch(
+            self.executor,
+            func,
+            iterables,
+            chunksize=chunksize or 1,
+            max_batches=self._max_batches(chunksize),
+            max_pending=max_pending,
+            ordered=ordered,
+        )
 
     def shutdown(self):
-        self.executor.shutdown()
+        if self._shared_pool:
+            # unmap the model from the pool's workers
+            assert isinstance(self._op, OpSpec)
+            self.executor.remove_resource(self._op.key)
+        else:
+            self.pool.shutdown()
         if self._close_key is not None:
             self._close_key.close()
             del self._close_key
+
+
+def _load_result(result: Any) -> Any:
+    if isinstance(result, (SharedResult, PickledResult)):
+        return result.load()
+    else:
+        return result
+
+
+async def _aload_results(results: AsyncIterator[Any]) -> AsyncIterator[Any]:
+    async for result in results:
+        yield _load_result(result)
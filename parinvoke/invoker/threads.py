@@ -0,0 +1,141 @@
+import logging
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import Any, AsyncIterator, Callable, Concatenate, Iterator
+
+from threadpoolctl import threadpool_limits
+
+from parinvoke.context import InvokeContext
+from parinvoke.invoker import ChunkSize, InvokerStats, ModelOpInvoker, P, R, T
+from parinvoke.invoker._dispatch import adispatch, dispatch
+from parinvoke.invoker._stats import TaskTimer
+from parinvoke.sharing import PersistedModel
+
+_log = logging.getLogger(__name__)
+
+
+class ThreadPoolOpInvoker(ModelOpInvoker[T, R]):
+    """
+    Invoker that runs operations in a pool of threads.  The model is shared
+    directly with the threads, so there is no persistence or process startup
+    cost; this is useful for operations that release the GIL (such as
+    BLAS-bound NumPy code) and on free-threaded Python builds.
+
+    BLAS threading limits are process-wide, so the invoker limits BLAS to the
+    nested thread count (``proc_count(level=1)``) for every thread while it is
+    active, and restores the original limits on :meth:`shutdown`.
+    """
+
+    model: T | None
+    n_jobs: int
+
+    def __init__(
+        self,
+        model: T,
+        func: Callable[Concatenate[T, P], R],
+        n_jobs: int,
+        context: InvokeContext,
+        *,
+        prepare: Callable[[T], Any] | None = None,
+    ):
+        self._timer = TaskTimer()
+        start = time.perf_counter()
+        if isinstance(model, PersistedModel):
+            self.model = model.get()
+        else:
+            self.model = model
+        # the threads share the model, so it only needs preparing once
+        if prepare is not None:
+            self.model = prepare(self.model)
+        self._timer.load_time = time.perf_counter() - start
+        self.function = func
+        self.n_jobs = n_jobs
+
+        kid_tc = context.config.proc_count(level=1)
+        _log.info("setting up ThreadPoolExecutor w/ %d threads", n_jobs)
+        self._limits = threadpool_limits(limits=kid_tc, user_api="blas")
+        self.executor = ThreadPoolExecutor(n_jobs, thread_name_prefix="parinvoke-worker")
+
+    def map(
+        self,
+        *iterables: Any,
+        chunksize: ChunkSize | None = None,
+        max_pending: int | None = None,
+    ) -> Iterator[R]:
+        if chunksize is None and max_pending is None:
+            return self.executor.map(
+                partial(self._timer.call, self.function, self.model), *iterables
+            )
+        else:
+            results = self._dispatch(iterables, chunksize, max_pending, ordered=True)
+            return (r for _i, r in results)
+
+    def map_unordered(
+        self,
+        *iterables: Any,
+        chunksize: ChunkSize | None = None,
+        max_pending: int | None = None,
+    ) -> Iterator[tuple[int, R]]:
+        return self._dispatch(iterables, chunksize, max_pending, ordered=False)
+
+    def amap(
+        self,
+        *iterables: Any,
+        chunksize: ChunkSize | None = None,
+        max_pending: int | None = None,
+    ) -> AsyncIterator[R]:
+        return adispatch(
+            self.executor,
+            self._invoke_batch,
+            iterables,
+            chunksize=chunksize or 1,
+            max_batches=self._max_batches(chunksize),
+            max_pending=max_pending,
+        )
+
+    def submit(self, *args: Any) -> Future[R]:
+        return self.executor.submit(self._timer.call, self.function, self.model, *args)
+
+    def _max_batches(self, chunksize: ChunkSize | None) -> int | None:
+        if chunksize == "auto":
+            return 2 * self.n_jobs
+        else:
+            return None
+
+    def _dispatch(
+        self,
+        iterables: tuple[Any, ...],
+        chunksize: ChunkSize | None,
+        max_pending: int | None,
+        *,
+        ordered: bool,
+    ) -> Iterator[tuple[int, R]]:
+        return dispatch(
+            self.executor,
+            self._invoke_batch,
+            iterables,
+            chunksize=chunksize or 1,
+            max_batches=self._max_batches(chunksize),
+            max_pending=max_pending,
+            ordered=ordered,
+        )
+
+    def _invoke_batch(self, batch: list[tuple[Any, ...]]) -> tuple[float, list[R]]:
+        start = time.perf_counter()
+        try:
+            results = [self.function(self.model, *args) for args in batch]
+        except BaseException:
+            self._timer.record(len(batch), time.perf_counter() - start, failed=len(batch))
+            raise
+        elapsed = time.perf_counter() - start
+        self._timer.record(len(batch), elapsed)
+        return elapsed, results
+
+    def stats(self) -> InvokerStats:
+        return self._timer.stats()
+
+    def shutdown(self):
+        self.executor.shutdown()
+        self._limits.restore_original_limits()
+        self.model = None
@@ -16,7 +16,7 @@ from numpy.random import SeedSequence
 
 from parinvoke._worker import initialize_worker
 from parinvoke.context import InvokeContext
-from parinvoke.logging import log_queue
+from parinvoke.logging import LogBatch, close_worker_logs, log_levels, log_queue
 
 T = TypeVar("T")
 P = ParamSpec("P")
@@ -24,7 +24,8 @@ _log = logging.getLogger(__name__)
 
 
 def _sp_worker(
-    log_queue: mp.Queue[logging.LogRecord],
+    log_queue: mp.Queue[LogBatch],
+    log_levels: dict[str, int],
     seed: SeedSequence,
     res_queue: mp.Queue[tuple[bool, Any | Exception]],
     context: InvokeContext,
@@ -32,7 +33,7 @@ def _sp_worker(
     args: list[Any],
     kwargs: dict[str, Any],
 ):
-    initialize_worker(log_queue, seed, context=context)
+    initialize_worker(log_queue, seed, context=context, log_levels=log_levels)
     _log.debug("unpickling worker function")
     func = pickle.loads(func_pkl)
     _log.debug("running %s in worker", func)
@@ -43,6 +44,8 @@ def _sp_worker(
     except Exception as e:
         _log.error("failed, transmitting error %r", e)
         res_queue.put((False, e))
+    finally:
+        close_worker_logs()
 
 
 def run_sp(context: InvokeContext, func: Callable[P, T], *args: P.args, **kwargs: P.kwargs) -> T:
@@ -51,12 +54,12 @@ def run_sp(context: InvokeContext, func: Callable[P, T], *args: P.args, **kwargs
     isolation, not parallelism.  The subprocess is configured so things like logging work
     correctly, and is initialized with a derived random seed.
     """
-    mp_ctx = mp.get_context("spawn")
+    mp_ctx = context.config.mp_context()
     rq = mp_ctx.SimpleQueue()
     seed = seedbank.derive_seed()
     # we pre-pickle the function to defer imports
     func_pkl = pickle.dumps(func, pickle.HIGHEST_PROTOCOL)
-    worker_args = (log_queue(mp_ctx), seed, rq, context, func_pkl, args, kwargs)
+    worker_args = (log_queue(mp_ctx), log_levels(), seed, rq, context, func_pkl, args, kwargs)
     _log.debug("spawning subprocess to run %s", func)
     proc = mp_ctx.Process(target=_sp_worker, args=worker_args)
     proc.start()
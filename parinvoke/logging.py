@@ -7,12 +7,40 @@
 from __future__ import annotations
 
 import logging
-from logging.handlers import QueueListener
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
 from multiprocessing.context import BaseContext
 from multiprocessing.queues import Queue
+from typing import Any, Protocol
 
-_log_queue: Queue[logging.LogRecord] | None = None
+LogBatch = list[logging.LogRecord]
+
+
+class LogSink(Protocol):
+    "Destination for a worker's batches of log records, such as a queue."
+
+    def put_nowait(self, item: LogBatch, /) -> Any: ...
+
+
+_log_queue: Queue[LogBatch] | None = None
 _log_listener = None
+_worker_handler: BatchQueueHandler | None = None
+_worker_sink: LogSink | None = None
+
+LOG_BATCH_SIZE = 64
+"""
+The maximum number of log records a worker buffers before sending them.
+"""
+LOG_BATCH_INTERVAL = 0.1
+"""
+The maximum time (in seconds) a worker buffers log records before sending them.
+"""
+LOG_CLOSE_TIMEOUT = 5.0
+"""
+The maximum time (in seconds) an exiting worker waits to send its remaining log
+records.
+"""
 
 
 class InjectHandler(logging.Handler):
@@ -29,7 +57,76 @@ class InjectHandler(logging.Handler):
             return False
 
 
-def log_queue(ctx: BaseContext) -> Queue[logging.LogRecord]:
+class BatchQueueHandler(QueueHandler):
+    """
+    Queue handler that sends log records in batches, to reduce the cost of
+    logging in worker processes.  A batch is sent when it is full, when it
+    contains a record at or above ``flush_level``, or when its first record is
+    :data:`LOG_BATCH_INTERVAL` seconds old.
+    """
+
+    buffer: LogBatch
+    capacity: int
+    flush_level: int
+    _timer: threading.Thread | None = None
+
+    def __init__(
+        self,
+        queue: LogSink,
+        capacity: int = LOG_BATCH_SIZE,
+        flush_level: int = logging.WARNING,
+    ):
+        super().__init__(queue)  # type: ignore
+        self.buffer = []
+        self.capacity = capacity
+        self.flush_level = flush_level
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            self.buffer.append(self.prepare(record))
+        except Exception:
+            self.handleError(record)
+            return
+
+        if len(self.buffer) >= self.capacity or record.levelno >= self.flush_level:
+            self.flush()
+        elif self._timer is None:
+            self._timer = threading.Thread(
+                target=self._flush_periodically, name="parinvoke-log-flush", daemon=True
+            )
+            self._timer.start()
+
+    def flush(self):
+        with self.lock:  # type: ignore
+            if self.buffer:
+                batch = self.buffer
+                self.buffer = []
+                try:
+                    self.enqueue(batch)  # type: ignore
+                except Exception:
+                    self.handleError(batch[-1])
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(LOG_BATCH_INTERVAL)
+            self.flush()
+
+
+class BatchQueueListener(QueueListener):
+    """
+    Queue listener that unpacks batches of records sent by
+    :class:`BatchQueueHandler`.
+    """
+
+    def handle(self, record: logging.LogRecord | LogBatch):
+        if isinstance(record, list):
+            for r in record:
+                super().handle(r)
+        else:
+            super().handle(record)
+
+
+def log_queue(ctx: BaseContext) -> Queue[LogBatch]:
     """
     Get the log queue for child process logging.
     """
@@ -37,6 +134,105 @@ def log_queue(ctx: BaseContext) -> Queue[logging.LogRecord]:
 
     if _log_queue is None:
         _log_queue = ctx.Queue()
-        _log_listener = QueueListener(_log_queue, InjectHandler())
+        _log_listener = BatchQueueListener(_log_queue, InjectHandler())
         _log_listener.start()
     return _log_queue
+
+
+def inject_worker_logs(batch: LogBatch):
+    """
+    Handle a batch of log records that a worker process sent through its own
+    pipe (see :func:`route_worker_logs`), as the log queue's listener does.
+    """
+    for record in batch:
+        _injector.handle(record)
+
+
+_injector = InjectHandler()
+
+
+def log_levels() -> dict[str, int]:
+    """
+    Get the log levels configured in the current process, to filter worker log
+    records at their source.  The root logger's level has the key ``""``, and
+    the level disabled with :func:`logging.disable` has the key ``"*"``.
+    Changes to log levels after a worker starts do not affect it.
+    """
+    levels = {"": logging.getLogger().level, "*": logging.root.manager.disable}
+    for name, logger in list(logging.root.manager.loggerDict.items()):
+        if isinstance(logger, logging.Logger) and logger.level != logging.NOTSET:
+            levels[name] = logger.level
+    return levels
+
+
+def route_worker_logs(sink: LogSink):
+    """
+    Send this worker process's log records through ``sink``, such as a pipe
+    private to the worker, instead of the log queue it is given when logging is
+    installed.  Workers share the log queue, so one that is killed while
+    writing to it leaves the queue locked for the others; executors that kill
+    workers give each of them its own pipe.  Must be called before
+    :func:`install_worker_logging`.
+    """
+    global _worker_sink
+    _worker_sink = sink
+
+
+def install_worker_logging(queue: LogSink, levels: dict[str, int] | None = None):
+    """
+    Set up logging in a worker process to send records to the parent through
+    ``queue`` (or the sink passed to :func:`route_worker_logs`).  If ``levels``
+    (from :func:`log_levels`) is provided, the worker loggers take the parent's
+    levels; otherwise, all records are sent.
+    """
+    global _worker_handler
+
+    _worker_handler = BatchQueueHandler(_worker_sink if _worker_sink is not None else queue)
+    root = logging.getLogger()
+    root.addHandler(_worker_handler)
+    if levels is None:
+        root.setLevel(logging.DEBUG)
+    else:
+        for name, level in levels.items():
+            if name == "*":
+                logging.disable(level)
+            else:
+                logging.getLogger(name).setLevel(level)
+
+
+def flush_worker_logs():
+    """
+    Send any log records buffered in this worker process to the parent.
+    """
+    if _worker_handler is not None:
+        _worker_handler.flush()
+
+
+def close_worker_logs(timeout: float = LOG_CLOSE_TIMEOUT):
+    """
+    Send any log records buffered in this worker process to the parent and stop
+    forwarding logs, before the worker exits.  Workers share the log queue, and
+    one that is killed while writing to it leaves the queue locked; rather than
+    blocking its exit on the lock, a worker gives up on its remaining records
+    after ``timeout`` seconds.  Records sent through a worker's own sink are
+    sent when they are flushed.
+    """
+    global _worker_handler
+
+    handler = _worker_handler
+    if handler is None:
+        return
+    _worker_handler = None
+    logging.getLogger().removeHandler(handler)
+    handler.flush()
+
+    queue: LogSink = handler.queue  # type: ignore
+    if not isinstance(queue, Queue):
+        return
+    queue.close()
+    writer = threading.Thread(target=queue.join_thread, name="parinvoke-log-close", daemon=True)
+    writer.start()
+    writer.join(timeout)
+    if writer.is_alive():
+        # keep multiprocessing from joining the stuck feeder thread at exit
+        queue.cancel_join_thread()
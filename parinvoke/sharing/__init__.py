@@ -13,7 +13,7 @@ from __future__ import annotations
 import logging
 import warnings
 from abc import ABC, abstractmethod
-from typing import Generic, Literal, TypeVar
+from typing import Callable, Generic, Literal, TypeVar
 
 _log = logging.getLogger(__name__)
 
@@ -69,3 +69,40 @@ class PersistedModel(ABC, Generic[T]):
         else:
             self.is_owner = "transfer"
         return self
+
+
+class PersistedRef(PersistedModel[T]):
+    """
+    A reference-counted handle to a persisted model that may be shared by
+    several owners, used by contexts that deduplicate persisted models (see
+    :attr:`~parinvoke.config.InvokeConfig.dedup_persist`).  Closing the handle
+    releases its reference; the underlying model is closed when the last
+    reference is released.
+
+    The handle pickles as the underlying persisted model, so workers receive
+    the same object they would without deduplication.
+    """
+
+    persisted: PersistedModel[T]
+    _release: Callable[[], None] | None
+
+    def __init__(self, persisted: PersistedModel[T], release: Callable[[], None]):
+        self.persisted = persisted
+        self._release = release
+        self.is_owner = True
+
+    def get(self) -> T:
+        return self.persisted.get()
+
+    def close(self) -> None:
+        if self._release is not None:
+            self._release()
+            self._release = None
+            self.is_owner = False
+
+    def __reduce__(self):
+        return (_unwrap_ref, (self.persisted,))
+
+
+def _unwrap_ref(persisted: PersistedModel[T]) -> PersistedModel[T]:
+    return persisted
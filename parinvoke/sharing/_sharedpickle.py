@@ -1,5 +1,13 @@
+import hashlib
+import pickle
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, Protocol, runtime_checkable
 
+FINGERPRINT_CHUNK = 64 * 1024 * 1024
+"""
+Size of the chunks that buffers are split into for parallel hashing.
+"""
+
 
 @runtime_checkable
 class SharedSerializable(Protocol):
@@ -19,3 +27,45 @@ class SharedPicklerMixin:
             return (obj.__class__.__new__, (obj.__class__,), state)
         else:
             return NotImplemented
+
+
+def _digest(data: memoryview | bytes) -> bytes:
+    return hashlib.blake2b(data, digest_size=32).digest()
+
+
+def fingerprint(data: bytes, buffers: list[pickle.PickleBuffer], threads: int = 1) -> str:
+    """
+    Compute a content fingerprint of pickle data and its out-of-band buffers.
+    Buffers are hashed in chunks of :data:`FINGERPRINT_CHUNK` bytes, in parallel
+    if ``threads`` is greater than 1 (hashing releases the GIL), and the chunk
+    digests are combined into the final fingerprint.
+
+    Args:
+        data: The pickle data.
+        buffers: The out-of-band buffers.
+        threads: The number of threads to use for hashing.
+
+    Returns:
+        The hex digest of the content.
+    """
+    chunks: list[memoryview] = []
+    sizes: list[int] = []
+    for buf in buffers:
+        raw = buf.raw()
+        sizes.append(raw.nbytes)
+        for start in range(0, raw.nbytes, FINGERPRINT_CHUNK):
+            chunks.append(raw[start : start + FINGERPRINT_CHUNK])
+
+    if threads > 1 and len(chunks) > 1:
+        with ThreadPoolExecutor(min(threads, len(chunks))) as pool:
+            digests = list(pool.map(_digest, chunks))
+    else:
+        digests = [_digest(c) for c in chunks]
+
+    h = hashlib.blake2b(digest_size=32)
+    h.update(_digest(data))
+    # buffer sizes keep chunks from different buffer layouts from colliding
+    h.update(repr(sizes).encode())
+    for d in digests:
+        h.update(d)
+    return h.hexdigest()
@@ -7,11 +7,12 @@
 from __future__ import annotations
 
 import gc
+import hashlib
 import logging
 import os
 import tempfile
 from pathlib import Path
-from typing import Optional, TypeVar, cast
+from typing import TYPE_CHECKING, Any, Optional, TypeVar, cast
 
 import binpickle
 
@@ -21,6 +22,10 @@ from ..context import InvokeContext
 from . import PersistedModel
 from ._sharedpickle import SharedPicklerMixin
 
+if TYPE_CHECKING:
+    from binpickle.format import IndexEntry
+    from numpy.typing import DTypeLike, NDArray
+
 _log = logging.getLogger(__name__)
 T = TypeVar("T")
 
@@ -74,7 +79,17 @@ class BPKContext(InvokeContext):
 
         self.dir = Path(dir) if dir else None
 
-    def persist(self, model: T) -> BPKPersisted[T]:
+    def persist(self, model: T) -> PersistedModel[T]:
+        persisted, digest = self._persist_file(model)
+        if not self.config.dedup_persist:
+            return persisted
+
+        if self._dedup is not None and digest in self._dedup:
+            # the model was only written to fingerprint it
+            persisted.close()
+        return self._persist_dedup(digest, lambda: persisted)
+
+    def _persist_file(self, model: T) -> tuple[BPKPersisted[T], str]:
         fd, path = tempfile.mkstemp(suffix=".bpk", prefix="lkpy-", dir=self.dir)
         os.close(fd)
         path = Path(path)
@@ -82,7 +97,22 @@ class BPKContext(InvokeContext):
         _log.debug("persisting %s to %s", model, path)
         with SharingBinPickler.mappable(path) as bp:
             bp.dump(model)
-        return BPKPersisted[T](path)
+        persisted = BPKPersisted[T](path)
+        persisted.prefetch = self.config.shm_prefault
+        return persisted, _bpk_digest(bp.entries)
+
+    def shared_array(self, shape: int | tuple[int, ...], dtype: DTypeLike = "f8") -> BPKArray:
+        import numpy as np
+
+        fd, path = tempfile.mkstemp(suffix=".dat", prefix="lkpy-", dir=self.dir)
+        dt = np.dtype(dtype)
+        shape = (shape,) if isinstance(shape, int) else tuple(shape)
+        nbytes = int(np.prod(shape)) * dt.itemsize
+        # extend the file without writing it, so it is sparse and zero-filled
+        os.ftruncate(fd, nbytes)
+        os.close(fd)
+        _log.debug("allocated %d bytes for shared array in %s", nbytes, path)
+        return BPKArray(Path(path), shape, dt.str)
 
     def teardown(self):
         super().teardown()
@@ -96,8 +126,42 @@ class BPKContext(InvokeContext):
         self.dir.unlink()
 
 
+def _prefetch_file(path: Path):
+    """
+    Ask the OS to read a file into the page cache in the background, so loading
+    it (which reads every buffer to verify its checksum) does not wait on each
+    page.  Ignored where it is not supported.
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return
+
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+    except OSError as e:
+        _log.debug("could not prefetch %s: %s", path, e)
+    finally:
+        os.close(fd)
+
+
+def _bpk_digest(entries: list[IndexEntry]) -> str:
+    """
+    Compute a content fingerprint of a BinPickle file from the checksums the
+    pickler computed while writing its buffers (the last of which is the
+    pickle stream), so the model is not serialized or hashed again.
+    """
+    h = hashlib.blake2b(digest_size=32)
+    for e in entries:
+        # buffer sizes keep different buffer layouts from colliding
+        h.update(e.dec_length.to_bytes(8, "little"))
+        h.update(e.hash)
+    return h.hexdigest()
+
+
 class BPKPersisted(PersistedModel[T]):
     path: Path
+    prefetch: bool = False
+    "Whether to ask the OS to read the file ahead when loading the model."
     _bpk_file: Optional[binpickle.BinPickleFile]
     _model: Optional[T]
 
@@ -110,6 +174,8 @@ class BPKPersisted(PersistedModel[T]):
     def get(self) -> T:
         if self._bpk_file is None:
             _log.debug("loading %s", self.path)
+            if self.prefetch:
+                _prefetch_file(self.path)
             self._bpk_file = binpickle.BinPickleFile(self.path, direct=True)
             self._model = cast(T, self._bpk_file.load())
         assert self._model is not None
@@ -152,3 +218,48 @@ class BPKPersisted(PersistedModel[T]):
 
     def __del___(self):
         self.close(False)
+
+
+class BPKArray(PersistedModel["NDArray[Any]"]):
+    """
+    A writable NumPy array shared through a memory-mapped file.
+    """
+
+    path: Path
+    shape: tuple[int, ...]
+    dtype: str
+    _array: Optional[NDArray[Any]]
+
+    def __init__(self, path: Path, shape: tuple[int, ...], dtype: str):
+        self.path = path
+        self.shape = shape
+        self.dtype = dtype
+        self.is_owner = True
+        self._array = None
+
+    def get(self) -> NDArray[Any]:
+        if self._array is None:
+            import numpy as np
+
+            _log.debug("mapping %s", self.path)
+            self._array = np.memmap(self.path, self.dtype, "r+", shape=self.shape)
+        return self._array
+
+    def close(self, unlink: bool = True):
+        if self._array is not None:
+            self._array.flush()
+            self._array = None
+
+        if self.is_owner and unlink:
+            _log.debug("deleting %s", self.path)
+            try:
+                self.path.unlink()
+            except IOError as e:
+                _log.warn("could not remove %s: %s", self.path, e)
+            self.is_owner = False
+
+    def __getstate__(self):
+        d = dict(self.__dict__)
+        d["_array"] = None
+        d["is_owner"] = self.is_owner == "transfer"
+        return d
@@ -8,17 +8,23 @@ from __future__ import annotations
 
 import io
 import logging
+import mmap
 import multiprocessing.shared_memory as shm
+import os
 import pickle
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from multiprocessing.managers import SharedMemoryManager
-from typing import Any, NamedTuple, Optional, TypeVar
+from typing import TYPE_CHECKING, Any, NamedTuple, Optional, TypeVar
 
 from parinvoke.config import InvokeConfig
 from parinvoke.context import InvokeContext
 
 from . import PersistedModel
-from ._sharedpickle import SharedPicklerMixin
+from ._sharedpickle import SharedPicklerMixin, fingerprint
+
+if TYPE_CHECKING:
+    from numpy.typing import DTypeLike, NDArray
 
 # we have encountered a number of bugs on Windows
 SHM_AVAILABLE = sys.platform != "win32"
@@ -46,42 +52,204 @@ def persist_shm(model: T) -> SHMPersisted[T]:
     Returns:
         PersistedModel: The persisted object.
     """
+    data, buffers = pickle_buffers(model)
+    return persist_buffers(data, buffers)
+
 
+def pickle_buffers(obj: object) -> tuple[memoryview, list[pickle.PickleBuffer]]:
+    """
+    Pickle an object with protocol 5, returning the pickle data and its
+    out-of-band buffers.  The pickle data is a view of the pickler's output
+    buffer, so it is not copied.
+    """
     buffers: list[pickle.PickleBuffer] = []
 
     out = io.BytesIO()
     pickler = SharedPickler(out, 5, buffer_callback=buffers.append)
-    pickler.dump(model)
-    data = out.getvalue()
+    pickler.dump(obj)
+    return out.getbuffer(), buffers
+
+
+def persist_buffers(
+    data: bytes | memoryview,
+    buffers: list[pickle.PickleBuffer],
+    manager: SharedMemoryManager | None = None,
+    threads: int = 1,
+    *,
+    align: int = 1,
+    huge_pages: bool = False,
+) -> SHMPersisted[Any]:
+    """
+    Persist pickled data and its out-of-band buffers in shared memory.  The
+    shared memory block is sized and allocated up front, and the buffers
+    followed by the pickle data are copied into it directly, so the only copy
+    of the model's data is the shared one.
 
+    Args:
+        data: The pickle data.
+        buffers: The out-of-band buffers.
+        manager:
+            The shared memory manager to allocate memory from; if ``None``, the
+            memory is allocated directly.
+        threads:
+            The number of threads to use for copying large buffers.
+        align:
+            The alignment (in bytes) of each buffer in shared memory.
+        huge_pages:
+            Whether to advise the kernel to use transparent huge pages.
+
+    Returns:
+        The persisted object.
+    """
     total_size = sum(memoryview(b).nbytes for b in buffers)
     _log.info(
-        "serialized %s to %d pickle bytes with %d buffers of %d bytes",
-        model,
+        "serialized %d pickle bytes with %d buffers of %d bytes",
         len(data),
         len(buffers),
         total_size,
     )
 
-    if buffers:
-        # blit the buffers to the SHM block
-        _log.debug("preparing to share %d buffers", len(buffers))
-        memory = shm.SharedMemory(create=True, size=total_size)
-        cur_offset = 0
-        blocks: list[SHMBlock] = []
-        for i, buf in enumerate(buffers):
-            ba = buf.raw()
-            blen = ba.nbytes
-            bend = cur_offset + blen
-            _log.debug("saving %d bytes in buffer %d/%d", blen, i + 1, len(buffers))
-            memory.buf[cur_offset:bend] = ba
-            blocks.append(SHMBlock(cur_offset, bend))
-            cur_offset = bend
+    if not buffers:
+        return SHMPersisted(bytes(data), None, [])
+
+    # lay out the buffers, followed by the pickle data
+    blocks: list[SHMBlock] = []
+    views: list[memoryview] = []
+    cur_offset = 0
+    for buf in buffers:
+        ba = buf.raw()
+        cur_offset = _align(cur_offset, align)
+        bend = cur_offset + ba.nbytes
+        blocks.append(SHMBlock(cur_offset, bend))
+        views.append(ba)
+        cur_offset = bend
+    data_block = SHMBlock(cur_offset, cur_offset + len(data))
+
+    _log.debug("preparing to share %d buffers", len(buffers))
+    if manager is None:
+        memory = shm.SharedMemory(create=True, size=data_block.end)
     else:
-        memory = None
-        blocks = []
+        memory = manager.SharedMemory(size=data_block.end)
+    if huge_pages:
+        advise_memory(memory, huge_pages=True)
+
+    copy_buffers(memory.buf, blocks + [data_block], views + [memoryview(data)], threads)
+    return SHMPersisted(data_block, memory, blocks)
+
 
-    return SHMPersisted[T](data, memory, blocks)
+def _align(offset: int, align: int) -> int:
+    return -(-offset // align) * align
+
+
+# not exposed by the mmap module in older Pythons; available since Linux 5.14
+_MADV_POPULATE_READ = getattr(mmap, "MADV_POPULATE_READ", 22 if sys.platform == "linux" else None)
+
+
+def advise_memory(memory: shm.SharedMemory, *, prefault: bool = False, huge_pages: bool = False):
+    """
+    Give the kernel advice about how a shared memory block will be used.  The
+    advice is best-effort, and ignored where it is not supported.
+
+    Args:
+        memory:
+            The shared memory block.
+        prefault:
+            Fault in all of the block's pages now, so later accesses do not
+            take page faults.
+        huge_pages:
+            Ask for the block to be backed by transparent huge pages.
+    """
+    mm = memory.buf.obj
+    if not isinstance(mm, mmap.mmap):  # no cover
+        return
+
+    if huge_pages and hasattr(mmap, "MADV_HUGEPAGE"):
+        try:
+            mm.madvise(mmap.MADV_HUGEPAGE)
+        except OSError as e:
+            _log.debug("could not request huge pages: %s", e)
+
+    if prefault:
+        if _MADV_POPULATE_READ is not None:
+            try:
+                mm.madvise(_MADV_POPULATE_READ)
+                return
+            except OSError as e:
+                _log.debug("could not populate pages: %s", e)
+        # fall back to reading one byte from each page
+        memory.buf[:: mmap.PAGESIZE].tobytes()
+
+
+COPY_CHUNK = 16 * 1024 * 1024
+"""
+Size of the chunks that large buffers are split into for parallel copying.
+"""
+
+
+def copy_buffers(
+    dest: memoryview, blocks: list[SHMBlock], sources: list[memoryview], threads: int = 1
+):
+    """
+    Copy buffers into blocks of a destination buffer.  If ``threads`` is greater
+    than 1 and NumPy is available, large buffers are split into chunks of
+    :data:`COPY_CHUNK` bytes and copied in parallel (NumPy copies release the
+    GIL).
+
+    Args:
+        dest: The destination buffer.
+        blocks: The destination block for each source buffer.
+        sources: The source buffers.
+        threads: The number of threads to use.
+    """
+    chunks: list[tuple[int, memoryview]] = []
+    for (start, end), src in zip(blocks, sources):
+        assert end - start == src.nbytes
+        for off in range(0, src.nbytes, COPY_CHUNK):
+            chunks.append((start + off, src[off : off + COPY_CHUNK]))
+
+    try:
+        import numpy as np
+    except ImportError:
+        np = None
+
+    if np is None or threads <= 1 or len(chunks) <= 1:
+        for start, src in chunks:
+            dest[start : start + src.nbytes] = src
+        return
+
+    target = np.frombuffer(dest, np.uint8)
+
+    def copy(chunk: tuple[int, memoryview]):
+        start, src = chunk
+        np.copyto(target[start : start + src.nbytes], np.frombuffer(src, np.uint8))
+
+    _log.debug("copying %d chunks with %d threads", len(chunks), threads)
+    with ThreadPoolExecutor(min(threads, len(chunks))) as pool:
+        for _r in pool.map(copy, chunks):
+            pass
+
+
+def _close_memory(memory: shm.SharedMemory) -> bool:
+    """
+    Close a shared memory block.  If objects reconstructed from the memory are
+    still alive, the mapping cannot be closed yet; the block drops its
+    reference to the mapping instead, so it is unmapped as soon as the last of
+    those objects is garbage-collected.
+
+    Returns:
+        ``True`` if the mapping was closed, and ``False`` if it is still in use.
+    """
+    try:
+        memory.close()
+        return True
+    except BufferError:
+        _log.debug("shared memory %s still in use, deferring close", memory.name)
+        memory._mmap = None  # type: ignore
+        fd = getattr(memory, "_fd", -1)
+        if fd >= 0:
+            os.close(fd)
+            memory._fd = -1  # type: ignore
+        return False
 
 
 class SHMContext(InvokeContext):
@@ -122,51 +290,69 @@ class SHMContext(InvokeContext):
         self.config = state["config"]
         self.manager = SharedMemoryManager(state["@mgr_address"])
 
-    def persist(self, model: T) -> SHMPersisted[T]:
-        buffers: list[pickle.PickleBuffer] = []
-
-        out = io.BytesIO()
-        pickler = SharedPickler(out, 5, buffer_callback=buffers.append)
-        pickler.dump(model)
-        data = out.getvalue()
-
-        total_size = sum(memoryview(b).nbytes for b in buffers)
-        _log.info(
-            "serialized %s to %d pickle bytes with %d buffers of %d bytes",
-            model,
-            len(data),
-            len(buffers),
-            total_size,
-        )
-
-        if buffers:
-            # blit the buffers to the SHM block
-            _log.debug("preparing to share %d buffers", len(buffers))
-            memory = self.manager.SharedMemory(size=total_size)
-            cur_offset = 0
-            blocks: list[SHMBlock] = []
-            for i, buf in enumerate(buffers):
-                ba = buf.raw()
-                blen = ba.nbytes
-                bend = cur_offset + blen
-                _log.debug("saving %d bytes in buffer %d/%d", blen, i + 1, len(buffers))
-                memory.buf[cur_offset:bend] = ba
-                blocks.append(SHMBlock(cur_offset, bend))
-                cur_offset = bend
+    def persist(self, model: T) -> PersistedModel[T]:
+        data, buffers = pickle_buffers(model)
+        _log.debug("persisting %s", model)
+        if self.config.dedup_persist:
+            digest = fingerprint(data, buffers, self.config.proc_count())
+            return self._persist_dedup(digest, lambda: self._persist_buffers(data, buffers))
         else:
-            memory = None
-            blocks = []
-
-        return SHMPersisted[T](data, memory, blocks)
+            return self._persist_buffers(data, buffers)
+
+    def _persist_buffers(
+        self, data: memoryview, buffers: list[pickle.PickleBuffer]
+    ) -> SHMPersisted[Any]:
+        persisted = persist_buffers(
+            data,
+            buffers,
+            self.manager,
+            self.config.proc_count(),
+            align=self.config.shm_align,
+            huge_pages=self.config.shm_huge_pages,
+        )
+        persisted.prefault = self.config.shm_prefault
+        persisted.huge_pages = self.config.shm_huge_pages
+        return persisted
+
+    def shared_array(
+        self, shape: int | tuple[int, ...], dtype: DTypeLike = "f8"
+    ) -> SHMPersisted[NDArray[Any]]:
+        import numpy as np
+
+        # a zero array is not touched by pickling, so we only use it for its header
+        template = np.zeros(shape, dtype)
+        data, buffers = pickle_buffers(template)
+        nbytes = template.nbytes
+        if len(buffers) != 1:
+            # empty arrays are pickled in-band
+            return SHMPersisted(bytes(data), None, [])
+
+        _log.debug("allocating %d bytes for shared array of shape %s", nbytes, template.shape)
+        memory = self.manager.SharedMemory(size=nbytes + len(data))
+        data_block = SHMBlock(nbytes, nbytes + len(data))
+        memory.buf[data_block.start : data_block.end] = data
+        return SHMPersisted(data_block, memory, [SHMBlock(0, nbytes)])
 
 
 class SHMPersisted(PersistedModel[T]):
-    pickle_data: bytes
+    pickle_data: bytes | SHMBlock
+    """
+    The pickle data, or the block of shared memory that contains it.
+    """
     blocks: list[SHMBlock]
     memory: Optional[shm.SharedMemory] = None
+    prefault: bool = False
+    "Whether to pre-fault the shared memory pages when loading the model."
+    huge_pages: bool = False
+    "Whether to request transparent huge pages when loading the model."
     _model: Optional[T] = None
 
-    def __init__(self, data: bytes, memory: shm.SharedMemory | None, blocks: list[SHMBlock]):
+    def __init__(
+        self,
+        data: bytes | SHMBlock,
+        memory: shm.SharedMemory | None,
+        blocks: list[SHMBlock],
+    ):
         self.pickle_data = data
         self.blocks = blocks
         self.memory = memory
@@ -175,12 +361,19 @@ class SHMPersisted(PersistedModel[T]):
     def get(self):
         if self._model is None:
             _log.debug("loading model from shared memory")
+            if self.memory is not None and (self.prefault or self.huge_pages):
+                advise_memory(self.memory, prefault=self.prefault, huge_pages=self.huge_pages)
             buffers: list[memoryview] = []
             for bs, be in self.blocks:
                 assert self.memory is not None, "persisted object with blocks has no shared memory"
                 buffers.append(self.memory.buf[bs:be])
 
-            self._model = pickle.loads(self.pickle_data, buffers=buffers)
+            if isinstance(self.pickle_data, SHMBlock):
+                assert self.memory is not None, "persisted object with blocks has no shared memory"
+                ds, de = self.pickle_data
+                self._model = pickle.loads(self.memory.buf[ds:de], buffers=buffers)
+            else:
+                self._model = pickle.loads(self.pickle_data, buffers=buffers)
 
         return self._model
 
@@ -189,10 +382,10 @@ class SHMPersisted(PersistedModel[T]):
 
         _log.debug("releasing SHM buffers")
         if self.memory is not None:
-            self.memory.close()
             if unlink and self.is_owner and self.is_owner != "transfer":
                 self.memory.unlink()
                 self.is_owner = False
+            _close_memory(self.memory)
             self.memory = None
 
     def __getstate__(self):
@@ -200,6 +393,8 @@ class SHMPersisted(PersistedModel[T]):
             "pickle_data": self.pickle_data,
             "blocks": self.blocks,
             "memory": self.memory,
+            "prefault": self.prefault,
+            "huge_pages": self.huge_pages,
             "is_owner": True if self.is_owner == "transfer" else False,
         }
 
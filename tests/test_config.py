@@ -4,24 +4,91 @@
 # Licensed under the MIT license, see LICENSE.md for details.
 # SPDX-License-Identifier: MIT
 
-import multiprocessing as mp
-
-from parinvoke.config import InvokeConfig
+import mmap
+import os
+from pathlib import Path
+
+from pytest import MonkeyPatch, mark, raises
+
+from parinvoke.config import (
+    InvokeConfig,
+    _cgroup_cpu_quota,
+    _parse_cpulist,
+    available_cpus,
+    worker_cpu_sets,
+)
 from parinvoke.util import set_env_var
 
 
 def test_proc_count_default():
     with set_env_var("PARINVOKE_NUM_PROCS", None):
         cfg = InvokeConfig()
-        assert cfg.proc_count() == mp.cpu_count()
+        assert cfg.proc_count() == available_cpus()
         assert cfg.proc_count(level=1) == 1
 
 
 def test_proc_count_div():
     with set_env_var("PARINVOKE_NUM_PROCS", None):
         cfg = InvokeConfig(core_div=2)
-        assert cfg.proc_count() == mp.cpu_count() // 2
-        assert cfg.proc_count(level=1) == 2
+        assert cfg.proc_count() == max(available_cpus() // 2, 1)
+        assert cfg.proc_count(level=1) == min(available_cpus(), 2)
+
+
+def test_cgroup_v2_quota(tmp_path: Path):
+    proc = tmp_path / "cgroup"
+    proc.write_text("0::/pod/app\n")
+    (tmp_path / "pod" / "app").mkdir(parents=True)
+    (tmp_path / "cpu.max").write_text("max 100000\n")
+    (tmp_path / "pod" / "cpu.max").write_text("400000 100000\n")
+    (tmp_path / "pod" / "app" / "cpu.max").write_text("max 100000\n")
+    assert _cgroup_cpu_quota(str(tmp_path), str(proc)) == 4.0
+
+    (tmp_path / "pod" / "app" / "cpu.max").write_text("150000 100000\n")
+    assert _cgroup_cpu_quota(str(tmp_path), str(proc)) == 1.5
+
+
+def test_cgroup_v1_quota(tmp_path: Path):
+    proc = tmp_path / "cgroup"
+    proc.write_text("4:memory:/\n2:cpu,cpuacct:/\n1:name=systemd:/\n")
+    cpu = tmp_path / "cpu,cpuacct"
+    cpu.mkdir()
+    (cpu / "cpu.cfs_period_us").write_text("100000\n")
+    (cpu / "cpu.cfs_quota_us").write_text("-1\n")
+    assert _cgroup_cpu_quota(str(tmp_path), str(proc)) is None
+
+    (cpu / "cpu.cfs_quota_us").write_text("200000\n")
+    assert _cgroup_cpu_quota(str(tmp_path), str(proc)) == 2.0
+
+
+def test_cgroup_no_quota(tmp_path: Path):
+    assert _cgroup_cpu_quota(str(tmp_path), str(tmp_path / "missing")) is None
+    proc = tmp_path / "cgroup"
+    proc.write_text("garbage\n0::/\n")
+    assert _cgroup_cpu_quota(str(tmp_path), str(proc)) is None
+
+
+def test_parse_cpulist():
+    assert _parse_cpulist("0\n") == {0}
+    assert _parse_cpulist("0-3,8-9,12\n") == {0, 1, 2, 3, 8, 9, 12}
+    assert _parse_cpulist("\n") == set()
+
+
+@mark.skipif(not hasattr(os, "sched_getaffinity"), reason="CPU affinity not supported")
+def test_worker_cpu_sets(tmp_path: Path, monkeypatch: MonkeyPatch):
+    monkeypatch.setattr(os, "sched_getaffinity", lambda _pid: set(range(8)))
+    for node, cpus in enumerate(["0-3", "4-7"]):
+        (tmp_path / f"node{node}").mkdir()
+        (tmp_path / f"node{node}" / "cpulist").write_text(cpus + "\n")
+
+    # sets alternate between nodes
+    sets = worker_cpu_sets(2, node_root=str(tmp_path))
+    assert sets == [{0, 1}, {4, 5}, {2, 3}, {6, 7}]
+    # sets do not straddle nodes
+    assert worker_cpu_sets(3, node_root=str(tmp_path)) == [{0, 1, 2}, {4, 5, 6}]
+    # unless they are bigger than a node
+    assert worker_cpu_sets(6, node_root=str(tmp_path)) == [set(range(6))]
+    # without NUMA information, all CPUs are one node
+    assert worker_cpu_sets(4, node_root=str(tmp_path / "missing")) == [{0, 1, 2, 3}, {4, 5, 6, 7}]
 
 
 def test_proc_count_env():
@@ -59,3 +126,76 @@ def test_proc_count_nest_env_prefix_fallback():
         assert cfg.proc_count() == 7
         assert cfg.proc_count(level=1) == 3
         assert cfg.proc_count(level=2) == 1
+
+
+def test_persistent_pool_env():
+    with set_env_var("PARINVOKE_PERSISTENT_POOL", None):
+        assert not InvokeConfig().persistent_pool
+        assert InvokeConfig(persistent_pool=True).persistent_pool
+
+    with set_env_var("PARINVOKE_PERSISTENT_POOL", "yes"):
+        assert InvokeConfig().persistent_pool
+        assert not InvokeConfig(persistent_pool=False).persistent_pool
+
+
+def test_start_method_default():
+    with set_env_var("PARINVOKE_START_METHOD", None):
+        cfg = InvokeConfig()
+        assert cfg.start_method == "spawn"
+        assert cfg.mp_context().get_start_method() == "spawn"
+
+
+def test_start_method_env():
+    with set_env_var("PARINVOKE_START_METHOD", "forkserver"), set_env_var(
+        "PARINVOKE_PRELOAD", "numpy, parinvoke._worker"
+    ):
+        cfg = InvokeConfig()
+        assert cfg.start_method == "forkserver"
+        assert cfg.preload == ["numpy", "parinvoke._worker"]
+
+
+def test_start_method_invalid():
+    cfg = InvokeConfig(start_method="thread")
+    with raises(ValueError):
+        cfg.mp_context()
+
+
+def test_backend_env():
+    with set_env_var("PARINVOKE_BACKEND", None):
+        assert InvokeConfig().backend == "process"
+        assert InvokeConfig(backend="thread").backend == "thread"
+
+    with set_env_var("PARINVOKE_BACKEND", "thread"):
+        assert InvokeConfig().backend == "thread"
+
+
+def test_shm_align_env():
+    with set_env_var("PARINVOKE_SHM_ALIGN", None):
+        assert InvokeConfig().shm_align == 64
+    with set_env_var("PARINVOKE_SHM_ALIGN", "page"):
+        assert InvokeConfig().shm_align == mmap.PAGESIZE
+    with set_env_var("PARINVOKE_SHM_ALIGN", "1"):
+        assert InvokeConfig().shm_align == 1
+
+
+def test_worker_limits_env():
+    with set_env_var("PARINVOKE_MAX_TASKS_PER_WORKER", None):
+        assert InvokeConfig().max_tasks_per_worker is None
+    with set_env_var("PARINVOKE_MAX_TASKS_PER_WORKER", "100"):
+        assert InvokeConfig().max_tasks_per_worker == 100
+    with set_env_var("PARINVOKE_MAX_WORKER_RSS", None):
+        assert InvokeConfig().max_worker_rss is None
+    with set_env_var("PARINVOKE_MAX_WORKER_RSS", "4096"):
+        assert InvokeConfig().max_worker_rss == 4096
+    with set_env_var("PARINVOKE_MAX_WORKER_RSS", "1.5G"):
+        assert InvokeConfig().max_worker_rss == 3 * 512 * 1024 * 1024
+    with set_env_var("PARINVOKE_TASK_RETRIES", None):
+        assert InvokeConfig().task_retries == 0
+    with set_env_var("PARINVOKE_TASK_RETRIES", "2"):
+        assert InvokeConfig().task_retries == 2
+    with set_env_var("PARINVOKE_TASK_TIMEOUT", "2.5"):
+        assert InvokeConfig().task_timeout == 2.5
+    with set_env_var("PARINVOKE_PIN_WORKERS", None):
+        assert not InvokeConfig().pin_workers
+    with set_env_var("PARINVOKE_PIN_WORKERS", "1"):
+        assert InvokeConfig().pin_workers
@@ -0,0 +1,128 @@
+# This file is part of parinvoke.
+# Copyright (C) 2020-2023 Boise State University
+# Copyright (C) 2023-2024 Drexel University
+# Licensed under the MIT license, see LICENSE.md for details.
+# SPDX-License-Identifier: MIT
+
+import logging
+import multiprocessing as mp
+import time
+from queue import Queue
+from typing import Any
+
+from pytest import LogCaptureFixture, mark, raises
+
+from parinvoke import InvokeContext
+from parinvoke.config import InvokeConfig
+from parinvoke.invoker import TaskTimeoutError
+from parinvoke.logging import (
+    BatchQueueHandler,
+    close_worker_logs,
+    install_worker_logging,
+    log_levels,
+    log_queue,
+)
+
+_log = logging.getLogger(__name__)
+
+
+def _record(level: int, msg: str):
+    return _log.makeRecord(_log.name, level, __file__, 0, msg, (), None)
+
+
+def test_batch_handler():
+    queue: Queue[Any] = Queue()
+    h = BatchQueueHandler(queue, capacity=3)  # type: ignore
+    h.handle(_record(logging.DEBUG, "a"))
+    h.handle(_record(logging.INFO, "b"))
+    assert queue.empty()
+
+    # the batch fills up
+    h.handle(_record(logging.DEBUG, "c"))
+    assert [r.msg for r in queue.get_nowait()] == ["a", "b", "c"]
+
+    # warnings are sent immediately
+    h.handle(_record(logging.DEBUG, "d"))
+    h.handle(_record(logging.WARNING, "e"))
+    assert [r.msg for r in queue.get_nowait()] == ["d", "e"]
+
+    h.handle(_record(logging.DEBUG, "f"))
+    h.flush()
+    assert [r.msg for r in queue.get_nowait()] == ["f"]
+
+
+def _enabled(_model: Any, name: str):
+    return {
+        level: logging.getLogger(name).isEnabledFor(level)
+        for level in [logging.DEBUG, logging.INFO, logging.WARNING]
+    }
+
+
+def test_worker_levels():
+    quiet = logging.getLogger("parinvoke.test.quiet")
+    old = quiet.level
+    quiet.setLevel(logging.WARNING)
+    try:
+        assert log_levels()["parinvoke.test.quiet"] == logging.WARNING
+        with InvokeContext.default() as ctx:
+            with ctx.invoker(None, _enabled, 2) as inv:
+                (quiet_en,) = inv.map(["parinvoke.test.quiet.child"])
+                assert quiet_en == {
+                    logging.DEBUG: False,
+                    logging.INFO: False,
+                    logging.WARNING: True,
+                }
+    finally:
+        quiet.setLevel(old)
+
+
+def _log_and_exit(queue: Any):
+    install_worker_logging(queue)
+    _log.warning("exiting")
+    close_worker_logs(timeout=0.5)
+
+
+def _log_warning(_model: Any, x: float):
+    time.sleep(x)
+    _log.warning("task %s", x)
+    return x
+
+
+def test_log_after_killed_worker(caplog: LogCaptureFixture):
+    config = InvokeConfig(task_timeout=1)
+    with InvokeContext.default(config) as ctx:
+        queue = log_queue(config.mp_context())
+        # as if a killed worker had left the shared log queue locked
+        locked = queue._wlock is not None and queue._wlock.acquire()  # type: ignore
+        try:
+            with ctx.invoker(None, _log_warning, 2) as inv:
+                with raises(TaskTimeoutError):
+                    inv.submit(60).result()
+                assert list(inv.map([0.1, 0.2])) == [0.1, 0.2]
+        finally:
+            if locked:
+                queue._wlock.release()  # type: ignore
+
+    # the workers' records reached the parent regardless
+    assert "task 0.1" in caplog.messages
+    assert "task 0.2" in caplog.messages
+
+
+# Windows can neither fork nor lock queues for writing
+@mark.skipif("fork" not in mp.get_all_start_methods(), reason="fork not available")
+def test_close_stuck_logs():
+    ctx = mp.get_context("fork")
+    queue = ctx.Queue()
+    # as if a worker died while writing to the queue
+    queue._wlock.acquire()  # type: ignore
+    try:
+        start = time.perf_counter()
+        proc = ctx.Process(target=_log_and_exit, args=(queue,))
+        proc.start()
+        proc.join(30)
+        assert proc.exitcode == 0
+        assert time.perf_counter() - start < 10
+    finally:
+        if proc.is_alive():
+            proc.kill()
+        queue._wlock.release()  # type: ignore
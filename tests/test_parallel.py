@@ -4,17 +4,28 @@
 # Licensed under the MIT license, see LICENSE.md for details.
 # SPDX-License-Identifier: MIT
 
+import asyncio
 import logging
 import multiprocessing as mp
 import os
+import time
+from collections import Counter
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
 from typing import Any
 
 import numpy as np
 import numpy.typing as npt
 
-from pytest import approx, fixture, mark  # type: ignore
+from pytest import LogCaptureFixture, approx, fixture, mark, raises, skip  # type: ignore
 
 from parinvoke import InvokeContext, is_mp_worker, is_worker
+from parinvoke.config import InvokeConfig, worker_cpu_sets
+from parinvoke.invoker import ModelOpInvoker, TaskTimeoutError, WorkerCrashError
+from parinvoke.invoker.threads import ThreadPoolOpInvoker
+from parinvoke.sharing import PersistedModel
+from parinvoke.sharing.binpickle import BPKContext
+from parinvoke.sharing.shm import SHM_AVAILABLE, SHMContext, SHMPersisted
 
 _log = logging.getLogger(__name__)
 
@@ -50,3 +61,678 @@ def test_mp_is_worker(ctx: InvokeContext):
         res = list(loop.map(range(10)))
         assert all([w for (_pid, w, _mpw) in res])
         assert all([mpw for (_pid, _w, mpw) in res])
+
+
+@mark.parametrize("chunksize", [1, 7, "auto"])
+def test_invoke_chunked(ctx: InvokeContext, chunksize: int | str):
+    matrix = np.random.randn(100, 100)
+    vectors = [np.random.randn(100) for _i in range(250)]
+    with ctx.invoker(matrix, _mul_op, 2) as inv:
+        mults = list(inv.map(vectors, chunksize=chunksize))
+        assert len(mults) == len(vectors)
+        for rv, v in zip(mults, vectors):
+            act_rv = matrix @ v
+            assert act_rv == approx(rv, abs=1.0e-6)
+
+
+def test_invoke_bounded(ctx: InvokeContext):
+    matrix = np.random.randn(100, 100)
+    vectors = [np.random.randn(100) for _i in range(100)]
+    consumed = 0
+
+    def gen():
+        nonlocal consumed
+        for v in vectors:
+            consumed += 1
+            yield v
+
+    with ctx.invoker(matrix, _mul_op, 2) as inv:
+        mults = inv.map(gen(), max_pending=10)
+        first = next(mults)
+        assert first == approx(matrix @ vectors[0], abs=1.0e-6)
+        # only a bounded number of inputs have been pulled
+        assert consumed <= 11
+
+        rest = list(mults)
+        assert len(rest) == len(vectors) - 1
+        for rv, v in zip(rest, vectors[1:]):
+            assert rv == approx(matrix @ v, abs=1.0e-6)
+
+
+@mark.parametrize("n_jobs", [1, 2])
+@mark.parametrize("chunksize", [None, 3, "auto"])
+def test_invoke_unordered(ctx: InvokeContext, n_jobs: int, chunksize: int | str | None):
+    matrix = np.random.randn(100, 100)
+    vectors = [np.random.randn(100) for _i in range(50)]
+    with ctx.invoker(matrix, _mul_op, n_jobs) as inv:
+        mults = list(inv.map_unordered(vectors, chunksize=chunksize, max_pending=8))
+        assert sorted(i for i, _r in mults) == list(range(len(vectors)))
+        for i, rv in mults:
+            assert rv == approx(matrix @ vectors[i], abs=1.0e-6)
+
+
+def _model_pid(model: str, *args: Any):
+    return model, os.getpid()
+
+
+def test_persistent_pool():
+    with InvokeContext.default(InvokeConfig(persistent_pool=True)) as ctx:
+        with ctx.invoker("foo", _model_pid, 2) as inv:
+            res = list(inv.map(range(20)))
+            assert all(m == "foo" for m, _pid in res)
+            pids = set(pid for _m, pid in res)
+
+        with ctx.invoker("bar", _model_pid, 2) as inv:
+            res = list(inv.map(range(20), chunksize=3))
+            assert all(m == "bar" for m, _pid in res)
+            # the second invoker reuses the first invoker's workers
+            assert set(pid for _m, pid in res) <= pids
+
+        assert ctx.worker_pool(2) is ctx.worker_pool(2)
+
+
+_handle_loads = 0
+
+
+class _CountedHandle(PersistedModel[str]):
+    "Persisted model that counts how many times a worker unpickles it."
+
+    def __init__(self, value: str):
+        self.value = value
+        self.is_owner = True
+
+    def get(self) -> str:
+        return self.value
+
+    def close(self):
+        pass
+
+    def __setstate__(self, state: dict[str, Any]):
+        global _handle_loads
+        _handle_loads += 1
+        self.__dict__.update(state)
+
+
+def _handle_loads_op(model: str, _x: Any):
+    return os.getpid(), _handle_loads
+
+
+@mark.parametrize("backend", ["process", "ring"])
+def test_shared_pool_sends_op_once(backend: str):
+    if backend == "ring" and not SHM_AVAILABLE:
+        skip("shared memory not available")
+
+    config = InvokeConfig(persistent_pool=True, backend=backend)
+    with InvokeContext.default(config) as ctx:
+        for chunksize in [None, 2, "auto"]:
+            with ctx.invoker(_CountedHandle("foo"), _handle_loads_op, 2) as inv:
+                res = list(inv.map(range(50), chunksize=chunksize))
+
+            # each worker unpickles the operation's model handle once, not per task
+            loads: dict[int, set[int]] = {}
+            for pid, n in res:
+                loads.setdefault(pid, set()).add(n)
+            assert all(len(ns) == 1 for ns in loads.values())
+
+
+def _segment_mapped(model: Any, name: str):
+    with open("/proc/self/maps") as f:
+        return name in f.read()
+
+
+@mark.skipif(not SHM_AVAILABLE, reason="shared memory not available")
+@mark.skipif(not os.path.exists("/proc/self/maps"), reason="memory maps not available")
+@mark.parametrize("backend", ["process", "ring"])
+def test_shared_pool_releases_model(backend: str):
+    config = InvokeConfig(persistent_pool=True, backend=backend)
+    with SHMContext(config) as ctx:
+        model = ctx.persist(np.random.randn(1000, 100))
+        assert isinstance(model, SHMPersisted) and model.memory is not None
+        name = model.memory.name
+        with ctx.invoker(model, _segment_mapped, 2) as inv:
+            assert all(inv.map([name] * 20))
+
+        # shutting down the invoker removes its operation and model from the workers
+        with ctx.invoker("foo", _segment_mapped, 2) as inv:
+            assert not any(inv.map([name] * 20))
+        model.close()
+
+
+def test_invoke_forkserver():
+    if "forkserver" not in mp.get_all_start_methods():
+        skip("forkserver not available")
+
+    config = InvokeConfig(start_method="forkserver", preload=["numpy"])
+    matrix = np.random.randn(100, 100)
+    vectors = [np.random.randn(100) for _i in range(20)]
+    with InvokeContext.default(config) as ctx:
+        with ctx.invoker(matrix, _mul_op, 2) as inv:
+            for rv, v in zip(inv.map(vectors), vectors):
+                assert rv == approx(matrix @ v, abs=1.0e-6)
+
+        res = ctx.run_sp(_mul_op, matrix, vectors[0])
+        assert res == approx(matrix @ vectors[0], abs=1.0e-6)
+
+
+def _outer_op(m: npt.NDArray[np.float64], v: npt.NDArray[np.float64]):
+    # large enough to go through shared memory
+    return np.outer(m @ v, v)
+
+
+@mark.parametrize("chunksize", [None, "auto"])
+def test_invoke_shm_results(ctx: InvokeContext, chunksize: str | None):
+    matrix = np.random.randn(500, 500)
+    vectors = [np.random.randn(500) for _i in range(10)]
+    with ctx.invoker(matrix, _outer_op, 2, shm_results=True) as inv:
+        results = list(inv.map(vectors, chunksize=chunksize))
+        for rv, v in zip(results, vectors):
+            assert rv.shape == (500, 500)
+            assert np.allclose(rv, np.outer(matrix @ v, v))
+
+
+@mark.parametrize("chunksize", [None, "auto"])
+def test_invoke_shm_small_results(ctx: InvokeContext, chunksize: str | None):
+    matrix = np.random.randn(100, 100)
+    vectors = [np.random.randn(100) for _i in range(10)]
+    with ctx.invoker(matrix, _mul_op, 2, shm_results=True) as inv:
+        results = list(inv.map(vectors, chunksize=chunksize))
+        for rv, v in zip(results, vectors):
+            assert rv == approx(matrix @ v, abs=1.0e-6)
+            # results below the threshold are copied, not mapped
+            assert rv.flags.writeable
+
+
+@mark.parametrize("n_jobs", [1, 2])
+@mark.parametrize("method", ["shm", "binpickle"])
+def test_invoke_map_into(n_jobs: int, method: str):
+    if method == "shm" and not SHM_AVAILABLE:
+        skip("SHM backend not available")
+
+    matrix = np.random.randn(100, 100)
+    vectors = [np.random.randn(100) for _i in range(50)]
+    with SHMContext() if method == "shm" else BPKContext() as ctx:
+        out = ctx.shared_array((len(vectors), 100))
+        try:
+            with ctx.invoker(matrix, _mul_op, n_jobs) as inv:
+                inv.map_into(out, vectors)
+                # no iterables means no tasks, as with map
+                inv.map_into(out)
+            result = out.get()
+            for rv, v in zip(result, vectors):
+                assert rv == approx(matrix @ v, abs=1.0e-6)
+            del result
+        finally:
+            out.close()
+
+
+@mark.parametrize("chunksize", [None, "auto"])
+def test_invoke_threads(chunksize: str | None):
+    matrix = np.random.randn(100, 100)
+    vectors = [np.random.randn(100) for _i in range(100)]
+    with InvokeContext.default(InvokeConfig(backend="thread")) as ctx:
+        with ctx.invoker(matrix, _mul_op, 4) as inv:
+            assert isinstance(inv, ThreadPoolOpInvoker)
+            mults = list(inv.map(vectors, chunksize=chunksize))
+            for rv, v in zip(mults, vectors):
+                assert rv == approx(matrix @ v, abs=1.0e-6)
+
+            unordered = list(inv.map_unordered(vectors, chunksize=chunksize))
+            assert sorted(i for i, _r in unordered) == list(range(len(vectors)))
+
+
+def test_threads_not_worker():
+    with InvokeContext.default(InvokeConfig(backend="thread")) as ctx:
+        with ctx.invoker("foo", _worker_status, 2) as inv:
+            for pid, w, mpw in inv.map(range(10)):
+                assert pid == os.getpid()
+                assert not w
+                assert not mpw
+
+
+@mark.parametrize("n_jobs", [1, 2])
+@mark.parametrize("backend", ["process", "ring", "thread"])
+def test_invoke_async(n_jobs: int, backend: str):
+    matrix = np.random.randn(100, 100)
+    vectors = [np.random.randn(100) for _i in range(20)]
+
+    async def run(inv: ModelOpInvoker[Any, Any]):
+        mults = [rv async for rv in inv.amap(vectors, chunksize="auto")]
+        singles = await asyncio.gather(*[inv.asubmit(v) for v in vectors[:5]])
+        return mults, singles
+
+    with InvokeContext.default(InvokeConfig(backend=backend)) as ctx:
+        with ctx.invoker(matrix, _mul_op, n_jobs) as inv:
+            mults, singles = asyncio.run(run(inv))
+
+    assert len(mults) == len(vectors)
+    for rv, v in zip(mults, vectors):
+        assert rv == approx(matrix @ v, abs=1.0e-6)
+    for rv, v in zip(singles, vectors):
+        assert rv == approx(matrix @ v, abs=1.0e-6)
+
+
+@mark.parametrize("n_jobs", [1, 2])
+def test_invoke_submit(ctx: InvokeContext, n_jobs: int):
+    matrix = np.random.randn(100, 100)
+    vectors = [np.random.randn(100) for _i in range(5)]
+    with ctx.invoker(matrix, _mul_op, n_jobs) as inv:
+        futures = [inv.submit(v) for v in vectors]
+        for fut, v in zip(futures, vectors):
+            assert fut.result() == approx(matrix @ v, abs=1.0e-6)
+
+
+def _nullary_op(model: str):
+    return model.upper()
+
+
+@mark.parametrize("n_jobs", [1, 2])
+@mark.parametrize("backend", ["process", "ring", "thread"])
+def test_invoke_submit_no_args(n_jobs: int, backend: str):
+    with InvokeContext.default(InvokeConfig(backend=backend)) as ctx:
+        with ctx.invoker("foo", _nullary_op, n_jobs) as inv:
+            assert inv.submit().result(timeout=60) == "FOO"
+            assert asyncio.run(asyncio.wait_for(inv.asubmit(), 60)) == "FOO"
+
+
+class _MapOnlyInvoker(ModelOpInvoker[str, str]):
+    "Invoker with the default submit."
+
+    def map(self, *iterables: Any, chunksize: Any = None, max_pending: Any = None):
+        return ("FOO" for _args in zip(*iterables))
+
+
+def test_default_submit_no_args():
+    with _MapOnlyInvoker() as inv:
+        with raises(TypeError):
+            inv.submit().result(timeout=60)
+        with raises(TypeError):
+            asyncio.run(asyncio.wait_for(inv.asubmit(), 60))
+
+
+def test_default_stats():
+    with _MapOnlyInvoker() as inv:
+        s1 = inv.stats()
+        s2 = inv.stats()
+    assert s1.tasks == 0
+    assert s1.worker_compute_time == {}
+    # snapshots do not share their dictionaries
+    assert s1.worker_compute_time is not s2.worker_compute_time
+
+
+def _fail_op(model: Any, arg: Any):
+    raise ValueError(arg)
+
+
+@mark.parametrize("n_jobs", [1, 2])
+def test_invoke_submit_fail(ctx: InvokeContext, n_jobs: int):
+    with ctx.invoker("foo", _fail_op, n_jobs) as inv:
+        fut = inv.submit("bar")
+        with raises(ValueError):
+            fut.result()
+
+
+def _big_op(model: Any, n: int):
+    return np.full(n, n, dtype=np.float64)
+
+
+@mark.skipif(not SHM_AVAILABLE, reason="shared memory not available")
+@mark.parametrize("chunksize", [None, 2, "auto"])
+def test_invoke_ring(chunksize: int | str | None):
+    matrix = np.random.randn(100, 100)
+    vectors = [np.random.randn(100) for _i in range(100)]
+    with InvokeContext.default(InvokeConfig(backend="ring")) as ctx:
+        with ctx.invoker(matrix, _mul_op, 2) as inv:
+            mults = list(inv.map(vectors, chunksize=chunksize))
+            for rv, v in zip(mults, vectors):
+                assert rv == approx(matrix @ v, abs=1.0e-6)
+
+            unordered = list(inv.map_unordered(vectors, chunksize=chunksize))
+            assert sorted(i for i, _r in unordered) == list(range(len(vectors)))
+
+
+@mark.skipif(not SHM_AVAILABLE, reason="shared memory not available")
+def test_ring_submit_fail():
+    with InvokeContext.default(InvokeConfig(backend="ring")) as ctx:
+        with ctx.invoker("foo", _fail_op, 2) as inv:
+            fut = inv.submit("bar")
+            with raises(ValueError):
+                fut.result()
+
+        # tasks and results too large for a ring slot are spilled
+        with ctx.invoker("foo", _big_op, 2) as inv:
+            sizes = [10, 100_000, 10, 200_000]
+            for n, res in zip(sizes, inv.map(sizes)):
+                assert res.shape == (n,)
+                assert np.all(res == n)
+
+        with ctx.invoker(np.ones((1, 200_000)), _mul_op, 2) as inv:
+            assert inv.submit(np.ones(200_000)).result() == approx([200_000])
+
+
+@mark.skipif(not SHM_AVAILABLE, reason="shared memory not available")
+def test_ring_unsupported_settings(caplog: LogCaptureFixture):
+    config = InvokeConfig(backend="ring", task_timeout=10, max_tasks_per_worker=5)
+    with InvokeContext.default(config) as ctx:
+        with ctx.invoker(None, _sleep_op, 2) as inv:
+            assert list(inv.map([0, 0])) == [0, 0]
+
+    assert any(
+        "ignores max_tasks_per_worker, task_timeout" in r.message
+        for r in caplog.records
+        if r.levelno == logging.WARNING
+    )
+
+
+@mark.skipif(not SHM_AVAILABLE, reason="shared memory not available")
+def test_ring_crash_while_busy():
+    with InvokeContext.default(InvokeConfig(backend="ring")) as ctx:
+        with ctx.invoker("", _crash_op, 2) as inv:
+            crash = inv.submit(3)
+            # the other worker keeps posting results, so the pool is never idle
+            start = time.perf_counter()
+            while not crash.done() and time.perf_counter() - start < 30:
+                try:
+                    inv.submit(0).result()
+                except BrokenProcessPool:
+                    break
+
+            with raises(BrokenProcessPool):
+                crash.result(timeout=0)
+
+
+def _affinity(model: Any, _x: Any):
+    return os.getpid(), os.sched_getaffinity(0)
+
+
+@mark.skipif(not hasattr(os, "sched_getaffinity"), reason="CPU affinity not supported")
+@mark.parametrize("backend", ["process", "ring"])
+def test_pin_workers(backend: str):
+    with InvokeContext.default(InvokeConfig(backend=backend, pin_workers=True)) as ctx:
+        sets = worker_cpu_sets(ctx.config.proc_count(level=1))
+        with ctx.invoker("foo", _affinity, 2) as inv:
+            pinned = dict(inv.map(range(20)))
+
+    for cpus in pinned.values():
+        assert cpus in sets
+    if len(sets) > 1:
+        assert len(set(map(frozenset, pinned.values()))) == len(pinned)
+
+
+_loaded_at: float | None = None
+
+
+class _LoadStamp:
+    "Model that records when it was loaded."
+
+    def __init__(self):
+        self.created = time.time()
+
+    def __setstate__(self, state: dict[str, Any]):
+        global _loaded_at
+        self.__dict__.update(state)
+        _loaded_at = time.time()
+
+
+def _loaded_at_op(model: _LoadStamp, _x: Any):
+    return _loaded_at
+
+
+def test_eager_load():
+    with InvokeContext.default(InvokeConfig(eager_load=True)) as ctx:
+        with ctx.invoker(_LoadStamp(), _loaded_at_op, 2) as inv:
+            ready = time.time()
+            loaded = list(inv.map(range(10)))
+            assert all(t is not None and t <= ready for t in loaded)
+
+
+@mark.parametrize("backend", ["process", "ring"])
+def test_eager_load_shared_pool(backend: str):
+    if backend == "ring" and not SHM_AVAILABLE:
+        skip("shared memory not available")
+
+    config = InvokeConfig(eager_load=True, persistent_pool=True, backend=backend)
+    with InvokeContext.default(config) as ctx:
+        with ctx.invoker(_LoadStamp(), _loaded_at_op, 2) as inv:
+            ready = time.time()
+            loaded = list(inv.map(range(10)))
+            assert all(t is not None and t <= ready for t in loaded)
+            # loading the model in each worker does not count as a task
+            assert inv.stats().tasks == 10
+
+
+def test_wait_ready(ctx: InvokeContext):
+    with ctx.invoker("foo", _worker_status, 2) as inv:
+        inv.wait_ready(timeout=60)
+        res = list(inv.map(range(10)))
+        assert len(res) == 10
+
+
+_prepare_count = 0
+
+
+def _prepare_twice(model: npt.NDArray[np.float64]):
+    global _prepare_count
+    _prepare_count += 1
+    return model * 2
+
+
+def _prepared_op(model: npt.NDArray[np.float64], v: npt.NDArray[np.float64]):
+    return model @ v, os.getpid(), _prepare_count
+
+
+@mark.parametrize("n_jobs", [1, 2])
+@mark.parametrize("backend", ["process", "ring", "thread"])
+def test_invoke_prepare(n_jobs: int, backend: str):
+    global _prepare_count
+    _prepare_count = 0
+    matrix = np.random.randn(100, 100)
+    vectors = [np.random.randn(100) for _i in range(20)]
+    with InvokeContext.default(InvokeConfig(backend=backend)) as ctx:
+        with ctx.invoker(matrix, _prepared_op, n_jobs, prepare=_prepare_twice) as inv:
+            results = list(inv.map(vectors))
+
+    for (rv, _pid, count), v in zip(results, vectors):
+        assert rv == approx(2 * matrix @ v, abs=1.0e-6)
+        # each worker prepares the model exactly once
+        assert count == 1
+
+
+@mark.parametrize("chunksize", [None, 2, "auto"])
+def test_recycle_tasks(chunksize: int | str | None):
+    with InvokeContext.default(InvokeConfig(max_tasks_per_worker=3)) as ctx:
+        with ctx.invoker("foo", _worker_status, 2) as inv:
+            res = list(inv.map(range(30), chunksize=chunksize))
+
+    assert len(res) == 30
+    assert all(w and mpw for _pid, w, mpw in res)
+    pids = set(pid for pid, _w, _mpw in res)
+    assert len(pids) > 2
+
+
+@mark.parametrize("ordered", [True, False])
+def test_recycle_tasks_chunked(ordered: bool):
+    with InvokeContext.default(InvokeConfig(max_tasks_per_worker=10)) as ctx:
+        with ctx.invoker("foo", _worker_status, 2) as inv:
+            if ordered:
+                res = list(inv.map(range(40), chunksize=5))
+            else:
+                res = [r for _i, r in inv.map_unordered(range(40), chunksize=5)]
+
+    assert len(res) == 40
+    # batches count each of their tasks towards the limit
+    counts = Counter(pid for pid, _w, _mpw in res)
+    assert len(counts) >= 4
+    assert max(counts.values()) <= 10
+
+
+def test_recycle_rss():
+    with InvokeContext.default(InvokeConfig(max_worker_rss=1)) as ctx:
+        with ctx.invoker("foo", _worker_status, 2) as inv:
+            res = list(inv.map(range(10)))
+
+    assert len(res) == 10
+    assert len(set(pid for pid, _w, _mpw in res)) > 2
+
+
+def _crash_op(flag: str, x: int):
+    # crash on 3, but only the first time if given a flag file
+    if x == 3 and not (flag and os.path.exists(flag)):
+        if flag:
+            open(flag, "w").close()
+        os._exit(3)
+    return x
+
+
+def test_crash_retry(tmp_path: Path):
+    flag = os.fspath(tmp_path / "crashed")
+    with InvokeContext.default(InvokeConfig(task_retries=1)) as ctx:
+        with ctx.invoker(flag, _crash_op, 2) as inv:
+            res = list(inv.map(range(10)))
+            assert res == list(range(10))
+            assert os.path.exists(flag)
+
+
+def test_crash_fail():
+    with InvokeContext.default(InvokeConfig(task_retries=1)) as ctx:
+        with ctx.invoker("", _crash_op, 2) as inv:
+            futures = [inv.submit(x) for x in range(10)]
+            for x, fut in enumerate(futures):
+                if x == 3:
+                    with raises(WorkerCrashError):
+                        fut.result()
+                else:
+                    assert fut.result() == x
+
+            # the pool survives
+            assert list(inv.map(range(5, 10))) == list(range(5, 10))
+
+
+def test_crash_recycle():
+    with InvokeContext.default(InvokeConfig(max_tasks_per_worker=2)) as ctx:
+        with ctx.invoker("", _crash_op, 2) as inv:
+            for _round in range(5):
+                futures = [inv.submit(x) for x in range(6)]
+                with raises(WorkerCrashError):
+                    futures[3].result()
+                for fut in futures[4:]:
+                    fut.result()
+
+            # crashes of retiring workers do not grow the pool
+            manager = inv.executor._manager  # type: ignore
+            assert len([w for w in manager._workers if not w.retiring]) <= 2
+
+
+def _sleep_op(model: Any, x: float):
+    time.sleep(x)
+    return x
+
+
+def test_task_timeout():
+    with InvokeContext.default(InvokeConfig(task_timeout=1)) as ctx:
+        with ctx.invoker(None, _sleep_op, 2) as inv:
+            inv.wait_ready()
+            start = time.perf_counter()
+            futures = [inv.submit(x) for x in [0.1, 60, 0.1, 0.1]]
+            for x, fut in zip([0.1, 60, 0.1, 0.1], futures):
+                if x > 1:
+                    with raises(TaskTimeoutError):
+                        fut.result()
+                else:
+                    assert fut.result() == x
+            assert time.perf_counter() - start < 30
+
+            # the worker was replaced
+            assert list(inv.map([0.1] * 4)) == [0.1] * 4
+
+
+@mark.parametrize("chunksize", [None, 2, "auto"])
+def test_cancel_on_close(chunksize: int | str | None):
+    with InvokeContext.default() as ctx:
+        with ctx.invoker(None, _sleep_op, 2) as inv:
+            inv.wait_ready()
+            results = inv.map([0.25] * 100, chunksize=chunksize)
+            assert next(results) == 0.25
+            results.close()  # type: ignore
+            del results
+
+            start = time.perf_counter()
+            assert list(inv.map([0.0] * 4)) == [0.0] * 4
+            assert time.perf_counter() - start < 5
+
+
+@mark.parametrize("n_jobs", [1, 2])
+@mark.parametrize("backend", ["process", "ring", "thread"])
+def test_invoke_stats(n_jobs: int, backend: str):
+    matrix = np.random.randn(100, 100)
+    vectors = [np.random.randn(100) for _i in range(20)]
+    with InvokeContext.default(InvokeConfig(backend=backend)) as ctx:
+        with ctx.invoker(matrix, _mul_op, n_jobs) as inv:
+            assert inv.stats().tasks == 0
+            list(inv.map(vectors))
+            # batched tasks are counted individually
+            list(inv.map(vectors, chunksize=5))
+            list(inv.map(vectors, chunksize="auto"))
+            stats = inv.stats()
+
+    assert stats.tasks == 60
+    assert stats.failed == 0
+    assert stats.compute_time > 0
+    assert stats.load_time >= 0
+    assert stats.worker_compute_time is not None
+    assert 1 <= len(stats.worker_compute_time) <= n_jobs
+    assert sum(stats.worker_compute_time.values()) == approx(stats.compute_time)
+    if n_jobs > 1 and backend != "thread":
+        assert stats.load_time > 0
+        assert stats.bytes_sent > 20 * 100 * 8
+        assert stats.bytes_received > 20 * 100 * 8
+    if n_jobs > 1 and backend == "process":
+        assert stats.queue_wait > 0
+
+
+def _dot_op(model: npt.NDArray[np.float64], v: npt.NDArray[np.float64], w: Any):
+    return float(v.sum() * (model @ w.ravel())), v.flags.c_contiguous
+
+
+_retained: list[npt.NDArray[np.float64]] = []
+
+
+def _retain_op(model: Any, v: npt.NDArray[np.float64]):
+    _retained.append(v)
+    return os.getpid(), [float(a[0]) for a in _retained]
+
+
+def test_invoke_retained_args(ctx: InvokeContext):
+    # arguments big enough to go through shared memory
+    with ctx.invoker(None, _retain_op, 2) as inv:
+        sent: dict[int, list[float]] = {}
+        for i in range(6):
+            pid, seen = inv.submit(np.full(64 * 1024, float(i))).result()
+            sent.setdefault(pid, []).append(float(i))
+            # earlier arguments were not overwritten by later tasks
+            assert seen == sent[pid]
+
+
+@mark.parametrize("n_jobs", [1, 2])
+def test_invoke_large_args(ctx: InvokeContext, n_jobs: int):
+    model = np.random.randn(256)
+    args = [
+        (np.random.randn(256 * 256), np.random.randn(256)),
+        # fortran-order and small non-contiguous arrays
+        (np.asfortranarray(np.random.randn(256, 256)), np.random.randn(512)[::2]),
+        # small enough to pickle in-band
+        (np.random.randn(100), np.random.randn(256)),
+        # large and non-contiguous
+        (np.random.randn(2 * 256 * 256)[::2], np.random.randn(256)),
+    ]
+    with ctx.invoker(model, _dot_op, n_jobs) as inv:
+        for _round in range(3):
+            futures = [inv.submit(v, w) for v, w in args]
+            for fut, (v, w) in zip(futures, args):
+                res, c_order = fut.result()
+                assert res == approx(v.sum() * (model @ w.ravel()))
+                if v.flags.c_contiguous or v.flags.f_contiguous:
+                    assert c_order == v.flags.c_contiguous
+
+        if n_jobs > 1:
+            stats = inv.stats()
+            assert stats.bytes_sent > 9 * 256 * 256 * 8
@@ -6,15 +6,22 @@
 
 from __future__ import annotations
 
+import gc
 import io
+import mmap
+import os
 import pickle
+from multiprocessing.shared_memory import SharedMemory
+from pathlib import Path
 from typing import Any
 
 import numpy as np
 from numpy.typing import NDArray
 
-from pytest import fixture, skip
+from pytest import MonkeyPatch, fixture, mark, skip
 
+from parinvoke.config import InvokeConfig
+from parinvoke.sharing import PersistedRef, shm
 from parinvoke.sharing.binpickle import BPKContext
 from parinvoke.sharing.shm import SHM_AVAILABLE, SharedPickler, SHMContext
 
@@ -103,3 +110,168 @@ def test_persist_shm(shm_context: SHMContext):
         del m2
     finally:
         share.close()
+
+
+def test_shared_array_shm(shm_context: SHMContext):
+    share = shm_context.shared_array((100, 10), np.int32)
+    try:
+        arr = share.get()
+        assert arr.shape == (100, 10)
+        assert arr.dtype == np.int32
+        assert np.all(arr == 0)
+        arr[5, :] = 7
+
+        # a second attachment sees the same memory
+        copy = pickle.loads(pickle.dumps(share))
+        assert np.all(copy.get()[5, :] == 7)
+        copy.close()
+        del arr
+    finally:
+        share.close()
+
+
+def test_shared_array_bpk(bpk_context: BPKContext):
+    share = bpk_context.shared_array(50)
+    try:
+        arr = share.get()
+        assert arr.shape == (50,)
+        assert np.all(arr == 0)
+        arr[3] = 2.5
+
+        copy = pickle.loads(pickle.dumps(share))
+        assert copy.get()[3] == 2.5
+        copy.close()
+        del arr
+    finally:
+        share.close()
+    assert not share.path.exists()
+
+
+@mark.parametrize("method", ["shm", "binpickle"])
+def test_persist_dedup(method: str):
+    if method == "shm" and not SHM_AVAILABLE:
+        skip("shared memory not available")
+
+    config = InvokeConfig(dedup_persist=True)
+    matrix = np.random.randn(1000, 100)
+    with SHMContext(config) if method == "shm" else BPKContext(config=config) as ctx:
+        s1 = ctx.persist(matrix)
+        s2 = ctx.persist(matrix.copy())
+        s3 = ctx.persist(matrix + 1)
+        assert isinstance(s1, PersistedRef)
+        assert isinstance(s2, PersistedRef)
+        assert s1.persisted is s2.persisted
+        assert s3.persisted is not s1.persisted
+
+        # closing one reference leaves the other usable
+        s1.close()
+        m2 = pickle.loads(pickle.dumps(s2))
+        assert not m2.is_owner
+        assert np.all(m2.get() == matrix)
+        m2.close()
+
+        s2.close()
+        s3.close()
+        assert not ctx._dedup
+
+
+def test_persist_dedup_bpk_files(tmp_path: Path):
+    config = InvokeConfig(dedup_persist=True)
+    matrix = np.random.randn(1000, 100)
+    ctx = BPKContext(tmp_path, config)
+    s1 = ctx.persist(matrix)
+    s2 = ctx.persist(matrix.copy())
+    assert isinstance(s1, PersistedRef)
+    assert isinstance(s2, PersistedRef)
+    assert s1.persisted is s2.persisted
+    # the duplicate's file is removed once it is fingerprinted
+    assert len(list(tmp_path.glob("*.bpk"))) == 1
+
+    s1.close()
+    s2.close()
+    assert not list(tmp_path.glob("*.bpk"))
+
+
+@mark.skipif(not hasattr(os, "posix_fadvise"), reason="fadvise not available")
+def test_persist_bpk_prefetch(monkeypatch: MonkeyPatch):
+    advised: list[int] = []
+    fadvise = os.posix_fadvise
+
+    def record(fd: int, offset: int, length: int, advice: int):
+        advised.append(advice)
+        fadvise(fd, offset, length, advice)
+
+    monkeypatch.setattr(os, "posix_fadvise", record)
+    matrix = np.random.randn(1000, 100)
+    with BPKContext(config=InvokeConfig(shm_prefault=True)) as ctx:
+        share = ctx.persist(matrix)
+        copy = pickle.loads(pickle.dumps(share))
+        assert np.all(copy.get() == matrix)
+        assert advised == [os.POSIX_FADV_WILLNEED]
+        copy.close()
+        share.close()
+
+
+def test_persist_shm_parallel(monkeypatch: MonkeyPatch):
+    if not SHM_AVAILABLE:
+        skip("shared memory not available")
+
+    # use small chunks so the copy is split across threads
+    monkeypatch.setattr(shm, "COPY_CHUNK", 4096)
+    matrix = np.random.randn(1000, 100)
+    data, buffers = shm.pickle_buffers(matrix)
+    share = shm.persist_buffers(data, buffers, threads=4)
+    try:
+        assert isinstance(share.pickle_data, shm.SHMBlock)
+        m2 = share.get()
+        assert np.all(m2 == matrix)
+        del m2
+    finally:
+        share.close()
+
+
+def test_persist_shm_aligned():
+    if not SHM_AVAILABLE:
+        skip("shared memory not available")
+
+    config = InvokeConfig(shm_align=mmap.PAGESIZE, shm_prefault=True, shm_huge_pages=True)
+    model = {"a": np.random.randn(100, 10), "b": np.arange(17, dtype=np.int8)}
+    with SHMContext(config) as ctx:
+        share = ctx.persist(model)
+        try:
+            assert all(bs % mmap.PAGESIZE == 0 for bs, _be in share.blocks)
+            m2 = pickle.loads(pickle.dumps(share))
+            assert m2.prefault
+            res = m2.get()
+            assert np.all(res["a"] == model["a"])
+            assert np.all(res["b"] == model["b"])
+            del res
+            m2.close()
+        finally:
+            share.close()
+
+
+def test_close_memory_in_use():
+    if not SHM_AVAILABLE:
+        skip("shared memory not available")
+
+    memory = SharedMemory(create=True, size=4096)
+    try:
+        array = np.frombuffer(memory.buf[:800], np.float64)
+        array[:] = 1.0
+        assert not shm._close_memory(memory)
+        # the array keeps the mapping alive
+        assert np.all(array == 1.0)
+
+        maps = Path("/proc/self/maps")
+        if maps.exists():
+            assert memory.name in maps.read_text()
+            del array
+            gc.collect()
+            assert memory.name not in maps.read_text()
+    finally:
+        memory.unlink()
+
+    memory = SharedMemory(create=True, size=4096)
+    memory.unlink()
+    assert shm._close_memory(memory)